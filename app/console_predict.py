@@ -2,16 +2,41 @@
 
 Usage:
     python app\console_predict.py --model models/baseline_tfidf_logreg.joblib
+    type messages.txt | python app\console_predict.py --model models/calibrated_model_full.tox > scores.jsonl
+    python app\console_predict.py --model models/calibrated_model_full.tox --format jsonl logs\chat.jsonl
 
-The script loads a saved sklearn pipeline (TF-IDF + classifier) and interacts via stdin.
+The script loads a saved sklearn pipeline (TF-IDF + classifier), a fused model or a
+serving artifact exported with scripts/export_fused.py. With a terminal on stdin
+it interacts line by line. When input files are given or stdin is a pipe it
+scores newline-delimited text or JSONL in batches and writes one JSON object
+per input line to stdout. `--window_words N` scores long messages by sliding
+windows and reports the most toxic span (see toxicity/windows.py).
 """
 import argparse
-import joblib
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import time
 
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
 
-def interactive(model_path):
+from toxicity.inference import predict_toxic_proba, score_texts_windowed
+from toxicity.model_io import load_model
+from toxicity.windows import add_window_args, window_config
+
+
+READ_BUFFER = 1 << 20
+_EOF = object()
+
+
+def interactive(model_path, windows=None):
     print('Loading model from', model_path)
-    model = joblib.load(model_path)
+    model = load_model(model_path)
     print('Model loaded. Enter text lines (empty line to exit).')
     while True:
         try:
@@ -21,19 +46,174 @@ def interactive(model_path):
         if not text or text.strip() == '':
             print('Exiting.')
             break
-        prob = None
-        try:
-            prob = model.predict_proba([text])[0][1]
-        except Exception:
-            pred = model.predict([text])[0]
-            prob = 1.0 if pred == 1 else 0.0
+        if windows is None:
+            prob, span = predict_toxic_proba(model, [text])[0], None
+        else:
+            probs, spans, _ = score_texts_windowed(model, [text], windows)
+            prob, span = probs[0], spans[0]
         pct = round(100 * prob, 1)
         label = 'TOXIC' if prob >= 0.5 else 'NOT_TOXIC'
         print(f'{label} (prob={pct}%)')
+        if span is not None and span[1] - span[0] < len(text):
+            print(f'  most toxic span [{span[0]}:{span[1]}]: {text[span[0]:span[1]]}')
+
+
+def open_input(path):
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace', newline=None)
+    return open(path, encoding='utf-8', errors='replace', buffering=READ_BUFFER)
+
+
+def parse_line(line, fmt, text_field):
+    """(record, text, error) for one non-blank input line; `record` is echoed in the output."""
+    if fmt == 'text':
+        return {'text': line}, line, None
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return None, None, f'invalid JSON: {e}'
+    if not isinstance(record, dict):
+        return None, None, 'JSON line is not an object'
+    text = record.get(text_field)
+    if text is None:
+        return None, None, f'missing field `{text_field}`'
+    return record, str(text), None
+
+
+def read_inputs(paths, fmt, text_field, out_queue):
+    """Parse every line of `paths` into `out_queue`, then put `_EOF`. Runs in a thread."""
+    try:
+        for path in paths:
+            with open_input(path) as f:
+                stream_fmt = fmt
+                for line in f:
+                    line = line.rstrip('\r\n')
+                    if not line.strip():
+                        # still one output record per input line
+                        out_queue.put((None, None, 'empty line'))
+                        continue
+                    if stream_fmt == 'auto':
+                        # decided by the first line: JSONL streams start with an object
+                        stream_fmt = 'jsonl' if line.lstrip().startswith('{') else 'text'
+                    out_queue.put(parse_line(line, stream_fmt, text_field))
+    except Exception as e:
+        out_queue.put((None, None, f'cannot read input: {e}'))
+    finally:
+        out_queue.put(_EOF)
+
+
+def collect_batch(in_queue, batch_size, batch_window):
+    """Up to `batch_size` parsed lines; returns early after `batch_window` seconds or at end of input.
+
+    The second value is True once the end of input has been reached.
+    """
+    batch = [in_queue.get()]
+    if batch[0] is _EOF:
+        return [], True
+    deadline = time.monotonic() + batch_window
+    while len(batch) < batch_size:
+        try:
+            item = in_queue.get_nowait()
+        except queue.Empty:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = in_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+        if item is _EOF:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+def score_batch(model, batch, threshold, windows=None):
+    """Encoded JSONL output lines for one batch, in input order.
+
+    With `windows` every record also gets `toxic_span`, the [start, end)
+    character offsets of its most toxic window.
+    """
+    texts = [text for _, text, error in batch if error is None]
+    spans = None
+    if not texts:
+        probs = []
+    elif windows is None:
+        probs = predict_toxic_proba(model, texts)
+    else:
+        probs, spans, _ = score_texts_windowed(model, texts, windows)
+    probs = iter(probs)
+    spans = iter(spans) if spans is not None else None
+    lines = []
+    for record, _, error in batch:
+        if error is not None:
+            out = {'error': error}
+        else:
+            prob = float(next(probs))
+            out = dict(record, toxic_proba=prob, toxic=int(prob >= threshold))
+            if spans is not None:
+                out['toxic_span'] = list(next(spans))
+        lines.append(json.dumps(out, ensure_ascii=False).encode('utf-8') + b'\n')
+    return b''.join(lines)
+
+
+def pipe(model_path, inputs, fmt='auto', text_field='text', batch_size=256, batch_window=0.05, threshold=0.5,
+         windows=None):
+    """Score every line of `inputs` (paths, '-' for stdin) and stream JSONL results to stdout.
+
+    Lines are read in a background thread. A batch is scored once `batch_size`
+    lines are collected or `batch_window` seconds after its first line, so a
+    slow log stream is still answered promptly while a file is scored at full
+    batch size.
+    """
+    t0 = time.perf_counter()
+    model = load_model(model_path)
+    print(f'Model loaded from {model_path} in {time.perf_counter() - t0:.2f}s', file=sys.stderr)
+
+    lines = queue.Queue(maxsize=4 * batch_size)
+    reader = threading.Thread(target=read_inputs, args=(inputs, fmt, text_field, lines), daemon=True)
+    reader.start()
+    out = sys.stdout.buffer
+    rows, errors = 0, 0
+    t0 = time.perf_counter()
+    done = False
+    try:
+        while not done:
+            batch, done = collect_batch(lines, batch_size, batch_window)
+            if not batch:
+                break
+            out.write(score_batch(model, batch, threshold, windows))
+            out.flush()
+            rows += len(batch)
+            errors += sum(1 for _, _, error in batch if error is not None)
+    except BrokenPipeError:
+        # the consumer (e.g. `head`) went away; stop quietly without a second error at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    elapsed = time.perf_counter() - t0
+    rate = rows / elapsed if elapsed > 0 else float('inf')
+    print(f'Scored {rows} lines ({errors} errors) in {elapsed:.1f}s ({rate:.0f} lines/s)', file=sys.stderr)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='*', help='Files to score in batch mode (`-` for stdin); default: stdin')
     parser.add_argument('--model', default='models/baseline_tfidf_logreg.joblib', help='Path to saved model')
+    parser.add_argument('--batch', action='store_true', help='Batch mode even when stdin is a terminal')
+    parser.add_argument('--format', choices=['auto', 'text', 'jsonl'], default='auto',
+                        help='Input lines: plain text or JSON objects (auto: decided by the first line)')
+    parser.add_argument('--text_field', default='text', help='Field with the message text in JSONL input')
+    parser.add_argument('--batch_size', type=int, default=256, help='Maximum lines per predict_proba call')
+    parser.add_argument('--batch_window_ms', type=float, default=50.0,
+                        help='Score a partial batch after waiting this long for more lines')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Threshold for the `toxic` output field')
+    add_window_args(parser)
     args = parser.parse_args()
-    interactive(args.model)
+    if args.batch_size < 1:
+        parser.error('--batch_size must be >= 1')
+
+    if args.inputs or args.batch or not sys.stdin.isatty():
+        pipe(args.model, args.inputs or ['-'], fmt=args.format, text_field=args.text_field, batch_size=args.batch_size,
+             batch_window=args.batch_window_ms / 1000.0, threshold=args.threshold, windows=window_config(args))
+    else:
+        interactive(args.model, window_config(args))
@@ -0,0 +1,287 @@
+"""Standalone HTTP scoring service with dynamic batching.
+
+Usage:
+    python app\score_server.py --model models/calibrated_model_full.tox --port 8080
+
+Endpoints (JSON in and out, HTTP/1.1 keep-alive):
+
+    POST /score        {"text": "..."}            -> {"toxic_proba": 0.93, "toxic": true}
+    POST /score_batch  {"texts": ["...", "..."]}  -> {"results": [{"toxic_proba": ..., "toxic": ...}, ...]}
+    GET  /healthz      liveness: 200 while the process serves requests
+    GET  /ready        readiness: 200 once the model is loaded and warmed up, 503 before
+
+The server starts listening right away and loads the model (any format
+accepted by `load_model`) in the background, so orchestrators can poll
+`/ready`. Texts from concurrent requests are merged by a `MicroBatcher` into
+one `predict_proba` call. At most `--max_concurrency` scoring requests are
+served at a time; further ones get 503 with `Retry-After` instead of queueing
+without bound. Only the standard library is used for HTTP.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.inference import MicroBatcher, ProcessPoolBatcher
+from toxicity.model_io import load_model, model_version
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 408: 'Request Timeout',
+    411: 'Length Required', 413: 'Payload Too Large', 431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error', 501: 'Not Implemented', 503: 'Service Unavailable',
+}
+MAX_HEADER_BYTES = 16 * 1024
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, close=False):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.close = close
+
+
+async def read_request(reader, max_body_bytes):
+    """(method, path, version, headers, body) of the next request, or None when the client closed the connection."""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400, 'incomplete request', close=True)
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, 'request headers too large', close=True)
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, path, version = lines[0].split(' ')
+    except ValueError:
+        raise HttpError(400, 'malformed request line', close=True)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise HttpError(501, 'chunked request bodies are not supported', close=True)
+    value = headers.get('content-length', '0')
+    try:
+        length = int(value)
+    except ValueError:
+        raise HttpError(400, 'invalid Content-Length', close=True)
+    # int() also takes signs, spaces and underscores, which a Content-Length must not have
+    if length < 0 or not value.isdigit():
+        raise HttpError(400, 'invalid Content-Length', close=True)
+    if length > max_body_bytes:
+        raise HttpError(413, f'request body larger than {max_body_bytes} bytes', close=True)
+    body = await reader.readexactly(length) if length else b''
+    return method, path.split('?', 1)[0], version, headers, body
+
+
+def wants_keep_alive(version, headers):
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+def encode_response(status, payload, keep_alive, extra_headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    lines = [
+        f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+        'Content-Type: application/json; charset=utf-8',
+        f'Content-Length: {len(body)}',
+        'Connection: ' + ('keep-alive' if keep_alive else 'close'),
+    ]
+    lines.extend(f'{name}: {value}' for name, value in extra_headers)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def parse_json(body):
+    try:
+        return json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HttpError(400, f'invalid JSON body: {e}')
+
+
+class ScoringServer:
+    def __init__(self, model_path, host='127.0.0.1', port=8080, workers=0, max_concurrency=64, max_batch_texts=1024,
+                 max_body_bytes=4 * 1024 * 1024, keepalive_timeout=30.0, threshold=0.5, **batcher_kwargs):
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be >= 1')
+        self.model_path = model_path
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.max_batch_texts = max_batch_texts
+        self.max_body_bytes = max_body_bytes
+        self.keepalive_timeout = keepalive_timeout
+        self.threshold = threshold
+        self.batcher_kwargs = batcher_kwargs
+        self.batcher = None
+        self.model_version = None
+        self.ready = False
+        self._server = None
+        self._inflight = 0
+
+    async def start(self):
+        """Start listening; the model is loaded by `load`."""
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info('Listening on http://%s:%d', self.host, self.port)
+
+    async def load(self):
+        """Load the model off the event loop, start the batcher and score a probe text."""
+        t0 = time.perf_counter()
+        model = await asyncio.get_running_loop().run_in_executor(None, load_model, self.model_path)
+        if self.workers > 0:
+            batcher = ProcessPoolBatcher(model, n_workers=self.workers, **self.batcher_kwargs)
+        else:
+            batcher = MicroBatcher(model, **self.batcher_kwargs)
+        await batcher.start()
+        if isinstance(batcher, ProcessPoolBatcher):
+            await batcher.warm_up()
+        else:
+            await batcher.predict('')
+        self.batcher = batcher
+        self.model_version = model_version(model)
+        self.ready = True
+        logger.info('Model %s loaded in %.2fs (version %s, processes=%d, max_batch_size=%d, batch_window=%.1fms)',
+                    self.model_path, time.perf_counter() - t0, self.model_version, self.workers,
+                    batcher.max_batch_size, batcher.batch_window * 1000)
+
+    async def stop(self):
+        self.ready = False
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self.batcher is not None:
+            await self.batcher.stop()
+            self.batcher = None
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await asyncio.wait_for(read_request(reader, self.max_body_bytes), self.keepalive_timeout)
+                    if request is None:
+                        break
+                    method, path, version, headers, body = request
+                    keep_alive = wants_keep_alive(version, headers)
+                    status, payload, extra = await self._dispatch(method, path, body)
+                except asyncio.TimeoutError:
+                    break
+                except HttpError as e:
+                    keep_alive = keep_alive and not e.close
+                    status, payload, extra = e.status, {'error': e.message}, ()
+                    if e.status == 503:
+                        extra = (('Retry-After', '1'),)
+                writer.write(encode_response(status, payload, keep_alive, extra))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, method, path, body):
+        if path == '/healthz':
+            return 200, {'status': 'ok'}, ()
+        if path == '/ready':
+            if not self.ready:
+                return 503, {'status': 'loading'}, (('Retry-After', '1'),)
+            return 200, {'status': 'ready', 'model': self.model_path, 'model_version': self.model_version}, ()
+        if path not in ('/score', '/score_batch'):
+            raise HttpError(404, f'unknown path {path}')
+        if method != 'POST':
+            raise HttpError(405, 'use POST')
+        if not self.ready:
+            raise HttpError(503, 'model is loading')
+        if self._inflight >= self.max_concurrency:
+            raise HttpError(503, 'too many concurrent requests')
+        data = parse_json(body)
+        self._inflight += 1
+        try:
+            if path == '/score':
+                if not isinstance(data, dict) or not isinstance(data.get('text'), str):
+                    raise HttpError(400, 'expected {"text": "..."}')
+                return 200, self._result(await self.batcher.predict(data['text'])), ()
+            texts = data.get('texts') if isinstance(data, dict) else None
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise HttpError(400, 'expected {"texts": ["...", ...]}')
+            if len(texts) > self.max_batch_texts:
+                raise HttpError(413, f'at most {self.max_batch_texts} texts per request')
+            probs = await asyncio.gather(*[self.batcher.predict(t) for t in texts])
+            return 200, {'results': [self._result(p) for p in probs]}, ()
+        except HttpError:
+            raise
+        except Exception as e:
+            logger.exception('scoring failed: %s', e)
+            raise HttpError(500, 'inference failed')
+        finally:
+            self._inflight -= 1
+
+    def _result(self, prob):
+        return {'toxic_proba': prob, 'toxic': prob >= self.threshold}
+
+
+async def serve(args):
+    server = ScoringServer(
+        args.model, host=args.host, port=args.port, workers=args.workers, max_concurrency=args.max_concurrency,
+        max_batch_texts=args.max_batch_texts, keepalive_timeout=args.keepalive_timeout, threshold=args.threshold,
+        max_batch_size=args.max_batch_size, batch_window=args.batch_window_ms / 1000.0,
+        max_queue_size=args.max_queue_size,
+    )
+    await server.start()
+    try:
+        try:
+            await server.load()
+        except Exception as e:
+            logger.error('Failed to load model %s: %s', args.model, e)
+            raise SystemExit(1)
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='models/calibrated_model.joblib', help='Path to joblib model or serving artifact')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (0 picks a free port)')
+    parser.add_argument('--batch_window_ms', type=float, default=5.0, help='How long to wait for more texts before scoring a batch')
+    parser.add_argument('--max_batch_size', type=int, default=64, help='Maximum number of texts scored in one predict_proba call')
+    parser.add_argument('--max_queue_size', type=int, default=4096, help='Maximum number of texts waiting for inference')
+    parser.add_argument('--workers', type=int, default=0, help='Number of scoring processes sharing a memory-mapped model (0 = score in a thread)')
+    parser.add_argument('--max_concurrency', type=int, default=64, help='Scoring requests served at once; more get 503')
+    parser.add_argument('--max_batch_texts', type=int, default=1024, help='Maximum texts in one /score_batch request')
+    parser.add_argument('--keepalive_timeout', type=float, default=30.0, help='Seconds an idle keep-alive connection stays open')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Threshold for the `toxic` field')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        logger.info('Stopped')
+
+
+if __name__ == '__main__':
+    main()
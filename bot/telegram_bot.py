@@ -1,6 +1,8 @@
 import argparse
+import asyncio
+import functools
 import os
-import joblib
+import sys
 import re
 import logging
 from dotenv import load_dotenv
@@ -13,10 +15,25 @@ from telegram.ext import (
     filters,
 )
 
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.admission import AdmissionController
+from toxicity.feature_cache import file_digest
+from toxicity.inference import MicroBatcher, ProcessPoolBatcher, predict_toxic_proba
+from toxicity.model_io import load_model as _load_any_model, model_version
+from toxicity.model_reload import ModelReloader, load_snapshot, remove_snapshot
+from toxicity.result_cache import ResultCache, token_key_function
+from toxicity.telemetry import MetricsRegistry, RequestTrace, dump_metrics_periodically, serve_metrics
+from toxicity.windows import add_window_args, window_config
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BUSY_TEXT = 'Слишком много запросов, попробуйте позже.'
+
 
 def _shorten(text: str, max_len: int = 400) -> str:
     if not text:
@@ -25,13 +42,15 @@ def _shorten(text: str, max_len: int = 400) -> str:
     return text if len(text) <= max_len else text[: max_len - 3] + '...'
 
 
-def _format_reply_with_text(text: str, prob: float, prefix: str = 'Это сообщение') -> str:
+def _format_reply_with_text(text: str, prob: float, prefix: str = 'Это сообщение', span=None) -> str:
     short = _shorten(text)
     pct = round(100 * float(prob), 1)
     if prob >= 0.5:
-        if short:
-            return f"Сообщение '{short}' токсично на {pct} процентов"
-        return f"Сообщение токсично на {pct} процентов"
+        reply = f"Сообщение '{short}' токсично на {pct} процентов" if short else f"Сообщение токсично на {pct} процентов"
+        # a long message scored by windows: point at the window that made it toxic
+        if span is not None and span[1] - span[0] < len(text):
+            reply += f"\nСамый токсичный фрагмент: '{_shorten(text[span[0]:span[1]])}'"
+        return reply
     else:
         if short:
             return f"Сообщение '{short}' не токсично"
@@ -42,41 +61,264 @@ def load_model(path):
     if not os.path.exists(path):
         raise RuntimeError(f'Model not found: {path}')
     try:
-        return joblib.load(path)
+        return _load_any_model(path)
+    except Exception as e:
+        raise RuntimeError(f'Failed to load model: {e}')
+
+
+def load_watched_model(path):
+    """(model, snapshot) for a model file watched by hot reload: an artifact is mapped from a private copy,
+    so rewriting the watched file cannot crash the bot."""
+    if not os.path.exists(path):
+        raise RuntimeError(f'Model not found: {path}')
+    try:
+        return load_snapshot(path)
     except Exception as e:
         raise RuntimeError(f'Failed to load model: {e}')
 
 
+class BotMetrics:
+    """Counters, histograms and gauges of the bot in the Prometheus text format.
+
+    Served on ``http://<metrics_host>:<metrics_port>/metrics`` and/or written to
+    `metrics_file` every `metrics_interval` seconds. Traces of requests slower
+    than `trace_slow_ms` are logged; all traces are logged at DEBUG level.
+    """
+
+    def __init__(self, batcher: MicroBatcher = None, cache: ResultCache = None, admission: AdmissionController = None,
+                 metrics_host='127.0.0.1', metrics_port=0, metrics_file=None, metrics_interval=15.0, trace_slow_ms=1000.0):
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.trace_slow = trace_slow_ms / 1000.0 if trace_slow_ms else None
+        self._server = None
+        self._dump_task = None
+        r = self.registry = MetricsRegistry('toxicity_bot_')
+        self.handled = r.counter('messages', 'Messages seen by a handler, by outcome', ['handler', 'outcome'])
+        self.reply_latency = r.histogram('reply_latency_seconds', 'From receiving the update to sending the reply', ['handler'])
+        self.update_lag = r.histogram('update_lag_seconds', 'From the Telegram message date to the start of its handler',
+                                      buckets=(0.5, 1, 2, 5, 10, 30, 60, 300))
+        self.text_length = r.histogram('text_length_chars', 'Length of the scored texts',
+                                       buckets=(16, 32, 64, 128, 256, 512, 1024, 4096))
+        self.predict_seconds = r.histogram('predict_seconds', 'predict_proba time of one batch')
+        self.queue_seconds = r.histogram('queue_wait_seconds', 'How long the oldest text of a batch waited for inference')
+        self.batch_size = r.histogram('batch_size', 'Texts per predict_proba call', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+        self.fallbacks = r.counter('predict_fallbacks', 'Batches scored with predict because predict_proba failed')
+        self.errors = r.counter('predict_errors', 'Batches whose scoring raised')
+        self.model_info = r.gauge('model_info', 'The model being served (always 1)', ['version', 'model_id'])
+        self.model_reloads = r.counter('model_reloads', 'Models swapped in without a restart')
+        if batcher is not None:
+            r.gauge('queue_depth', 'Texts waiting for inference', function=lambda: batcher.queue_depth)
+        if cache is not None:
+            r.gauge('cache_entries', 'Entries in the result cache', function=lambda: len(cache))
+            r.counter('cache_hits', 'Result cache hits', function=lambda: cache.hits)
+            r.counter('cache_misses', 'Result cache misses', function=lambda: cache.misses)
+        if admission is not None:
+            r.gauge('pending_requests', 'Admitted messages not yet scored', function=lambda: admission.pending)
+
+    def set_model(self, model, model_id):
+        self.model_info.clear()
+        self.model_info.labels(version=model_version(model) or '', model_id=(model_id or '')[:16]).set(1)
+
+    def on_batch(self, size, queue_seconds, predict_seconds, fallback, error):
+        self.batch_size.observe(size)
+        self.queue_seconds.observe(queue_seconds)
+        self.predict_seconds.observe(predict_seconds)
+        if fallback:
+            self.fallbacks.inc()
+        if error:
+            self.errors.inc()
+
+    def finish(self, trace: RequestTrace, msg):
+        self.handled.labels(trace.name, trace.outcome).inc()
+        elapsed = trace.elapsed()
+        if trace.outcome == 'replied':
+            self.reply_latency.labels(trace.name).observe(elapsed)
+        date = getattr(msg, 'date', None)
+        if date is not None:
+            self.update_lag.observe(max(0.0, trace.started_at - date.timestamp()))
+        if self.trace_slow is not None and elapsed >= self.trace_slow:
+            logger.warning('slow request: %s', trace.format())
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug('trace: %s', trace.format())
+
+    async def start(self):
+        if self.metrics_port:
+            self._server = await serve_metrics(self.registry, self.metrics_host, self.metrics_port)
+            logger.info('Metrics on http://%s:%d/metrics', self.metrics_host, self.metrics_port)
+        if self.metrics_file:
+            self._dump_task = asyncio.create_task(
+                dump_metrics_periodically(self.registry, self.metrics_file, self.metrics_interval))
+            logger.info('Writing metrics to %s every %.0fs', self.metrics_file, self.metrics_interval)
+
+    async def stop(self):
+        if self._dump_task is not None:
+            self._dump_task.cancel()
+            try:
+                await self._dump_task
+            except asyncio.CancelledError:
+                pass
+            self._dump_task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+def _instrumented(handler):
+    """Trace a handler and record its outcome (the handler's return value) in `bot_data['metrics']`."""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        metrics = context.bot_data.get('metrics')
+        if metrics is None:
+            return await handler(update, context)
+        trace = RequestTrace(handler.__name__, update.update_id)
+        try:
+            trace.outcome = await handler(update, context, trace)
+        except BaseException:
+            trace.outcome = 'exception'
+            raise
+        finally:
+            if trace.outcome != 'ignored':
+                trace.mark('reply')
+            metrics.finish(trace, update.message)
+        return trace.outcome
+
+    return wrapper
+
+
+def _window_position(windows, text, span):
+    """Index of `span` among the windows of `text`.
+
+    The result cache keeps this rather than character offsets, which would not
+    fit a text that shares the cache key but differs in case or spacing.
+    """
+    if windows is None or span is None:
+        return None
+    spans = windows.spans(text)
+    return spans.index(tuple(span)) if tuple(span) in spans else None
+
+
+def _window_span(windows, text, position):
+    if windows is None or position is None:
+        return None
+    spans = windows.spans(text)
+    return spans[position] if position < len(spans) else None
+
+
+async def _predict(context: ContextTypes.DEFAULT_TYPE, model, text: str, trace: RequestTrace = None):
+    """(P(toxic), most toxic span or None) of one text from the result cache, the shared micro-batcher,
+    or directly if neither is set up."""
+    metrics = context.bot_data.get('metrics')
+    if metrics is not None:
+        metrics.text_length.observe(len(text))
+    batcher = context.bot_data.get('batcher')
+    windows = getattr(batcher, 'windows', None)
+    cache = context.bot_data.get('result_cache')
+    if cache is not None:
+        key = cache.key(text)
+        model_id = cache.model_id
+        entry = cache.lookup(key)
+        if entry is not None:
+            if trace is not None:
+                trace.mark('cache_hit')
+            prob, position = entry
+            return prob, _window_span(windows, text, position)
+    span = None
+    if batcher is not None:
+        prob, span = await batcher.predict_with_span(text)
+    else:
+        prob = float(predict_toxic_proba(model, [text])[0])
+    if trace is not None:
+        trace.mark('score')
+    # a model reloaded while this text was scored has already cleared the cache
+    if cache is not None and cache.model_id == model_id:
+        cache.store(key, prob, _window_position(windows, text, span))
+    return prob, span
+
+
+async def _admit(context: ContextTypes.DEFAULT_TYPE, msg, dedupe_key=None):
+    """None if the message may be scored (then `_release` must follow), else the reason it was shed."""
+    admission = context.bot_data.get('admission')
+    if admission is None:
+        return None
+    chat_id = msg.chat.id
+    user = msg.from_user
+    reason = admission.try_admit(chat_id, user.id if user is not None else None, dedupe_key)
+    if reason is not None and admission.should_notify(chat_id, reason):
+        try:
+            await msg.reply_text(BUSY_TEXT)
+        except Exception as e:
+            logger.exception('failed to send busy reply: %s', e)
+    return reason
+
+
+def _release(context: ContextTypes.DEFAULT_TYPE):
+    admission = context.bot_data.get('admission')
+    if admission is not None:
+        admission.release()
+
+
+def _forget(context: ContextTypes.DEFAULT_TYPE, dedupe_key):
+    """Let repeated checks of a message be served again after its check failed to answer."""
+    admission = context.bot_data.get('admission')
+    if admission is not None:
+        admission.forget(dedupe_key)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Пришлите мне сообщение, и я скажу насколько оно токсично')
 
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text('/start - start\n/ping - health check\nПришлите мне сообщение в ответ на которое хотите получить оценку токсичности.')
+    await update.message.reply_text('/start - start\n/ping - health check\n/stats - result cache statistics\nПришлите мне сообщение в ответ на которое хотите получить оценку токсичности.')
 
 
 async def ping(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('pong')
 
 
-
-async def check_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lines = []
+    cache = context.bot_data.get('result_cache')
+    if cache is None:
+        lines.append('Кеш результатов выключен.')
+    else:
+        st = cache.stats()
+        lines.append(f"Кеш: {st['size']}/{st['max_size']}, попаданий {st['hits']}, промахов {st['misses']} "
+                     f"({100 * st['hit_rate']:.1f}%), вытеснено {st['evictions']}, устарело {st['expired']}")
+    batcher = context.bot_data.get('batcher')
+    admission = context.bot_data.get('admission')
+    if batcher is not None:
+        lines.append(f'Очередь инференса: {batcher.queue_depth}')
+    if admission is not None:
+        st = admission.stats()
+        shed = st['shed']
+        lines.append(f"В обработке: {st['pending']} (максимум {st['max_pending_seen']}), принято {st['admitted']}; "
+                     f"отброшено: дубликаты {shed['duplicate']}, лимит чата {shed['chat_rate']}, "
+                     f"лимит пользователя {shed['user_rate']}, перегрузка {shed['overloaded']}")
+    await update.message.reply_text('\n'.join(lines))
+
+
+@_instrumented
+async def check_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, trace: RequestTrace = None):
     msg = update.message
     if msg is None:
         logger.debug('check_reply_handler: no message')
-        return
+        return 'ignored'
     trigger_text = (msg.text or msg.caption or '')
     if msg.chat.type == 'private':
         logger.debug('check_reply_handler: private message received but will be handled by private handler')
-        return
+        return 'ignored'
 
     if not trigger_text or 'токс' not in trigger_text.lower():
         logger.debug('group message without trigger; ignoring')
-        return
+        return 'ignored'
 
     if msg.reply_to_message is None:
         logger.debug('trigger present but no reply target; ignoring')
-        return
+        return 'ignored'
 
     target = msg.reply_to_message
     text = target.text or target.caption or ''
@@ -85,7 +327,7 @@ async def check_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             await msg.reply_text('Нельзя проверить: сообщение не содержит текста.')
         except Exception as e:
             logger.exception('check_reply_handler: failed to send empty-target reply: %s', e)
-        return
+        return 'empty_target'
 
     model = context.bot_data.get('model')
     if model is None:
@@ -94,38 +336,45 @@ async def check_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         except Exception as e:
             logger.exception('check_reply_handler: failed to send model-missing reply: %s', e)
         logger.warning('check_reply_handler: model not loaded')
-        return
+        return 'no_model'
 
+    # repeated triggers on the same message are answered once
+    dedupe_key = (msg.chat.id, target.message_id)
+    shed = await _admit(context, msg, dedupe_key=dedupe_key)
+    if shed is not None:
+        return 'shed_' + shed
     try:
-        prob = model.predict_proba([text])[0][1]
+        prob, span = await _predict(context, model, text, trace)
     except Exception as e:
-        logger.exception('predict_proba failed in check handler: %s', e)
+        _forget(context, dedupe_key)
+        logger.exception('inference failed in check handler: %s', e)
         try:
-            pred = model.predict([text])[0]
-            prob = 1.0 if pred == 1 else 0.0
-        except Exception as e2:
-            logger.exception('predict fallback failed in check handler: %s', e2)
-            try:
-                await msg.reply_text('Ошибка при инференсе модели.')
-            except Exception:
-                pass
-            return
-
-    reply_text = _format_reply_with_text(text, prob)
+            await msg.reply_text('Ошибка при инференсе модели.')
+        except Exception:
+            pass
+        return 'error'
+    finally:
+        _release(context)
+
+    reply_text = _format_reply_with_text(text, prob, span=span)
     try:
         await msg.reply_text(reply_text)
     except Exception as e:
+        _forget(context, dedupe_key)
         logger.exception('check_reply_handler: failed to send result reply: %s', e)
+        return 'reply_failed'
+    return 'replied'
 
 
-async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@_instrumented
+async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, trace: RequestTrace = None):
     """Handle private (one-to-one) messages: respond to every text message with toxicity score."""
     msg = update.message
     if msg is None:
-        return
+        return 'ignored'
     text_in = (msg.text or msg.caption or '')
     if not text_in or text_in.startswith('/'):
-        return
+        return 'ignored'
 
     model = context.bot_data.get('model')
     if model is None:
@@ -133,48 +382,196 @@ async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_
             await msg.reply_text('Модель не загружена.')
         except Exception as e:
             logger.exception('private_message_handler: failed to send model-missing reply: %s', e)
-        return
+        return 'no_model'
 
+    shed = await _admit(context, msg)
+    if shed is not None:
+        return 'shed_' + shed
     try:
-        prob = model.predict_proba([text_in])[0][1]
+        prob, span = await _predict(context, model, text_in, trace)
     except Exception as e:
-        logger.exception('predict_proba failed in private handler: %s', e)
+        logger.exception('inference failed in private handler: %s', e)
         try:
-            pred = model.predict([text_in])[0]
-            prob = 1.0 if pred == 1 else 0.0
-        except Exception as e2:
-            logger.exception('predict fallback failed in private handler: %s', e2)
-            try:
-                await msg.reply_text('Ошибка при инференсе модели.')
-            except Exception:
-                pass
-            return
-
-    reply_text = _format_reply_with_text(text_in, prob)
+            await msg.reply_text('Ошибка при инференсе модели.')
+        except Exception:
+            pass
+        return 'error'
+    finally:
+        _release(context)
+
+    reply_text = _format_reply_with_text(text_in, prob, span=span)
     try:
         await msg.reply_text(reply_text)
     except Exception as e:
         logger.exception('private_message_handler: failed to send result reply: %s', e)
-
-
-def main():
+        return 'reply_failed'
+    return 'replied'
+
+
+def _make_model_swap(app, batcher: MicroBatcher, cache: ResultCache = None, metrics: BotMetrics = None):
+    async def swap(model, model_id):
+        # only swap_model awaits: the updates below run without handlers interleaving
+        await batcher.swap_model(model)
+        app.bot_data['model'] = model
+        if cache is not None:
+            cache.key_fn = token_key_function(model)
+            cache.bind_model(model_id)
+        if metrics is not None:
+            metrics.set_model(model, model_id)
+            metrics.model_reloads.inc()
+
+    return swap
+
+
+def _make_lifecycle_hooks(batcher: MicroBatcher, cache: ResultCache = None, cache_path: str = None,
+                          model_path: str = None, reload_interval: float = 0, metrics: BotMetrics = None,
+                          admission: AdmissionController = None, snapshot: str = None):
+    """post_init/post_shutdown hooks; `snapshot` is the private model copy from `load_snapshot`, removed at shutdown."""
+    reloader = None
+
+    async def post_init(app):
+        nonlocal reloader
+        if cache is not None:
+            if cache_path:
+                restored = cache.load(cache_path)
+                logger.info('Result cache: restored %d entries from %s', restored, cache_path)
+            app.bot_data['result_cache'] = cache
+        await batcher.start()
+        if isinstance(batcher, ProcessPoolBatcher):
+            await batcher.warm_up()
+        app.bot_data['batcher'] = batcher
+        logger.info('Inference worker started (processes=%d, max_batch_size=%d, batch_window=%.1fms, max_queue_size=%d)',
+                    getattr(batcher, 'n_workers', 0), batcher.max_batch_size, batcher.batch_window * 1000,
+                    batcher.max_queue_size)
+        if admission is not None:
+            app.bot_data['admission'] = admission
+        if metrics is not None:
+            app.bot_data['metrics'] = metrics
+            await metrics.start()
+        if model_path and reload_interval > 0:
+            reloader = ModelReloader(model_path, _make_model_swap(app, batcher, cache, metrics), interval=reload_interval,
+                                     snapshot=snapshot)
+            reloader.start()
+            logger.info('Watching %s for a new model every %.1fs', model_path, reload_interval)
+
+    async def post_shutdown(app):
+        if reloader is not None:
+            await reloader.stop()
+        app.bot_data.pop('batcher', None)
+        await batcher.stop()
+        if reloader is not None:
+            reloader.close()
+        else:
+            remove_snapshot(snapshot)
+        if metrics is not None:
+            await metrics.stop()
+        if cache is not None:
+            logger.info('Result cache stats: %s', cache.stats())
+            if cache_path:
+                cache.save(cache_path)
+                logger.info('Result cache: saved %d entries to %s', len(cache), cache_path)
+
+    return post_init, post_shutdown
+
+
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--token', default=None, help='Telegram bot token (or set TELEGRAM_TOKEN env var)')
     parser.add_argument('--model', default='models/calibrated_model.joblib', help='Path to calibrated model')
-    args = parser.parse_args()
+    parser.add_argument('--batch_window_ms', type=float, default=5.0, help='How long to wait for more messages before scoring a batch')
+    parser.add_argument('--max_batch_size', type=int, default=32, help='Maximum number of messages scored in one predict_proba call')
+    parser.add_argument('--max_queue_size', type=int, default=1024, help='Maximum number of messages waiting for inference')
+    parser.add_argument('--workers', type=int, default=0, help='Number of scoring processes sharing a memory-mapped model (0 = score in a thread of the bot process)')
+    parser.add_argument('--cache_size', type=int, default=10000, help='Maximum number of cached scores (0 disables the result cache)')
+    parser.add_argument('--cache_ttl', type=float, default=0, help='Seconds a cached score stays valid (0 = no expiry)')
+    parser.add_argument('--cache_path', default=None, help='Optional JSON file to persist the result cache across restarts')
+    parser.add_argument('--cache_squeeze_repeats', type=int, default=0, help='Squeeze runs of a repeated character to this length before caching (0 = off; approximate)')
+    parser.add_argument('--metrics_port', type=int, default=0, help='Serve Prometheus metrics on this port at /metrics (0 = off)')
+    parser.add_argument('--metrics_host', default='127.0.0.1', help='Interface of the metrics endpoint')
+    parser.add_argument('--metrics_file', default=None, help='Also write the metrics to this file (Prometheus text format)')
+    parser.add_argument('--metrics_interval', type=float, default=15.0, help='Seconds between writes of --metrics_file')
+    parser.add_argument('--no_metrics', action='store_true', help='Do not collect metrics and traces')
+    parser.add_argument('--trace_slow_ms', type=float, default=1000.0, help='Log the step timings of requests slower than this (0 = never)')
+    parser.add_argument('--chat_rate', type=float, default=1.0, help='Scoring requests per second allowed per chat (0 = unlimited)')
+    parser.add_argument('--chat_burst', type=int, default=5, help='Requests a chat may send at once before --chat_rate applies')
+    parser.add_argument('--user_rate', type=float, default=0.5, help='Scoring requests per second allowed per user (0 = unlimited)')
+    parser.add_argument('--user_burst', type=int, default=3, help='Requests a user may send at once before --user_rate applies')
+    parser.add_argument('--max_pending', type=int, default=256, help='Messages admitted for scoring at the same time; more are shed (0 = unlimited)')
+    parser.add_argument('--coalesce_window', type=float, default=60.0, help='Seconds during which repeated checks of the same replied-to message are answered once (0 = off)')
+    parser.add_argument('--shed_policy', choices=['drop', 'busy'], default='busy', help='Ignore shed messages, or reply that the bot is busy (once per --busy_notice_interval per chat)')
+    parser.add_argument('--busy_notice_interval', type=float, default=30.0, help='Minimum seconds between busy replies in one chat')
+    parser.add_argument('--reload_interval', type=float, default=5.0, help='Seconds between checks of the model file for a new version (0 disables hot reload)')
+    add_window_args(parser, default_words=64)
+    return parser
+
+
+def build_services(args, model):
+    """The micro-batcher, result cache, metrics and admission control configured by `args`."""
+    windows = window_config(args)
+    batcher_kwargs = dict(
+        max_batch_size=args.max_batch_size,
+        batch_window=args.batch_window_ms / 1000.0,
+        max_queue_size=args.max_queue_size,
+        windows=windows,
+    )
+    if args.workers > 0:
+        batcher = ProcessPoolBatcher(model, n_workers=args.workers, **batcher_kwargs)
+    else:
+        batcher = MicroBatcher(model, **batcher_kwargs)
+    model_id = file_digest(args.model)
+    cache = None
+    if args.cache_size > 0:
+        cache = ResultCache(
+            max_size=args.cache_size, ttl=args.cache_ttl, key_fn=token_key_function(model),
+            squeeze_repeats=args.cache_squeeze_repeats, model_id=model_id,
+            scoring=repr(windows) if windows is not None else None,
+        )
+    admission = AdmissionController(
+        chat_rate=args.chat_rate, chat_burst=args.chat_burst, user_rate=args.user_rate, user_burst=args.user_burst,
+        max_pending=args.max_pending, coalesce_window=args.coalesce_window, policy=args.shed_policy,
+        busy_notice_interval=args.busy_notice_interval,
+    )
+    metrics = None
+    if not args.no_metrics:
+        metrics = BotMetrics(batcher, cache, admission, metrics_host=args.metrics_host, metrics_port=args.metrics_port,
+                             metrics_file=args.metrics_file, metrics_interval=args.metrics_interval,
+                             trace_slow_ms=args.trace_slow_ms)
+        metrics.set_model(model, model_id)
+        batcher.on_batch = metrics.on_batch
+    return batcher, cache, metrics, admission
+
+
+def main():
+    args = build_parser().parse_args()
 
     load_dotenv()
 
     token = args.token or os.environ.get('TELEGRAM_TOKEN')
     if not token:
         raise RuntimeError('Telegram token missing: set TELEGRAM_TOKEN or pass --token')
-    model = load_model(args.model)
-
-    app = ApplicationBuilder().token(token).build()
+    snapshot = None
+    if args.reload_interval > 0:
+        model, snapshot = load_watched_model(args.model)
+    else:
+        model = load_model(args.model)
+    batcher, cache, metrics, admission = build_services(args, model)
+    post_init, post_shutdown = _make_lifecycle_hooks(batcher, cache, args.cache_path, args.model, args.reload_interval,
+                                                     metrics, admission, snapshot)
+
+    # Updates must be processed concurrently, otherwise there is nothing to batch
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.bot_data['model'] = model
     app.add_handler(CommandHandler('start', start))
     app.add_handler(CommandHandler('help', help_cmd))
     app.add_handler(CommandHandler('ping', ping))
+    app.add_handler(CommandHandler('stats', stats_cmd))
     # Handle private messages: respond to every text message in direct chats
     app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT, private_message_handler))
     app.add_handler(MessageHandler(filters.REPLY & filters.TEXT, check_reply_handler))
@@ -0,0 +1,229 @@
+"""Benchmark model load time, single-message latency, batched throughput and stage split.
+
+Usage:
+    python scripts/benchmark.py models/calibrated_model_full.tox --json_out bench.json
+    python scripts/benchmark.py models/calibrated_model_full.tox --input_csv data/ru_toxic/sample_small.csv
+    python scripts/benchmark.py models/new_model.tox --compare bench.json
+
+Reported numbers:
+- Cold load time and RSS, measured in a fresh interpreter.
+- p50/p95/p99 latency of scoring one message at a time, per text length.
+- Texts/s for several batch sizes.
+- Time spent in the vectorizer versus the classifier and calibration.
+
+Texts are synthetic Russian sentences of the given word counts, or the
+`text` column of a CSV. Results can be written as JSON, and `--compare`
+prints the change against an earlier JSON run.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import sklearn
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.pipeline import Pipeline
+
+from toxicity.dataio import read_table
+from toxicity.fused import FusedScorer
+from toxicity.inference import predict_toxic_proba
+from toxicity.model_io import load_model, model_version
+from toxicity.synthetic import synthetic_texts
+from toxicity.sysinfo import format_bytes
+
+
+_COLD_LOAD = '''
+import json, sys, time
+sys.path.insert(0, {root!r})
+from toxicity.sysinfo import rss_bytes
+rss_start = rss_bytes()
+t0 = time.perf_counter()
+from toxicity.model_io import load_model
+t1 = time.perf_counter()
+rss_imported = rss_bytes()
+model = load_model({path!r})
+t2 = time.perf_counter()
+print(json.dumps({{'import_seconds': t1 - t0, 'seconds': t2 - t1, 'rss_start': rss_start,
+                  'rss_imported': rss_imported, 'rss_after': rss_bytes()}}))
+'''
+
+
+def cold_load(model_path):
+    """Import time, load time and RSS of a fresh interpreter loading the model."""
+    code = _COLD_LOAD.format(root=REPO_ROOT, path=os.path.abspath(model_path))
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    if res['rss_imported'] is not None and res['rss_after'] is not None:
+        res['rss_model'] = res['rss_after'] - res['rss_imported']
+    return res
+
+
+def latency_percentiles(model, texts, warmup=20):
+    for t in texts[:warmup]:
+        predict_toxic_proba(model, [t])
+    times = np.empty(len(texts))
+    for i, t in enumerate(texts):
+        t0 = time.perf_counter()
+        predict_toxic_proba(model, [t])
+        times[i] = time.perf_counter() - t0
+    ms = times * 1000
+    return {
+        'n': len(texts),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+    }
+
+
+def throughput(model, texts, batch_size, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            predict_toxic_proba(model, texts[i:i + batch_size])
+        best = min(best, time.perf_counter() - t0)
+    return len(texts) / best
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+
+def stage_split(model, texts):
+    """Seconds spent vectorizing vs. classifying/calibrating `texts` in one batch, or None if unknown."""
+    if isinstance(model, FusedScorer):
+        counts, t_vec = _timed(model.transform, texts)
+        _, t_clf = _timed(model.proba_from_counts, counts)
+        return {'vectorize': t_vec, 'classify': t_clf}
+    if isinstance(model, Pipeline):
+        X, t_vec = _timed(model[:-1].transform, texts)
+        _, t_clf = _timed(model.steps[-1][1].predict_proba, X)
+        return {'vectorize': t_vec, 'classify': t_clf}
+    if isinstance(model, CalibratedClassifierCV) and hasattr(model, 'calibrated_classifiers_'):
+        t_vec = t_clf = 0.0
+        for cc in model.calibrated_classifiers_:
+            pipe = getattr(cc.estimator, 'estimator', cc.estimator)  # unwrap FrozenEstimator
+            if not isinstance(pipe, Pipeline):
+                return None
+            X, t = _timed(pipe[:-1].transform, texts)
+            t_vec += t
+            _, t = _timed(pipe.steps[-1][1].decision_function, X)
+            t_clf += t
+        # the calibrators and fold averaging are the rest of a full predict_proba
+        _, t_total = _timed(model.predict_proba, texts)
+        return {'vectorize': t_vec, 'classify': max(t_total - t_vec, t_clf)}
+    return None
+
+
+def flatten(results, prefix=''):
+    """Numeric leaves of the results as {'a.b.c': value}."""
+    flat = {}
+    for k, v in results.items():
+        name = f'{prefix}{k}'
+        if isinstance(v, dict):
+            flat.update(flatten(v, name + '.'))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            flat[name] = v
+    return flat
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    old, new = flatten(baseline), flatten(results)
+    print(f'\nComparison with {baseline_path} (model {baseline.get("model_version")} -> {results.get("model_version")}):')
+    print(f'{"metric":<40} {"before":>12} {"after":>12} {"change":>8}')
+    for name in sorted(set(old) & set(new)):
+        if '.' not in name or name.endswith('.n'):
+            continue
+        a, b = old[name], new[name]
+        change = f'{100 * (b - a) / a:+.1f}%' if a else 'n/a'
+        print(f'{name:<40} {a:>12.4g} {b:>12.4g} {change:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path', help='Path to a serving artifact or joblib model')
+    parser.add_argument('--input_csv', default=None, help='Use the `text` column of this CSV/Parquet/Arrow file instead of synthetic texts')
+    parser.add_argument('--lengths', default='5,20,80', help='Comma-separated word counts of synthetic texts')
+    parser.add_argument('--n_texts', type=int, default=1000, help='Texts per length (or taken from the CSV)')
+    parser.add_argument('--batch_sizes', default='1,8,32,128,512', help='Comma-separated batch sizes for throughput')
+    parser.add_argument('--repeats', type=int, default=3, help='Throughput runs per batch size (best is reported)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json_out', default=None, help='Optional path to write results as JSON')
+    parser.add_argument('--compare', default=None, help='Earlier JSON results to compare against')
+    args = parser.parse_args()
+
+    results = {
+        'model_path': args.model_path,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sklearn': sklearn.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+    print('Cold load...')
+    results['load'] = cold_load(args.model_path)
+    load = results['load']
+    print(f'  imports {load["import_seconds"] * 1000:.1f} ms, model {load["seconds"] * 1000:.1f} ms, '
+          f'RSS {format_bytes(load["rss_after"])} (model {format_bytes(load.get("rss_model"))})')
+
+    model = load_model(args.model_path)
+    results['model_type'] = type(model).__name__
+    results['model_version'] = model_version(model)
+
+    if args.input_csv:
+        texts = read_table(args.input_csv, columns=['text'])['text'].fillna('').astype(str).tolist()[: args.n_texts]
+        if not texts:
+            raise SystemExit('No texts found in ' + args.input_csv)
+        groups = {'csv': texts}
+    else:
+        groups = {f'{n}w': synthetic_texts(args.n_texts, int(n), seed=args.seed) for n in args.lengths.split(',')}
+
+    print('Single-message latency...')
+    results['latency'] = {}
+    for name, texts in groups.items():
+        res = latency_percentiles(model, texts)
+        results['latency'][name] = res
+        print(f'  {name:>5}: p50 {res["p50_ms"]:.3f} ms, p95 {res["p95_ms"]:.3f} ms, p99 {res["p99_ms"]:.3f} ms')
+
+    all_texts = [t for texts in groups.values() for t in texts]
+    print('Batched throughput...')
+    results['throughput'] = {}
+    for bs in (int(b) for b in args.batch_sizes.split(',')):
+        tps = throughput(model, all_texts, bs, args.repeats)
+        results['throughput'][f'batch_{bs}'] = tps
+        print(f'  batch {bs:>4}: {tps:,.0f} texts/s')
+
+    split = stage_split(model, all_texts)
+    if split is not None:
+        total = split['vectorize'] + split['classify']
+        results['stages'] = dict(split, vectorize_share=split['vectorize'] / total if total else 0.0)
+        print(f'Stage split on {len(all_texts)} texts: vectorize {split["vectorize"] * 1000:.1f} ms, '
+              f'classify+calibrate {split["classify"] * 1000:.1f} ms ({100 * results["stages"]["vectorize_share"]:.0f}% vectorize)')
+
+    if args.json_out:
+        d = os.path.dirname(args.json_out)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('Saved results to', args.json_out)
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
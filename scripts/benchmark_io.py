@@ -0,0 +1,58 @@
+"""Compare load time and size of a dataset stored as CSV, Parquet and Arrow IPC.
+
+Usage:
+    python scripts/benchmark_io.py data/ru_toxic/combined.csv
+
+The input is converted to each format in a temporary directory, then every
+file is read back `--repeats` times (all columns and only `text`, `label`)
+and the best wall time is printed.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.dataio import read_table, with_extension, write_table
+from toxicity.sysinfo import format_bytes
+
+
+def best_time(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_path', help='CSV/Parquet/Arrow file with `text` and `label` columns')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--keep_dir', default=None, help='Write converted files here instead of a temporary directory')
+    args = parser.parse_args()
+
+    df = read_table(args.input_path)
+    work_dir = args.keep_dir or tempfile.mkdtemp(prefix='toxicity-io-')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        print(f'{"format":>8} {"size":>10} {"read all":>10} {"text,label":>11}')
+        for fmt in ('csv', 'parquet', 'arrow'):
+            path = with_extension(os.path.join(work_dir, 'data'), fmt)
+            write_table(df, path)
+            t_all = best_time(lambda: read_table(path), args.repeats)
+            t_cols = best_time(lambda: read_table(path, columns=['text', 'label']), args.repeats)
+            print(f'{fmt:>8} {format_bytes(os.path.getsize(path)):>10} {t_all * 1000:>8.1f}ms {t_cols * 1000:>9.1f}ms')
+    finally:
+        if not args.keep_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Check that the vectorized label normalizer matches the old row-wise one and time both.
+
+Usage:
+    python scripts/benchmark_labels.py --trials 300 --n_rows 1000000
+
+First, random columns of every dtype `prepare_combined.py` can see are built
+from edge-case values: numbers around the 0.5/1/2 thresholds, inf and NaN,
+case and whitespace variants of the "toxic" strings, numeric strings, None/NA,
+and lists, tuples, dicts and arrays of mixed elements. `to_binary_label` must
+reproduce the old `Series.apply` implementation on all of them.
+
+The old function raised on lists whose length is not 1 and on multi-element
+arrays, and it returned 0 for any array. There the reference is the intended
+rule (toxic if any element equals 1), i.e. `label_value`. After the check,
+large synthetic columns are timed with both implementations.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.labels import label_value, to_binary_label
+
+
+def legacy_convert(x):
+    """The per-row rule `prepare_combined.to_binary_label` used before vectorization."""
+    if pd.isna(x):
+        return 0
+    if isinstance(x, (list, tuple)):
+        for v in x:
+            try:
+                if int(v) == 1:
+                    return 1
+            except Exception:
+                pass
+        return 0
+    if isinstance(x, dict):
+        for v in x.values():
+            try:
+                if int(v) == 1:
+                    return 1
+            except Exception:
+                pass
+        return 0
+    if isinstance(x, str):
+        if x.strip().lower() in ('1', 'true', 'yes', 'toxic', 'tox'):
+            return 1
+        try:
+            return 1 if float(x) > 0.5 else 0
+        except Exception:
+            return 0
+    try:
+        return 1 if int(x) == 1 else 0
+    except Exception:
+        try:
+            return 1 if float(x) > 0.5 else 0
+        except Exception:
+            return 0
+
+
+def legacy_to_binary_label(series):
+    return series.apply(legacy_convert)
+
+
+EDGE_FLOATS = [0.0, -0.0, 0.5, 0.5000001, 0.99, 1.0, 1.5, 1.999999, 2.0, -1.0, -0.5, 3.7, np.nan, np.inf, -np.inf]
+EDGE_STRINGS = [
+    '1', ' 1', '1 ', '0', 'TRUE', 'True', 'true ', 'Yes', ' yes', 'toxic', 'TOXIC', 'Tox', 'tox ic', 'no', 'False',
+    '0.6', '0.5', '0.50001', '1.0', '2', '-1', '1e0', '5e-1', 'nan', 'NaN', 'inf', '-inf', '1_0', '0x1', '+1', '01',
+    '', ' ', '\t1\n', 'abc', 'токсичный', '１', 'None', 'null',
+]
+
+
+def random_scalar(rng, kind):
+    if kind == 'int':
+        return int(rng.integers(-3, 4)) if rng.random() < 0.9 else int(rng.integers(-2 ** 62, 2 ** 62))
+    if kind == 'float':
+        return float(rng.choice(EDGE_FLOATS)) if rng.random() < 0.6 else float(rng.uniform(-3, 3))
+    if kind == 'bool':
+        return bool(rng.random() < 0.5)
+    if kind == 'str':
+        if rng.random() < 0.7:
+            return str(rng.choice(EDGE_STRINGS))
+        if rng.random() < 0.5:
+            return f'{rng.uniform(-2, 3):.3f}'
+        letters = rng.choice(list('abcXYZ tT1 0'), size=int(rng.integers(0, 8)))
+        return ''.join(letters)
+    if kind == 'missing':
+        return [None, np.nan, pd.NA][int(rng.integers(0, 3))]
+    raise ValueError(kind)
+
+
+def random_element(rng):
+    r = rng.random()
+    if r < 0.1:
+        return [int(rng.integers(0, 2))]
+    if r < 0.15:
+        return None
+    return random_scalar(rng, str(rng.choice(['int', 'float', 'bool', 'str'])))
+
+
+def random_container(rng):
+    items = [random_element(rng) for _ in range(int(rng.integers(0, 5)))]
+    kind = rng.choice(['list', 'tuple', 'dict', 'array'])
+    if kind == 'tuple':
+        return tuple(items)
+    if kind == 'dict':
+        return {f'k{i}': v for i, v in enumerate(items)}
+    if kind == 'array':
+        return np.array(rng.integers(0, 3, size=len(items)))
+    return items
+
+
+def random_column(rng, n):
+    """A random Series of one of the layouts raw datasets come in."""
+    layout = rng.choice(['int', 'float', 'bool', 'Int64', 'string', 'object_str', 'object_scalar', 'object_mixed'])
+    if layout == 'int':
+        return pd.Series([random_scalar(rng, 'int') for _ in range(n)], dtype=np.int64)
+    if layout == 'float':
+        return pd.Series([random_scalar(rng, 'float') for _ in range(n)], dtype=np.float64)
+    if layout == 'bool':
+        return pd.Series([random_scalar(rng, 'bool') for _ in range(n)], dtype=bool)
+    if layout == 'Int64':
+        return pd.Series([pd.NA if rng.random() < 0.2 else int(rng.integers(-1, 3)) for _ in range(n)], dtype='Int64')
+    if layout == 'string':
+        return pd.Series([pd.NA if rng.random() < 0.1 else random_scalar(rng, 'str') for _ in range(n)], dtype='string')
+    if layout == 'object_str':
+        return pd.Series([random_scalar(rng, 'missing') if rng.random() < 0.1 else random_scalar(rng, 'str') for _ in range(n)], dtype=object)
+    kinds = ['int', 'float', 'bool', 'str', 'missing']
+    values = []
+    for _ in range(n):
+        if layout == 'object_mixed' and rng.random() < 0.3:
+            values.append(random_container(rng))
+        else:
+            values.append(random_scalar(rng, str(rng.choice(kinds))))
+    index = rng.permutation(n) + 100  # non-default index must be preserved
+    return pd.Series(values, dtype=object, index=index)
+
+
+def reference_labels(series):
+    out, fallbacks = [], 0
+    for v in series:
+        if isinstance(v, np.ndarray):
+            out.append(label_value(v))
+            fallbacks += 1
+            continue
+        try:
+            out.append(legacy_convert(v))
+        except ValueError:
+            out.append(label_value(v))
+            fallbacks += 1
+    return np.asarray(out, dtype=np.int64), fallbacks
+
+
+def check_equivalence(trials, seed):
+    rng = np.random.default_rng(seed)
+    total_rows = total_fallbacks = 0
+    for t in range(trials):
+        series = random_column(rng, int(rng.integers(0, 200)))
+        expected, fallbacks = reference_labels(series)
+        got = to_binary_label(series)
+        if not got.index.equals(series.index):
+            raise SystemExit(f'Trial {t}: index not preserved')
+        if not np.array_equal(got.to_numpy(), expected):
+            bad = np.flatnonzero(got.to_numpy() != expected)[:5]
+            details = [(repr(series.iloc[i]), int(expected[i]), int(got.iloc[i])) for i in bad]
+            raise SystemExit(f'Trial {t} ({series.dtype}): mismatch (value, expected, got): {details}')
+        total_rows += len(series)
+        total_fallbacks += fallbacks
+    print(f'Equivalence OK: {trials} random columns, {total_rows} values '
+          f'({total_fallbacks} containers the old function could not handle)')
+
+
+def benchmark_columns(n, seed):
+    rng = np.random.default_rng(seed)
+    strings = np.array(['toxic', 'normal', '0', '1', 'True', 'no'], dtype=object)
+    tuples = [(int(a), int(b)) for a, b in rng.integers(0, 2, size=(n, 2))]
+    dicts = [{'insult': int(a), 'threat': int(b)} for a, b in rng.integers(0, 2, size=(n, 2))]
+    return {
+        'float': pd.Series(rng.random(n)),
+        'int': pd.Series(rng.integers(0, 2, n)),
+        'string': pd.Series(strings[rng.integers(0, len(strings), n)]),
+        'tuple': pd.Series(tuples, dtype=object),
+        'dict': pd.Series(dicts, dtype=object),
+    }
+
+
+def best_time(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trials', type=int, default=300, help='Number of random columns for the equivalence check')
+    parser.add_argument('--n_rows', type=int, default=1000000, help='Rows per benchmark column')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    check_equivalence(args.trials, args.seed)
+
+    print(f'{"column":>8} {"row-wise":>10} {"vectorized":>11} {"speedup":>8}')
+    for name, series in benchmark_columns(args.n_rows, args.seed).items():
+        if not np.array_equal(legacy_to_binary_label(series).to_numpy(), to_binary_label(series).to_numpy()):
+            raise SystemExit(f'Benchmark column {name}: results differ')
+        t_old = best_time(lambda: legacy_to_binary_label(series), args.repeats)
+        t_new = best_time(lambda: to_binary_label(series), args.repeats)
+        print(f'{name:>8} {t_old:>9.3f}s {t_new:>10.3f}s {t_old / t_new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
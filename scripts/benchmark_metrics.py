@@ -0,0 +1,139 @@
+"""Check `toxicity.metrics.BinaryMetrics` against scikit-learn and time it on large OOF-sized inputs.
+
+Usage:
+    python scripts/benchmark_metrics.py --trials 200 --n_rows 10000000
+
+The check draws random label/score arrays: few and many distinct scores,
+heavy ties, a single class, and scores of exactly 0, 1 and the threshold.
+On each one it compares accuracy/precision/recall/F1 at several thresholds,
+ROC AUC, average precision, Brier score, the ROC and PR curves and the
+confusion matrix with their scikit-learn counterparts. ECE is compared with
+the per-bin Python loop the analysis notebook used (with 1.0 in the last
+bin).
+
+Then it times one summary (as evaluate_model.py prints it) for n_rows
+scores: the separate sklearn calls vs `BinaryMetrics`, plus a threshold
+sweep and the bootstrap intervals.
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+from sklearn.exceptions import UndefinedMetricWarning
+from sklearn.metrics import (accuracy_score, average_precision_score, brier_score_loss, confusion_matrix, f1_score,
+                             precision_recall_curve, precision_score, recall_score, roc_auc_score, roc_curve)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.metrics import BinaryMetrics
+
+
+def loop_ece(y, p, n_bins=10):
+    """The analysis notebook's per-bin loop, with p == 1.0 counted in the last bin."""
+    bins = np.linspace(0.0, 1.0, n_bins + 1)
+    ece = 0.0
+    for i in range(n_bins):
+        upper_ok = p <= bins[i + 1] if i == n_bins - 1 else p < bins[i + 1]
+        mask = (p >= bins[i]) & upper_ok
+        if mask.sum() == 0:
+            continue
+        ece += mask.mean() * abs(p[mask].mean() - y[mask].mean())
+    return ece
+
+
+def random_case(rng):
+    n = int(rng.integers(1, 400))
+    kind = rng.integers(0, 4)
+    if kind == 0:
+        p = rng.random(n)
+    elif kind == 1:
+        p = rng.integers(0, 5, n) / 4.0  # heavy ties, exact 0, 0.5 and 1
+    elif kind == 2:
+        p = np.round(rng.random(n), 2)
+    else:
+        p = np.full(n, rng.random())
+    y = (rng.random(n) < rng.choice([0.0, 0.3, 0.5, 1.0], p=[0.1, 0.4, 0.4, 0.1])).astype(int)
+    return y, p
+
+
+def check_close(name, a, b, trial):
+    if not np.allclose(a, b, rtol=1e-9, atol=1e-12, equal_nan=True):
+        raise SystemExit(f'Trial {trial}: {name} differs: {a} vs {b}')
+
+
+def check_equivalence(trials, seed):
+    rng = np.random.default_rng(seed)
+    warnings.simplefilter('ignore', UndefinedMetricWarning)
+    for trial in range(trials):
+        y, p = random_case(rng)
+        m = BinaryMetrics(y, p)
+        for th in (0.0, 0.25, 0.5, 0.75, 1.0, float(rng.random())):
+            pred = (p >= th).astype(int)
+            got = m.at(th)
+            check_close(f'accuracy@{th}', got['accuracy'], accuracy_score(y, pred), trial)
+            check_close(f'precision@{th}', got['precision'], precision_score(y, pred, zero_division=0), trial)
+            check_close(f'recall@{th}', got['recall'], recall_score(y, pred, zero_division=0), trial)
+            check_close(f'f1@{th}', got['f1'], f1_score(y, pred, zero_division=0), trial)
+            check_close(f'confusion@{th}', m.confusion(th), confusion_matrix(y, pred, labels=[0, 1]).ravel(), trial)
+        check_close('brier', m.brier(), brier_score_loss(y, p), trial)
+        check_close('ece', m.ece(), loop_ece(y, p), trial)
+        if 0 < y.sum() < len(y):
+            check_close('roc_auc', m.roc_auc(), roc_auc_score(y, p), trial)
+            check_close('average_precision', m.average_precision(), average_precision_score(y, p), trial)
+            fpr, tpr, _ = roc_curve(y, p, drop_intermediate=False)
+            got_fpr, got_tpr, _ = m.roc_curve()
+            check_close('roc_curve', (got_fpr, got_tpr), (fpr, tpr), trial)
+            prec, rec, thr = precision_recall_curve(y, p, drop_intermediate=False)
+            got_prec, got_rec, got_thr = m.pr_curve()
+            check_close('pr_curve', (got_prec, got_rec), (prec, rec), trial)
+            check_close('pr_thresholds', got_thr, thr, trial)
+    print(f'Equivalence check passed on {trials} random cases')
+
+
+def sklearn_summary(y, p, threshold=0.5):
+    pred = (p >= threshold).astype(int)
+    return (accuracy_score(y, pred), precision_score(y, pred, zero_division=0), recall_score(y, pred, zero_division=0),
+            f1_score(y, pred, zero_division=0), roc_auc_score(y, p), brier_score_loss(y, p))
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trials', type=int, default=200, help='Number of random cases for the equivalence check')
+    parser.add_argument('--n_rows', type=int, default=10000000, help='Rows of the synthetic OOF scores to time')
+    parser.add_argument('--n_boot', type=int, default=200, help='Bootstrap replicates to time')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    check_equivalence(args.trials, args.seed)
+
+    rng = np.random.default_rng(args.seed)
+    y = (rng.random(args.n_rows) < 0.3).astype(np.int64)
+    p = np.clip(rng.normal(0.3 + 0.4 * y, 0.2), 0, 1)
+    print(f'\n{args.n_rows} rows:')
+    ref, t_sk = timed(lambda: sklearn_summary(y, p))
+    print(f'  sklearn, 6 separate calls:           {t_sk:7.2f}s')
+    m, t_sort = timed(lambda: BinaryMetrics(y, p))
+    got, t_sum = timed(lambda: m.summary())
+    print(f'  BinaryMetrics sort + cumsums:        {t_sort:7.2f}s')
+    print(f'  summary (incl. AUC, AP, ECE):        {t_sum:7.2f}s')
+    check_close('summary', [got[k] for k in ('accuracy', 'precision', 'recall', 'f1', 'roc_auc', 'brier')], ref, 'bench')
+    _, t = timed(lambda: (m.threshold_sweep(np.linspace(0, 1, 1001)), m.best_thresholds()))
+    print(f'  1001-threshold sweep + best table:   {t:7.2f}s')
+    ci, t = timed(lambda: m.bootstrap(n_boot=args.n_boot))
+    print(f'  bootstrap, {args.n_boot} replicates:          {t:7.2f}s')
+    print(ci.round(4).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
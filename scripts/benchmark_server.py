@@ -0,0 +1,197 @@
+"""Load-test the HTTP scoring service with concurrent keep-alive clients.
+
+Usage:
+    python scripts/benchmark_server.py --model models/calibrated_model_full.tox --concurrency 1,8,32
+    python scripts/benchmark_server.py --port 8080 --concurrency 16 --batch 32
+
+With `--model` a server (app/score_server.py) is started on a free port and
+stopped afterwards; otherwise an already running server at `--host`/`--port`
+is used. For every concurrency level the clients send `--requests` requests
+over persistent connections, each with one text (`/score`) or `--batch` texts
+(`/score_batch`), and request throughput, texts/s, latency percentiles and
+the count of every HTTP status are printed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.dataio import read_table
+from toxicity.synthetic import synthetic_texts
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection that reconnects when the server closes it."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def post(self, path, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f'POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\n\r\n').encode('latin-1')
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._writer.write(head + body)
+        await self._writer.drain()
+        status_line = await self._reader.readuntil(b'\r\n')
+        headers = {}
+        while True:
+            line = await self._reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        data = await self._reader.readexactly(int(headers.get('content-length', '0')))
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return int(status_line.split()[1]), data
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+            self._reader = self._writer = None
+
+
+async def run_level(host, port, texts, concurrency, n_requests, batch):
+    path = '/score' if batch == 1 else '/score_batch'
+    latencies = []
+    statuses = {}
+    counter = iter(range(n_requests))
+
+    async def client():
+        conn = Connection(host, port)
+        try:
+            for i in counter:
+                start = (i * batch) % len(texts)
+                chunk = [texts[(start + j) % len(texts)] for j in range(batch)]
+                payload = {'text': chunk[0]} if batch == 1 else {'texts': chunk}
+                t0 = time.perf_counter()
+                try:
+                    status, _ = await conn.post(path, payload)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    await conn.close()
+                    status = 'connection error'
+                latencies.append(time.perf_counter() - t0)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            await conn.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    ms = np.asarray(latencies) * 1000
+    ok = statuses.get(200, 0)
+    return {
+        'concurrency': concurrency,
+        'batch': batch,
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'requests_per_s': len(latencies) / elapsed,
+        'texts_per_s': ok * batch / elapsed,
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+        'statuses': {str(k): v for k, v in sorted(statuses.items(), key=str)},
+    }
+
+
+def wait_ready(host, port, proc=None, timeout=120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f'Server exited with code {proc.returncode}')
+        try:
+            with urllib.request.urlopen(f'http://{host}:{port}/ready', timeout=2) as resp:
+                return json.loads(resp.read())
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise SystemExit(f'Server at {host}:{port} not ready after {timeout:.0f}s')
+
+
+def free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def start_server(args):
+    cmd = [sys.executable, os.path.join(REPO_ROOT, 'app', 'score_server.py'), '--model', args.model,
+           '--host', args.host, '--port', str(args.port), '--workers', str(args.workers),
+           '--max_concurrency', str(args.max_concurrency)]
+    return subprocess.Popen(cmd)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=None, help='Start a server with this model; otherwise use a running one')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help='Server port (default: 8080, or a free port with --model)')
+    parser.add_argument('--workers', type=int, default=0, help='Scoring processes of the started server')
+    parser.add_argument('--max_concurrency', type=int, default=256, help='--max_concurrency of the started server')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated numbers of concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per concurrency level')
+    parser.add_argument('--batch', type=int, default=1, help='Texts per request (1 uses /score, more use /score_batch)')
+    parser.add_argument('--input_csv', default=None, help='Use the `text` column of this CSV/Parquet/Arrow file instead of synthetic texts')
+    parser.add_argument('--n_words', type=int, default=20, help='Words per synthetic text')
+    parser.add_argument('--json_out', default=None, help='Optional path to write results as JSON')
+    args = parser.parse_args()
+
+    if args.input_csv:
+        texts = read_table(args.input_csv, columns=['text'])['text'].fillna('').astype(str).tolist()
+    else:
+        texts = synthetic_texts(5000, args.n_words)
+
+    proc = None
+    if args.model:
+        if args.port is None:
+            args.port = free_port(args.host)
+        proc = start_server(args)
+    elif args.port is None:
+        args.port = 8080
+    try:
+        info = wait_ready(args.host, args.port, proc)
+        print(f'Server ready: {info}')
+        results = []
+        print(f'{"clients":>7} {"req/s":>9} {"texts/s":>9} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8}  statuses')
+        for c in [int(v) for v in args.concurrency.split(',') if v]:
+            res = asyncio.run(run_level(args.host, args.port, texts, c, args.requests, args.batch))
+            results.append(res)
+            print(f'{c:>7} {res["requests_per_s"]:>9.1f} {res["texts_per_s"]:>9.1f} {res["p50_ms"]:>8.2f} '
+                  f'{res["p90_ms"]:>8.2f} {res["p99_ms"]:>8.2f} {res["max_ms"]:>8.2f}  {res["statuses"]}')
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    if args.json_out:
+        d = os.path.dirname(args.json_out)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('Saved results to', args.json_out)
+
+
+if __name__ == '__main__':
+    main()
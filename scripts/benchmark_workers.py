@@ -0,0 +1,89 @@
+"""Measure bot scoring throughput and memory as the number of worker processes grows.
+
+Usage:
+    python scripts/benchmark_workers.py models/calibrated_model_full.joblib data/ru_toxic/sample_small.csv
+
+For each worker count from 1 up to the number of cores the texts are pushed
+through a ProcessPoolBatcher concurrently, the same way the bot does it, and
+throughput together with total RSS/PSS of the bot and worker processes is printed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.inference import ProcessPoolBatcher
+from toxicity.model_io import load_model
+from toxicity.sysinfo import format_bytes, pss_bytes, rss_bytes
+
+
+def _sum_memory(reader, pids):
+    values = [reader(pid) for pid in pids]
+    if any(v is None for v in values):
+        return None
+    return sum(values)
+
+
+async def run_one(model, texts, n_workers, max_batch_size, batch_window):
+    batcher = ProcessPoolBatcher(model, n_workers=n_workers, max_batch_size=max_batch_size,
+                                 batch_window=batch_window, max_queue_size=len(texts))
+    await batcher.start()
+    try:
+        await batcher.warm_up()
+        t0 = time.perf_counter()
+        await asyncio.gather(*[batcher.predict(t) for t in texts])
+        elapsed = time.perf_counter() - t0
+        pids = [os.getpid()] + batcher.worker_pids()
+        return {
+            'workers': n_workers,
+            'texts': len(texts),
+            'seconds': elapsed,
+            'throughput': len(texts) / elapsed if elapsed > 0 else float('inf'),
+            'rss_bytes': _sum_memory(rss_bytes, pids),
+            'pss_bytes': _sum_memory(pss_bytes, pids),
+        }
+    finally:
+        await batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path', help='Path to joblib model or serving artifact')
+    parser.add_argument('input_csv', help='CSV file with a `text` column')
+    parser.add_argument('--n_texts', type=int, default=5000, help='Number of texts to score per run')
+    parser.add_argument('--max_workers', type=int, default=os.cpu_count() or 1, help='Largest worker count to try')
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    parser.add_argument('--batch_window_ms', type=float, default=5.0)
+    parser.add_argument('--json_out', default=None, help='Optional path to write results as JSON')
+    args = parser.parse_args()
+
+    model = load_model(args.model_path)
+    df = pd.read_csv(args.input_csv, usecols=['text'])
+    texts = df['text'].fillna('').astype(str).tolist()
+    if not texts:
+        raise SystemExit('No texts found in ' + args.input_csv)
+    texts = (texts * (args.n_texts // len(texts) + 1))[: args.n_texts]
+
+    results = []
+    print(f'{"workers":>7} {"texts/s":>10} {"RSS total":>12} {"PSS total":>12}')
+    for n in range(1, max(1, args.max_workers) + 1):
+        res = asyncio.run(run_one(model, texts, n, args.max_batch_size, args.batch_window_ms / 1000.0))
+        results.append(res)
+        print(f'{n:>7} {res["throughput"]:>10.1f} {format_bytes(res["rss_bytes"]):>12} {format_bytes(res["pss_bytes"]):>12}')
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('Saved results to', args.json_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,29 @@
-import pandas as pd
-import numpy as np
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, brier_score_loss
+import argparse
+import os
 import sys
 
-path = sys.argv[1] if len(sys.argv) > 1 else 'data/ru_toxic/combined_oof.csv'
-print('Reading', path)
-df = pd.read_csv(path)
-if 'soft_label' not in df.columns or 'label' not in df.columns:
-    raise RuntimeError('CSV must contain columns: label, soft_label')
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.dataio import read_table
+from toxicity.metrics import BinaryMetrics, add_report_args, print_report, write_summary
 
-p = df['soft_label'].astype(float).values
-y = df['label'].astype(int).values
-th = 0.5
-pred = (p >= th).astype(int)
+parser = argparse.ArgumentParser()
+parser.add_argument('path', nargs='?', default='data/ru_toxic/combined_oof.csv', help='OOF file with `label` and `soft_label`')
+add_report_args(parser)
+args = parser.parse_args()
 
-acc = accuracy_score(y, pred)
-prec = precision_score(y, pred, zero_division=0)
-rec = recall_score(y, pred, zero_division=0)
-f1 = f1_score(y, pred, zero_division=0)
-auc = roc_auc_score(y, p) if len(np.unique(y)) > 1 else float('nan')
-brier = brier_score_loss(y, p)
+path = args.path
+print('Reading', path)
+try:
+    df = read_table(path, columns=['label', 'soft_label'])
+except (ValueError, KeyError):
+    raise RuntimeError('CSV must contain columns: label, soft_label')
 
-print(f'Accuracy: {acc:.4f}')
-print(f'Precision: {prec:.4f}')
-print(f'Recall: {rec:.4f}')
-print(f'F1-score: {f1:.4f}')
-print(f'ROC AUC: {auc:.4f}')
-print(f'Brier score: {brier:.4f}')
+metrics = BinaryMetrics(df['label'].astype(int).values, df['soft_label'].astype(float).values)
+print_report(metrics, threshold=args.threshold, n_bins=args.calibration_bins, sweep=args.sweep,
+             n_boot=args.bootstrap, seed=args.seed)
+if args.metrics_out:
+    write_summary(metrics, args.metrics_out, threshold=args.threshold, n_bins=args.calibration_bins, input=path)
+    print('Saved metrics to', args.metrics_out)
@@ -1,8 +1,34 @@
+"""Download HF datasets and write raw and standardized (`text`, `label`) tables per split.
+
+Usage:
+    python scripts/download_hf_datasets.py --outdir data/hf_raw --workers 4
+    python scripts/download_hf_datasets.py --offline            # only the local HF cache
+    python scripts/download_hf_datasets.py --local_dir stand_in  # <dataset>/<split>.{csv,parquet,arrow}
+
+Datasets are fetched concurrently, then every (dataset, split) pair is
+converted and standardized in a pool of worker processes. `manifest.json` in
+the output directory records a fingerprint of each source split and the
+content hashes of the files written for it. On rerun, splits whose source and
+outputs are unchanged are skipped, so an interrupted run resumes where it
+stopped.
+"""
 import os
+import sys
 import argparse
-from datasets import load_dataset
+import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import pandas as pd
 
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.dataio import is_table_file, read_table, with_extension, write_table
+from toxicity.feature_cache import file_digest
+
+
+MANIFEST = 'manifest.json'
 
 DATASET_IDS = [
     'AlexSham/Toxic_Russian_Comments',
@@ -70,49 +96,153 @@ def standardize_df(df: pd.DataFrame):
     return out
 
 
-def save_dataset(dataset_id: str, outdir: str):
-    print(f'Loading {dataset_id} ...')
+def _load_dataset(dataset_id, split=None):
+    # imported lazily so that --offline can set the HF environment variables first
+    from datasets import load_dataset
+    return load_dataset(dataset_id, split=split)
+
+
+def list_hf_splits(dataset_id):
+    """Fetch `dataset_id` into the HF cache and describe each split as a task."""
+    ds = _load_dataset(dataset_id)
+    splits = ds.items() if isinstance(ds, dict) else [(None, ds)]
+    return [
+        {'dataset': dataset_id, 'split': split or 'data', 'hf_split': split, 'fingerprint': d._fingerprint}
+        for split, d in splits
+    ]
+
+
+def list_local_splits(local_dir):
+    """Tasks for stand-in datasets laid out as `<local_dir>/<dataset>/<split>.<ext>`."""
+    tasks = []
+    for name in sorted(os.listdir(local_dir)):
+        base = os.path.join(local_dir, name)
+        if not os.path.isdir(base):
+            continue
+        for fn in sorted(os.listdir(base)):
+            if not is_table_file(fn) or fn.startswith('standardized'):
+                continue
+            p = os.path.join(base, fn)
+            tasks.append({'dataset': name, 'split': os.path.splitext(fn)[0], 'path': p, 'fingerprint': file_digest(p)})
+    return tasks
+
+
+def process_split(task, outdir, fmt):
+    """Write the raw and standardized tables of one split; returns its manifest entry."""
+    if 'path' in task:
+        df = read_table(task['path'])
+    else:
+        df = _load_dataset(task['dataset'], split=task['hf_split']).to_pandas()
+    base = os.path.join(outdir, task['dataset'].replace('/', '_'))
+    ensure_dir(base)
+
+    outputs = {}
+    p = with_extension(os.path.join(base, task['split']), fmt)
+    write_table(df, p)
+    outputs[os.path.relpath(p, outdir)] = file_digest(p)
+    std = standardize_df(df)
+    if std is not None:
+        sp = with_extension(os.path.join(base, f'standardized_{task["split"]}'), fmt)
+        write_table(std, sp)
+        outputs[os.path.relpath(sp, outdir)] = file_digest(sp)
+    return {
+        'fingerprint': task['fingerprint'],
+        'format': fmt,
+        'rows': len(df),
+        'standardized_rows': None if std is None else len(std),
+        'outputs': outputs,
+    }
+
+
+def task_key(task):
+    return f'{task["dataset"]}/{task["split"]}'
+
+
+def load_manifest(outdir):
     try:
-        ds = load_dataset(dataset_id)
-    except Exception as e:
-        print(f'Failed to load {dataset_id}:', e)
-        return
+        with open(os.path.join(outdir, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'splits': {}}
 
-    base = os.path.join(outdir, dataset_id.replace('/', '_'))
-    ensure_dir(base)
 
-    if isinstance(ds, dict):
-        for split, d in ds.items():
-            df = pd.DataFrame(d)
-            p = os.path.join(base, f'{split}.csv')
-            df.to_csv(p, index=False)
-            print('Saved', p, 'rows=', len(df))
-            std = standardize_df(df)
-            if std is not None:
-                std.to_csv(os.path.join(base, 'standardized.csv'), index=False)
-    else:
-        df = pd.DataFrame(ds)
-        p = os.path.join(base, 'data.csv')
-        df.to_csv(p, index=False)
-        print('Saved', p, 'rows=', len(df))
-        std = standardize_df(df)
-        if std is not None:
-            std.to_csv(os.path.join(base, 'standardized.csv'), index=False)
+def save_manifest(outdir, manifest):
+    fd, tmp = tempfile.mkstemp(dir=outdir, suffix='.json')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(outdir, MANIFEST))
+
+
+def is_up_to_date(entry, task, outdir, fmt):
+    if not entry or entry.get('fingerprint') != task['fingerprint'] or entry.get('format') != fmt:
+        return False
+    for rel, digest in entry['outputs'].items():
+        p = os.path.join(outdir, rel)
+        if not os.path.exists(p) or file_digest(p) != digest:
+            return False
+    return True
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--outdir', default='data/hf_raw', help='Output directory for downloaded datasets')
     parser.add_argument('--which', nargs='*', default=None, help='Optional list of dataset IDs to download (overrides default list)')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default='csv', help='File format for saved splits')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help='Parallel downloads and split conversions')
+    parser.add_argument('--offline', action='store_true', help='Use only datasets already in the local HF cache')
+    parser.add_argument('--local_dir', default=None, help='Read stand-in datasets from <local_dir>/<dataset>/<split>.<ext> instead of HF')
+    parser.add_argument('--force', action='store_true', help='Reprocess every split even if the manifest says it is up to date')
     args = parser.parse_args()
 
+    if args.offline:
+        os.environ['HF_DATASETS_OFFLINE'] = '1'
+        os.environ['HF_HUB_OFFLINE'] = '1'
     ensure_dir(args.outdir)
-    ids = args.which if args.which else DATASET_IDS
-    for did in ids:
-        try:
-            save_dataset(did, args.outdir)
-        except Exception as e:
-            print('Error processing', did, e)
+    workers = max(1, args.workers)
+
+    if args.local_dir:
+        tasks = list_local_splits(args.local_dir)
+    else:
+        ids = args.which if args.which else DATASET_IDS
+        tasks = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(list_hf_splits, did): did for did in ids}
+            for fut in as_completed(futures):
+                try:
+                    tasks.extend(fut.result())
+                except Exception as e:
+                    print(f'Failed to load {futures[fut]}:', e)
+        tasks.sort(key=task_key)
+
+    manifest = load_manifest(args.outdir)
+    todo = []
+    for task in tasks:
+        if not args.force and is_up_to_date(manifest['splits'].get(task_key(task)), task, args.outdir, args.format):
+            print('Up to date:', task_key(task))
+        else:
+            todo.append(task)
+    print(f'{len(todo)} of {len(tasks)} splits to process')
+
+    def record(task, entry):
+        manifest['splits'][task_key(task)] = entry
+        save_manifest(args.outdir, manifest)
+        print('Saved', task_key(task), 'rows=', entry['rows'], 'standardized=', entry['standardized_rows'])
+
+    if workers == 1 or len(todo) <= 1:
+        for task in todo:
+            try:
+                record(task, process_split(task, args.outdir, args.format))
+            except Exception as e:
+                print('Error processing', task_key(task), e)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+        futures = {pool.submit(process_split, task, args.outdir, args.format): task for task in todo}
+        for fut in as_completed(futures):
+            task = futures[fut]
+            try:
+                record(task, fut.result())
+            except Exception as e:
+                print('Error processing', task_key(task), e)
 
 
 if __name__ == '__main__':
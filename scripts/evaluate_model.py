@@ -1,51 +1,100 @@
 import argparse
+import os
 import sys
-import joblib
-import pandas as pd
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, brier_score_loss, classification_report
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.dataio import read_table
+from toxicity.feature_cache import FeatureCache, arrays_to_csr, csr_to_arrays
+from toxicity.fused import fuse_calibrated, vectorizer_fingerprint
+from toxicity.inference import chunk_texts, predict_toxic_proba
+from toxicity.metrics import BinaryMetrics, add_report_args, print_report, write_summary
+from toxicity.model_io import load_model
+from toxicity.windows import add_window_args, window_config
+
+
+def read_test_csv(path):
+    try:
+        return read_table(path, columns=['text', 'label'])
+    except (ValueError, KeyError):
+        print('Test CSV must contain `text` and `label` columns')
+        sys.exit(2)
+
+
+def as_fused(model):
+    """The model itself if it scores from counts, its fused form if it can be fused, else None."""
+    if hasattr(model, 'proba_from_counts'):
+        return model
+    try:
+        return fuse_calibrated(model)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_counts(path, scorer, cache):
+    """Labels and term counts of the test CSV for `scorer`, from the feature cache when possible."""
+    if cache is not None:
+        # 'missing' marks entries built from chunk_texts, which maps missing texts to ''
+        key = cache.make_key(path, {'kind': 'fused_counts', 'vocabulary': vectorizer_fingerprint(scorer.vectorizer),
+                                    'missing': 'empty'})
+        hit = cache.get(key)
+        if hit is not None:
+            arrays, _ = hit
+            print('Loaded test features from cache', key)
+            return np.asarray(arrays['labels']), arrays_to_csr('counts', arrays)
+
+    df = read_test_csv(path)
+    y = df['label'].astype(int).values
+    counts = scorer.vectorizer.transform(chunk_texts(df))
+    if cache is not None:
+        arrays = csr_to_arrays('counts', counts)
+        arrays['labels'] = y
+        cache.put(key, arrays, {'input': os.path.abspath(path), 'rows': len(y)})
+    return y, counts
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('model_path', help='Path to joblib model (supports predict_proba or predict)')
-    parser.add_argument('test_csv', help='CSV file with columns `text` and `label`')
-    parser.add_argument('--threshold', type=float, default=0.5, help='Decision threshold for converting probs to labels')
+    parser.add_argument('model_path', help='Path to joblib model or serving artifact (supports predict_proba or predict)')
+    parser.add_argument('test_csv', help='CSV/Parquet/Arrow file with columns `text` and `label`')
+    parser.add_argument('--cache_dir', default='data/feature_cache', help='Directory of the persistent feature cache')
+    parser.add_argument('--cache_max_mb', type=int, default=4096, help='Size limit of the feature cache; least recently used entries are evicted')
+    parser.add_argument('--no_cache', action='store_true', help='Do not read or write the feature cache')
+    add_report_args(parser)
+    add_window_args(parser)
     args = parser.parse_args()
 
-    model = joblib.load(args.model_path)
-    df = pd.read_csv(args.test_csv)
-    if 'text' not in df.columns or 'label' not in df.columns:
-        print('Test CSV must contain `text` and `label` columns')
-        sys.exit(2)
+    model = load_model(args.model_path)
+    windows = window_config(args)
+    # Fused TF-IDF models tokenize each text once; their count matrices are
+    # cached on disk keyed by the CSV content and the model vocabulary.
+    # Window scoring vectorizes windows, not whole texts, so it skips that path.
+    scorer = as_fused(model) if windows is None else None
+    if scorer is not None:
+        cache = None if args.no_cache else FeatureCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+        y, counts = load_counts(args.test_csv, scorer, cache)
+        probs = scorer.proba_from_counts(counts)
+        report(y, probs, args)
+        return
 
-    texts = df['text'].astype(str).tolist()
+    df = read_test_csv(args.test_csv)
     y = df['label'].astype(int).values
+    probs = predict_toxic_proba(model, chunk_texts(df), windows)
 
-    try:
-        probs = model.predict_proba(texts)[:,1]
-    except Exception:
-        preds_raw = model.predict(texts)
-        if hasattr(preds_raw[0], '__iter__'):
-            try:
-                probs = [p[1] for p in preds_raw]
-            except Exception:
-                probs = [1.0 if p==1 else 0.0 for p in preds_raw]
-        else:
-            probs = [1.0 if p==1 else 0.0 for p in preds_raw]
-
-    preds = [1 if pr >= args.threshold else 0 for pr in probs]
-
-    print('Accuracy:', accuracy_score(y, preds))
-    print('Precision:', precision_score(y, preds, zero_division=0))
-    print('Recall:', recall_score(y, preds, zero_division=0))
-    print('F1:', f1_score(y, preds, zero_division=0))
-    try:
-        print('ROC AUC:', roc_auc_score(y, probs))
-    except Exception:
-        pass
-    print('Brier score:', brier_score_loss(y, probs))
-    print('\nClassification report:\n')
-    print(classification_report(y, preds, zero_division=0))
+    report(y, probs, args)
+
+
+def report(y, probs, args):
+    metrics = BinaryMetrics(y, probs)
+    print_report(metrics, threshold=args.threshold, n_bins=args.calibration_bins, per_class=True,
+                 sweep=args.sweep, n_boot=args.bootstrap, seed=args.seed)
+    if args.metrics_out:
+        write_summary(metrics, args.metrics_out, threshold=args.threshold, n_bins=args.calibration_bins,
+                      model=args.model_path, input=args.test_csv)
+        print('Saved metrics to', args.metrics_out)
 
 
 if __name__ == '__main__':
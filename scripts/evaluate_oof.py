@@ -1,31 +1,33 @@
 import argparse
-import pandas as pd
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, brier_score_loss
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.dataio import read_table
+from toxicity.metrics import BinaryMetrics, add_report_args, print_report, write_summary
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--oof_csv', required=True, help='Path to CSV with `text`, `label`, `soft_label`')
-    parser.add_argument('--threshold', type=float, default=0.5, help='Threshold for converting soft_label to predicted labels')
+    parser.add_argument('--oof_csv', required=True, help='Path to CSV/Parquet/Arrow file with `label`, `soft_label`')
+    add_report_args(parser)
     args = parser.parse_args()
 
-    df = pd.read_csv(args.oof_csv)
-    if not {'label','soft_label'}.issubset(df.columns):
+    try:
+        df = read_table(args.oof_csv, columns=['label', 'soft_label'])
+    except (ValueError, KeyError):
         raise SystemExit('CSV must contain columns `label` and `soft_label`')
 
-    y_true = df['label'].astype(int).values
-    probs = df['soft_label'].astype(float).values
-    preds = (probs >= args.threshold).astype(int)
-
-    print('Accuracy:', accuracy_score(y_true, preds))
-    print('Precision:', precision_score(y_true, preds, zero_division=0))
-    print('Recall:', recall_score(y_true, preds, zero_division=0))
-    print('F1:', f1_score(y_true, preds, zero_division=0))
-    try:
-        print('ROC AUC:', roc_auc_score(y_true, probs))
-    except Exception:
-        pass
-    print('Brier Score:', brier_score_loss(y_true, probs))
+    metrics = BinaryMetrics(df['label'].astype(int).values, df['soft_label'].astype(float).values)
+    print_report(metrics, threshold=args.threshold, n_bins=args.calibration_bins, sweep=args.sweep,
+                 n_boot=args.bootstrap, seed=args.seed)
+    if args.metrics_out:
+        write_summary(metrics, args.metrics_out, threshold=args.threshold, n_bins=args.calibration_bins,
+                      input=args.oof_csv)
+        print('Saved metrics to', args.metrics_out)
 
 
 if __name__ == '__main__':
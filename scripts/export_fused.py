@@ -0,0 +1,71 @@
+"""Convert a trained calibrated TF-IDF + LR model into the fused serving form.
+
+Usage:
+    python scripts/export_fused.py models/calibrated_model_full.joblib models/fused_model.joblib \
+        --check_csv data/ru_toxic/sample_small.csv
+    python scripts/export_fused.py models/calibrated_model_full.joblib models/calibrated_model_full.tox \
+        --format artifact
+
+`--format fused` pickles the FusedScorer with joblib; `--format artifact` writes
+the memory-mapped serving artifact (see toxicity/artifact.py).
+"""
+import argparse
+import os
+import sys
+
+import joblib
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.artifact import load_artifact, write_artifact
+from toxicity.fused import fuse_calibrated, max_abs_diff
+from toxicity.model_io import dump_model
+
+
+def ensure_dir(path):
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path', help='Path to joblib CalibratedClassifierCV model')
+    parser.add_argument('out_path', help='Where to save the fused model')
+    parser.add_argument('--format', choices=['fused', 'artifact'], default='fused', help='Output format')
+    parser.add_argument('--check_csv', default=None, help='Optional CSV with a `text` column to compare scores on')
+    parser.add_argument('--check_rows', type=int, default=5000, help='Number of rows of --check_csv to compare')
+    parser.add_argument('--tolerance', type=float, default=1e-6, help='Maximum allowed absolute probability difference')
+    args = parser.parse_args()
+
+    model = joblib.load(args.model_path)
+    fused = fuse_calibrated(model)
+    print(f'Fused {fused.n_folds} folds into {fused.coef_.shape[0]} shared features')
+
+    if args.check_csv:
+        texts = pd.read_csv(args.check_csv, usecols=['text'], nrows=args.check_rows)['text'].fillna('').astype(str).tolist()
+        diff = max_abs_diff(model, fused, texts)
+        print(f'Max abs probability difference on {len(texts)} texts: {diff:.3g}')
+        if diff > args.tolerance:
+            raise SystemExit(f'Fused model differs from the original by {diff:.3g} > {args.tolerance}')
+
+    ensure_dir(args.out_path)
+    if args.format == 'artifact':
+        version = write_artifact(fused, args.out_path)
+        if args.check_csv:
+            diff = max_abs_diff(model, load_artifact(args.out_path), texts)
+            if diff > args.tolerance:
+                raise SystemExit(f'Serving artifact differs from the original by {diff:.3g} > {args.tolerance}')
+        print('Saved serving artifact to', args.out_path, '(version', version + ')',
+              f'({os.path.getsize(args.out_path)} bytes, original {os.path.getsize(args.model_path)} bytes)')
+        return
+    dump_model(fused, args.out_path)
+    print('Saved fused model to', args.out_path,
+          f'({os.path.getsize(args.out_path)} bytes, original {os.path.getsize(args.model_path)} bytes)')
+
+
+if __name__ == '__main__':
+    main()
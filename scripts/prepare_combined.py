@@ -1,8 +1,20 @@
 import argparse
 import os
+import sys
 from datasets import load_dataset
 import pandas as pd
 
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.dataio import TableWriter, is_table_file, iter_batches, read_table, with_extension, write_table
+from toxicity.dedup import KEEP, STATUS_NAMES, DedupIndex
+from toxicity.labels import to_binary_label
+from toxicity.profiling import add_profile_args, annotate, iter_stage, profiling, stage
+from toxicity.sampling import ReservoirSampler
+from toxicity.sysinfo import format_bytes, peak_rss_bytes
+
 
 HF_IDS = [
     "AlexSham/Toxic_Russian_Comments",
@@ -30,118 +42,239 @@ def detect_label_column(df):
     raise ValueError('No label column found')
 
 
-def to_binary_label(series):
-    def convert(x):
-        if pd.isna(x):
-            return 0
-        if isinstance(x, (list, tuple)):
-            for v in x:
-                try:
-                    if int(v) == 1:
-                        return 1
-                except Exception:
-                    pass
-            return 0
-        if isinstance(x, dict):
-            for v in x.values():
-                try:
-                    if int(v) == 1:
-                        return 1
-                except Exception:
-                    pass
-            return 0
-        if isinstance(x, str):
-            if x.strip().lower() in ('1', 'true', 'yes', 'toxic', 'tox'):
-                return 1
-            try:
-                return 1 if float(x) > 0.5 else 0
-            except Exception:
-                return 0
-        try:
-            return 1 if int(x) == 1 else 0
-        except Exception:
-            try:
-                return 1 if float(x) > 0.5 else 0
-            except Exception:
-                return 0
+def normalize_part(df, text_col, label_col, source):
+    df2 = df[[text_col, label_col]].rename(columns={text_col: 'text', label_col: 'label_raw'})
+    with stage('labels'):
+        df2['label'] = to_binary_label(df2['label_raw'])
+    df2['source'] = source
+    return df2[['text', 'label', 'source']]
+
+
+def drop_empty_texts(df):
+    df = df.copy()
+    df['text'] = df['text'].fillna('').astype(str)
+    return df[df['text'].str.strip() != '']
+
+
+def local_sources(input_dir):
+    """(path, source name) of every table file below `input_dir`, in sorted order."""
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for fn in sorted(files):
+            if not is_table_file(fn):
+                continue
+            rel = os.path.relpath(root, input_dir)
+            yield os.path.join(root, fn), os.path.splitext(fn)[0] if rel == '.' else rel.replace(os.sep, '_')
 
-    return series.apply(convert)
+
+def hf_split(ds):
+    if hasattr(ds, 'keys') and 'train' in ds.keys():
+        return ds['train']
+    if hasattr(ds, 'keys'):
+        return ds[list(ds.keys())[0]]
+    return ds
 
 
 def load_and_concat(hf_ids, input_dir=None):
     parts = []
     if input_dir:
-        print('Loading local CSVs from', input_dir)
-        for root, _, files in os.walk(input_dir):
-            for fn in files:
-                if not fn.lower().endswith('.csv'):
-                    continue
-                p = os.path.join(root, fn)
-                try:
-                    df = pd.read_csv(p)
-                except Exception as e:
-                    print('Failed to read', p, e)
-                    continue
-                try:
-                    text_col = detect_text_column(df)
-                    label_col = detect_label_column(df)
-                except Exception as e:
-                    print('Skipping', p, 'due to', e)
-                    continue
-                df2 = df[[text_col, label_col]].rename(columns={text_col: 'text', label_col: 'label_raw'})
-                df2['label'] = to_binary_label(df2['label_raw'])
-                parts.append(df2[['text', 'label']])
+        print('Loading local tables from', input_dir)
+        for p, source in local_sources(input_dir):
+            try:
+                with stage('read'):
+                    df = read_table(p)
+            except Exception as e:
+                print('Failed to read', p, e)
+                continue
+            try:
+                text_col = detect_text_column(df)
+                label_col = detect_label_column(df)
+            except Exception as e:
+                print('Skipping', p, 'due to', e)
+                continue
+            parts.append(normalize_part(df, text_col, label_col, source))
     else:
         for hid in hf_ids:
             print('Loading', hid)
-            ds = load_dataset(hid)
-            if hasattr(ds, 'keys') and 'train' in ds.keys():
-                df = ds['train'].to_pandas()
-            else:
-                if hasattr(ds, 'keys'):
-                    first = list(ds.keys())[0]
-                    df = ds[first].to_pandas()
-                else:
-                    df = ds.to_pandas()
+            with stage('read'):
+                df = hf_split(load_dataset(hid)).to_pandas()
             try:
                 text_col = detect_text_column(df)
                 label_col = detect_label_column(df)
             except Exception as e:
                 print('Skipping', hid, 'due to', e)
                 continue
-            df2 = df[[text_col, label_col]].rename(columns={text_col: 'text', label_col: 'label_raw'})
-            df2['label'] = to_binary_label(df2['label_raw'])
-            parts.append(df2[['text', 'label']])
+            parts.append(normalize_part(df, text_col, label_col, hid.replace('/', '_')))
 
     if not parts:
         raise RuntimeError('No datasets loaded')
-    combined = pd.concat(parts, ignore_index=True)
-    combined['text'] = combined['text'].fillna('').astype(str)
-    combined = combined[combined['text'].str.strip() != '']
-    return combined
+    return drop_empty_texts(pd.concat(parts, ignore_index=True))
+
+
+def _normalized_chunks(name, chunks, source):
+    """Detect columns on the first chunk of one source, then normalize every chunk."""
+    text_col = label_col = None
+    for chunk in chunks:
+        if text_col is None:
+            try:
+                text_col = detect_text_column(chunk)
+                label_col = detect_label_column(chunk)
+            except Exception as e:
+                print('Skipping', name, 'due to', e)
+                return
+        yield drop_empty_texts(normalize_part(chunk, text_col, label_col, source))
+
+
+def iter_chunks(hf_ids, input_dir=None, chunksize=100000):
+    """Like `load_and_concat`, but yields normalized chunks without holding whole sources in memory."""
+    if input_dir:
+        print('Streaming local tables from', input_dir)
+        for p, source in local_sources(input_dir):
+            try:
+                yield from _normalized_chunks(p, iter_batches(p, batch_size=chunksize), source)
+            except Exception as e:
+                print('Failed to read', p, e)
+    else:
+        for hid in hf_ids:
+            print('Streaming', hid)
+            # HF datasets are memory-mapped Arrow tables, so batches are read lazily
+            split = hf_split(load_dataset(hid))
+            yield from _normalized_chunks(hid, split.to_pandas(batch_size=chunksize, batched=True), hid.replace('/', '_'))
+
+
+def empty_corpus():
+    return pd.DataFrame({'text': pd.Series(dtype=object), 'label': pd.Series(dtype='int64')})
+
+
+def dedup_part(index, df, report):
+    """Drop exact and near duplicates of `df` (against `index` and itself) and count them per source."""
+    with stage('dedup', rows=len(df)):
+        status = index.dedup(df['text'])
+    counts = pd.crosstab(df['source'].to_numpy(), pd.Series(status).map(STATUS_NAMES).to_numpy())
+    report.append(counts.reindex(columns=list(STATUS_NAMES.values()), fill_value=0))
+    return df[status == KEEP]
+
+
+def print_dedup_report(report):
+    counts = pd.concat(report).groupby(level=0).sum()
+    counts.columns.name = None
+    counts['dropped'] = counts['exact'] + counts['near']
+    counts.loc['TOTAL'] = counts.sum()
+    counts.index.name = 'source'
+    print('Deduplication (rows kept / dropped as exact or near duplicates):')
+    print(counts.to_string())
+
+
+def open_dedup_index(args):
+    index = DedupIndex.open(args.dedup_index, threshold=args.dedup_threshold)
+    if len(index):
+        print(f'Loaded dedup index with {len(index)} texts from {args.dedup_index}')
+    return index
+
+
+def finish_dedup(args, index, report):
+    if report:
+        print_dedup_report(report)
+    if args.dedup_index:
+        index.save(args.dedup_index)
+        print(f'Saved dedup index ({len(index)} texts) to {args.dedup_index}')
+
+
+def assemble_streaming(args, combined_path, sample_path):
+    """Write combined/sample outputs chunk by chunk; the sample is a seeded reservoir sample."""
+    sampler = ReservoirSampler(args.sample_size, seed=42)
+    index = open_dedup_index(args) if args.dedup else None
+    report = []
+    total = seen = 0
+    writers = [TableWriter(combined_path)]
+    if args.partitioned:
+        writers.append(TableWriter(os.path.join(args.out_dir, 'combined_parquet'), partition_cols=['source']))
+    try:
+        for chunk in iter_stage('read', iter_chunks(HF_IDS, input_dir=args.input_dir, chunksize=args.chunksize)):
+            seen += len(chunk)
+            if index is not None:
+                chunk = dedup_part(index, chunk, report)
+            if not len(chunk):
+                continue
+            with stage('write'):
+                writers[0].write(chunk[['text', 'label']])
+                if args.partitioned:
+                    writers[1].write(chunk)
+            with stage('sample'):
+                sampler.add(chunk[['text', 'label']])
+            total += len(chunk)
+    finally:
+        for w in writers:
+            w.close()
+    if index is not None:
+        finish_dedup(args, index, report)
+    if not seen:
+        raise RuntimeError('No datasets loaded')
+    if not total:
+        # every row was a duplicate of the dedup index: still leave valid, empty outputs
+        write_table(empty_corpus(), combined_path)
+    print('Total rows in combined:', total)
+    print('Saved combined to', combined_path)
+    if args.partitioned:
+        print('Saved partitioned dataset to', writers[1].path)
+    sample = sampler.to_frame() if total else empty_corpus()
+    write_table(sample, sample_path)
+    print('Saved sample (%d rows) to %s' % (len(sample), sample_path))
+    print('Peak RSS:', format_bytes(peak_rss_bytes()))
+
+
+def assemble(args, combined_path, sample_path):
+    with stage('load'):
+        combined = load_and_concat(HF_IDS, input_dir=args.input_dir)
+        annotate(rows=len(combined))
+    if args.dedup:
+        index = open_dedup_index(args)
+        report = []
+        combined = dedup_part(index, combined, report)
+        finish_dedup(args, index, report)
+    print('Total rows in combined:', len(combined))
+    if args.partitioned:
+        dataset_path = os.path.join(args.out_dir, 'combined_parquet')
+        with stage('write_partitioned'):
+            write_table(combined, dataset_path, partition_cols=['source'])
+        print('Saved partitioned dataset to', dataset_path)
+    combined = combined[['text', 'label']]
+    with stage('write'):
+        write_table(combined, combined_path)
+    print('Saved combined to', combined_path)
+
+    n = min(args.sample_size, len(combined))
+    with stage('sample'):
+        sample = combined.sample(n, random_state=42)
+        write_table(sample, sample_path)
+    print('Saved sample (%d rows) to %s' % (n, sample_path))
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--out_dir', default='data/ru_toxic', help='Output directory')
     parser.add_argument('--sample_size', type=int, default=20000, help='Size of small sample')
-    parser.add_argument('--input_dir', default=None, help='Optional: directory with locally downloaded HF CSVs (use this instead of loading from the Hub)')
+    parser.add_argument('--input_dir', default=None, help='Optional: directory with locally downloaded HF CSV/Parquet/Arrow files (use this instead of loading from the Hub)')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default='csv', help='File format for combined and sample outputs')
+    parser.add_argument('--partitioned', action='store_true', help='Also write combined_parquet/ partitioned by source corpus')
+    parser.add_argument('--streaming', action='store_true', help='Read sources in chunks and append to the outputs incrementally; the sample is drawn by reservoir sampling')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows per chunk in --streaming mode')
+    parser.add_argument('--dedup', action='store_true', help='Drop exact (normalized text) and MinHash/LSH near duplicates')
+    parser.add_argument('--dedup_threshold', type=float, default=0.8, help='Estimated Jaccard similarity of 5-gram shingles above which texts are near duplicates')
+    parser.add_argument('--dedup_index', default=None, help='Optional directory of a persistent dedup index: rows already seen in earlier runs are dropped and new rows are added')
+    add_profile_args(parser)
     args = parser.parse_args()
 
     out_dir = args.out_dir
     os.makedirs(out_dir, exist_ok=True)
+    combined_path = with_extension(os.path.join(out_dir, 'combined'), args.format)
+    sample_path = with_extension(os.path.join(out_dir, 'sample_small'), args.format)
 
-    combined = load_and_concat(HF_IDS, input_dir=args.input_dir)
-    print('Total rows in combined:', len(combined))
-    combined_path = os.path.join(out_dir, 'combined.csv')
-    combined.to_csv(combined_path, index=False)
-    print('Saved combined to', combined_path)
-
-    n = min(args.sample_size, len(combined))
-    sample = combined.sample(n, random_state=42)
-    sample_path = os.path.join(out_dir, 'sample_small.csv')
-    sample.to_csv(sample_path, index=False)
-    print('Saved sample (%d rows) to %s' % (n, sample_path))
+    with profiling(args):
+        if args.streaming:
+            assemble_streaming(args, combined_path, sample_path)
+        else:
+            assemble(args, combined_path, sample_path)
 
 
 if __name__ == '__main__':
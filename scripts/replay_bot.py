@@ -0,0 +1,297 @@
+"""Replay a stream of fake Telegram updates through the bot handlers and measure them.
+
+Usage:
+    python scripts/replay_bot.py --model models/calibrated_model_full.tox --rate 200 --n_updates 4000
+    python scripts/replay_bot.py --model models/calibrated_model_full.tox --input_csv data/ru_toxic/sample_small.csv \
+        --json_out bench/replay.json
+    python scripts/replay_bot.py --model models/new_model.tox --baseline bench/replay.json --max_regression 0.2 -- --workers 2
+
+No token or network is needed. The updates are direct messages and group
+replies with the "токс" trigger (`--group_share`), built from the `text` column
+of `--input_csv` or from synthetic sentences. They arrive open-loop at
+`--rate` updates/s (Poisson or evenly spaced) and go straight into
+`private_message_handler` / `check_reply_handler`. The batcher, result cache,
+metrics and admission control are built by the bot's own `build_services`,
+from the bot options given after ``--``. Per-chat and per-user rate limits and
+coalescing are off unless given there, so that they do not shed the
+synthetic traffic. `reply_text` is stubbed and records the reply after
+`--reply_delay_ms`.
+
+Reported numbers:
+- handler outcomes and end-to-end throughput (scored replies/s);
+- latency from the scheduled arrival of an update to its reply (p50/p90/p99/max), per handler;
+- event-loop lag: how late a 5 ms timer fires, and the total time of stalls over 10 ms.
+
+With `--json_out` the results are saved. `--baseline` compares against an
+earlier run and `--max_p99_ms`, `--min_throughput` and `--max_loop_lag_ms` set
+absolute limits. If any limit is broken the script exits with status 1, so it
+can gate a bot change in CI.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (REPO_ROOT, os.path.join(REPO_ROOT, 'bot')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import telegram_bot
+from toxicity.dataio import read_table
+from toxicity.fake_telegram import FakeContext, ReplyLog, group_check_update, private_update
+from toxicity.model_io import model_version
+from toxicity.synthetic import synthetic_texts
+from toxicity.telemetry import LoopLagMonitor
+
+
+# replay defaults that differ from the bot's: synthetic senders would be rate-limited away
+BOT_DEFAULTS = ['--chat_rate', '0', '--user_rate', '0', '--coalesce_window', '0', '--reload_interval', '0']
+HANDLERS = {
+    'private': telegram_bot.private_message_handler,
+    'group': telegram_bot.check_reply_handler,
+}
+
+
+def load_texts(args):
+    if args.input_csv:
+        texts = read_table(args.input_csv, columns=['text'])['text'].fillna('').astype(str).tolist()
+        texts = [t for t in texts if t.strip()]
+        if not texts:
+            raise SystemExit('No texts found in ' + args.input_csv)
+        return texts
+    lengths = [int(n) for n in args.lengths.split(',')]
+    per_length = -(-args.n_updates // len(lengths))
+    groups = [synthetic_texts(per_length, n, seed=args.seed + i) for i, n in enumerate(lengths)]
+    # interleave the lengths so every part of the run sees the same mix
+    return [t for row in zip(*groups) for t in row]
+
+
+def build_traffic(texts, n, group_share, n_chats, n_users, reply_log, seed=0):
+    """(kind, update) pairs: private texts from `n_users` users and trigger replies in `n_chats` groups."""
+    rng = np.random.default_rng(seed)
+    is_group = rng.random(n) < group_share
+    users = rng.integers(0, n_users, size=n)
+    chats = rng.integers(0, n_chats, size=n)
+    traffic = []
+    for i in range(n):
+        text = texts[i % len(texts)]
+        user_id = 10000 + int(users[i])
+        if is_group[i]:
+            update = group_check_update(text, chat_id=-1000 - int(chats[i]), user_id=user_id, reply_log=reply_log)
+            traffic.append(('group', update))
+        else:
+            traffic.append(('private', private_update(text, user_id, reply_log=reply_log)))
+    return traffic
+
+
+def arrival_offsets(n, rate, arrival, seed=0):
+    """Seconds from the start at which each of `n` updates arrives."""
+    if arrival == 'uniform':
+        return np.arange(n) / rate
+    return np.cumsum(np.random.default_rng(seed).exponential(1.0 / rate, size=n))
+
+
+async def replay(traffic, offsets, context):
+    """Deliver each update at its offset without waiting for earlier ones; returns per-update results."""
+    results = [None] * len(traffic)
+
+    async def handle(i, kind, update, scheduled):
+        outcome = await HANDLERS[kind](update, context)
+        results[i] = (kind, outcome, scheduled, time.perf_counter())
+
+    tasks = []
+    t0 = time.perf_counter()
+    for i, ((kind, update), offset) in enumerate(zip(traffic, offsets)):
+        delay = t0 + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(handle(i, kind, update, t0 + offset)))
+    await asyncio.gather(*tasks)
+    return results, t0
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return {'n': 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        'n': len(ms),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+
+def summarize(results, t0, n_sent):
+    outcomes = {}
+    latencies = {'all': []}
+    for kind, outcome, scheduled, done in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if outcome == 'replied':
+            latencies['all'].append(done - scheduled)
+            latencies.setdefault(kind, []).append(done - scheduled)
+    elapsed = max(done for _, _, _, done in results) - t0
+    return {
+        'updates': len(results),
+        'seconds': elapsed,
+        'updates_per_s': len(results) / elapsed,
+        'replies_per_s': outcomes.get('replied', 0) / elapsed,
+        'messages_sent': n_sent,
+        'outcomes': outcomes,
+        'latency': {kind: latency_summary(values) for kind, values in latencies.items()},
+    }
+
+
+def check_gates(results, args):
+    """Messages for every broken limit (empty if the run passes)."""
+    failures = []
+    p99 = results['latency']['all'].get('p99_ms', 0.0)
+    throughput = results['replies_per_s']
+    loop_max = results['loop_lag']['max_ms']
+    if args.max_p99_ms is not None and p99 > args.max_p99_ms:
+        failures.append(f'p99 latency {p99:.1f} ms > {args.max_p99_ms:.1f} ms')
+    if args.min_throughput is not None and throughput < args.min_throughput:
+        failures.append(f'throughput {throughput:.1f} replies/s < {args.min_throughput:.1f}')
+    if args.max_loop_lag_ms is not None and loop_max > args.max_loop_lag_ms:
+        failures.append(f'event-loop lag {loop_max:.1f} ms > {args.max_loop_lag_ms:.1f} ms')
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            base = json.load(f)
+        r = args.max_regression
+        base_p99 = base['latency']['all'].get('p99_ms', 0.0)
+        if base_p99 and p99 > base_p99 * (1 + r):
+            failures.append(f'p99 latency {p99:.1f} ms vs baseline {base_p99:.1f} ms (+{100 * (p99 / base_p99 - 1):.0f}%)')
+        if throughput < base['replies_per_s'] * (1 - r):
+            failures.append(f'throughput {throughput:.1f} replies/s vs baseline {base["replies_per_s"]:.1f}')
+        # a few ms of timer jitter is not a regression
+        if loop_max > max(base['loop_lag']['max_ms'] * (1 + r), base['loop_lag']['max_ms'] + 5.0):
+            failures.append(f'event-loop lag {loop_max:.1f} ms vs baseline {base["loop_lag"]["max_ms"]:.1f} ms')
+    return failures
+
+
+def print_results(results):
+    print(f'{results["updates"]} updates in {results["seconds"]:.2f}s: {results["updates_per_s"]:.1f} updates/s, '
+          f'{results["replies_per_s"]:.1f} replies/s')
+    for outcome, count in sorted(results['outcomes'].items()):
+        print(f'  {outcome:<18} {count:>7}')
+    print('Latency, arrival to reply:')
+    for kind, lat in results['latency'].items():
+        if lat['n']:
+            print(f'  {kind:>8}: n {lat["n"]:>6}, p50 {lat["p50_ms"]:.1f} ms, p90 {lat["p90_ms"]:.1f} ms, '
+                  f'p99 {lat["p99_ms"]:.1f} ms, max {lat["max_ms"]:.1f} ms')
+    lag = results['loop_lag']
+    print(f'Event-loop lag: p50 {lag["p50_ms"]:.2f} ms, p99 {lag["p99_ms"]:.2f} ms, max {lag["max_ms"]:.1f} ms; '
+          f'{lag["stalls"]} stalls over 10 ms, {lag["blocked_seconds"] * 1000:.0f} ms blocked in total')
+    batching = results.get('batching')
+    if batching:
+        print(f'Batches: {batching["batches"]}, mean size {batching["mean_size"]:.1f}')
+
+
+async def run(args, bot_args):
+    model = telegram_bot.load_model(bot_args.model)
+    batcher, cache, metrics, admission = telegram_bot.build_services(bot_args, model)
+    post_init, post_shutdown = telegram_bot._make_lifecycle_hooks(batcher, cache, None, None, 0, metrics, admission)
+    context = FakeContext({'model': model})
+    batch_sizes = []
+    on_batch = batcher.on_batch
+
+    def record_batch(size, *rest):
+        batch_sizes.append(size)
+        if on_batch is not None:
+            on_batch(size, *rest)
+
+    batcher.on_batch = record_batch
+    await post_init(context)
+    try:
+        texts = load_texts(args)
+        reply_log = ReplyLog(delay=args.reply_delay_ms / 1000.0)
+        if args.warmup:
+            warmup = build_traffic(texts[::-1], args.warmup, args.group_share, args.n_chats, args.n_users, reply_log,
+                                   seed=args.seed + 1)
+            await replay(warmup, arrival_offsets(args.warmup, args.rate, 'uniform'), context)
+            if cache is not None:
+                cache.clear()
+            reply_log.replies.clear()
+            batch_sizes.clear()
+        traffic = build_traffic(texts, args.n_updates, args.group_share, args.n_chats, args.n_users, reply_log,
+                                seed=args.seed)
+        offsets = arrival_offsets(args.n_updates, args.rate, args.arrival, seed=args.seed)
+        monitor = LoopLagMonitor()
+        monitor.start()
+        try:
+            results, t0 = await replay(traffic, offsets, context)
+        finally:
+            await monitor.stop()
+        summary = summarize(results, t0, len(reply_log.replies))
+        summary['loop_lag'] = monitor.summary()
+        if batch_sizes:
+            summary['batching'] = {'batches': len(batch_sizes), 'mean_size': float(np.mean(batch_sizes))}
+    finally:
+        await post_shutdown(context)
+    return summary, model
+
+
+def main():
+    parser = argparse.ArgumentParser(epilog='Options after -- are passed to the bot (see bot/telegram_bot.py --help)')
+    parser.add_argument('--model', default='models/calibrated_model.joblib', help='Path to joblib model or serving artifact')
+    parser.add_argument('--input_csv', default=None, help='Replay the `text` column of this CSV/Parquet/Arrow file instead of synthetic texts')
+    parser.add_argument('--lengths', default='5,20,80', help='Comma-separated word counts of synthetic texts')
+    parser.add_argument('--n_updates', type=int, default=2000, help='Updates to replay')
+    parser.add_argument('--rate', type=float, default=200.0, help='Target arrival rate, updates/s')
+    parser.add_argument('--arrival', choices=['poisson', 'uniform'], default='poisson', help='Arrival process')
+    parser.add_argument('--group_share', type=float, default=0.3, help='Share of updates that are group replies with the trigger')
+    parser.add_argument('--n_chats', type=int, default=50, help='Number of group chats')
+    parser.add_argument('--n_users', type=int, default=1000, help='Number of senders')
+    parser.add_argument('--reply_delay_ms', type=float, default=0.0, help='Simulated time to send one reply')
+    parser.add_argument('--warmup', type=int, default=100, help='Updates replayed and discarded before measuring')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log_level', default='WARNING', help='Logging level during the replay')
+    parser.add_argument('--json_out', default=None, help='Optional path to write results as JSON')
+    parser.add_argument('--baseline', default=None, help='Earlier --json_out results; fail on regressions beyond --max_regression')
+    parser.add_argument('--max_regression', type=float, default=0.2, help='Allowed relative regression against --baseline')
+    parser.add_argument('--max_p99_ms', type=float, default=None, help='Fail if the p99 latency of replies exceeds this')
+    parser.add_argument('--min_throughput', type=float, default=None, help='Fail if fewer replies/s than this')
+    parser.add_argument('--max_loop_lag_ms', type=float, default=None, help='Fail if the event loop ever stalls longer than this')
+    args, bot_argv = parser.parse_known_args()
+    if bot_argv[:1] == ['--']:
+        bot_argv = bot_argv[1:]
+    bot_args = telegram_bot.build_parser().parse_args(BOT_DEFAULTS + ['--model', args.model] + bot_argv)
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    summary, model = asyncio.run(run(args, bot_args))
+    results = {
+        'model_path': args.model,
+        'model_version': model_version(model),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpu_count': os.cpu_count(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('json_out', 'baseline')},
+        'bot_args': bot_argv,
+        **summary,
+    }
+    print_results(results)
+
+    if args.json_out:
+        d = os.path.dirname(args.json_out)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print('Saved results to', args.json_out)
+    failures = check_gates(results, args)
+    for failure in failures:
+        print('FAIL:', failure)
+    if failures:
+        sys.exit(1)
+    if args.baseline or args.max_p99_ms is not None or args.min_throughput is not None or args.max_loop_lag_ms is not None:
+        print('PASS')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,84 +1,139 @@
+"""Run download -> prepare -> train -> OOF metrics as a DAG, redoing only what changed.
+
+Usage:
+    python scripts/run_full_pipeline.py
+    python scripts/run_full_pipeline.py --dry_run
+    python scripts/run_full_pipeline.py --only train --force train
+
+Every stage declares its inputs (data files and the code it runs) and its
+outputs. A stage is skipped when its command and inputs are unchanged since
+its last successful run and its outputs are still intact (see
+`toxicity.pipeline`). Independent stages (download and prepare) run in
+parallel (`--jobs`). After a failure, rerunning resumes from the failed stage.
+
+The model is judged by its out-of-fold metrics: `sample_small` is drawn from
+`combined`, so every row of it was trained on and scoring it would not be an
+evaluation.
+"""
+import argparse
+import json
 import os
-import subprocess
 import sys
 
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
 
-REPO_ROOT = os.path.dirname(os.path.dirname(__file__))
-
-
-def run(cmd, desc=None, check=True):
-    if desc:
-        print('---', desc)
-    print('>',' '.join(cmd))
-    res = subprocess.run(cmd, check=check)
-    return res.returncode
-
-
-def main():
-    py = sys.executable
+from toxicity.pipeline import BLOCKED, FAILED, PipelineRunner, Stage, select_stages
 
-    download_script = os.path.join(REPO_ROOT, 'scripts', 'download_hf_datasets.py')
-    if os.path.exists(download_script):
-        run([py, download_script, '--outdir', os.path.join('data','hf_raw')], desc='Downloading HF datasets')
-    else:
-        print('No download_hf_datasets.py found, skipping download step')
 
-    prepare_script = os.path.join(REPO_ROOT, 'scripts', 'prepare_combined.py')
-    if os.path.exists(prepare_script):
-        run([py, prepare_script], desc='Preparing combined CSVs')
-    else:
-        print('No prepare_combined.py found, ensure combined CSVs exist under data/ru_toxic')
+def script(name):
+    return os.path.join(REPO_ROOT, 'scripts', name)
 
-    train_script = os.path.join(REPO_ROOT, 'scripts', 'train_baseline.py')
-    if os.path.exists(train_script):
-        run([py, train_script], desc='Training baseline and saving calibrated model')
-    else:
-        print('No train_baseline.py found, aborting')
 
-    print('\nPipeline finished. Check data/ru_toxic/combined_oof.csv and models/calibrated_model.joblib')
+# every stage imports shared code from here; any change to it reruns the stages
+PACKAGE = os.path.join(REPO_ROOT, 'toxicity')
 
 
-if __name__ == '__main__':
-    main()
-import argparse
-import subprocess
-import sys
-import os
-
-
-def run_cmd(cmd):
-    print('\n>>> Running:', ' '.join(cmd))
-    res = subprocess.run(cmd)
-    if res.returncode != 0:
-        raise SystemExit(f'Command failed: {cmd}')
+def build_stages(args):
+    py = sys.executable
+    raw_dir = os.path.join(args.data_dir, 'hf_raw')
+    out_dir = os.path.join(args.data_dir, 'ru_toxic')
+    combined = os.path.join(out_dir, 'combined.csv')
+    sample = os.path.join(out_dir, 'sample_small.csv')
+    oof = os.path.join(out_dir, 'combined_oof.csv')
+    model = os.path.join(args.model_dir, 'calibrated_model.joblib')
+    artifact = os.path.join(args.model_dir, 'calibrated_model.tox')
+    oof_metrics = metrics_path(args)
+
+    prepare_cmd = [py, script('prepare_combined.py'), '--out_dir', out_dir]
+    prepare_inputs = [script('prepare_combined.py'), PACKAGE]
+    if args.input_dir:
+        prepare_cmd += ['--input_dir', args.input_dir]
+        prepare_inputs.append(args.input_dir)
+
+    return [
+        # keeps a local copy of the raw and standardized splits; prepare reads the Hub itself
+        Stage('download', [py, script('download_hf_datasets.py'), '--outdir', raw_dir],
+              inputs=[script('download_hf_datasets.py'), PACKAGE],
+              outputs=[os.path.join(raw_dir, 'manifest.json')]),
+        Stage('prepare', prepare_cmd, inputs=prepare_inputs, outputs=[combined, sample]),
+        Stage('train', [py, script('train_baseline.py'), '--input', combined, '--oof_out', oof,
+                        '--model_out', model, '--artifact_out', artifact],
+              inputs=[script('train_baseline.py'), combined, PACKAGE],
+              outputs=[oof, model, artifact], deps=['prepare']),
+        Stage('oof_metrics', [py, script('compute_oof_metrics.py'), oof, '--metrics_out', oof_metrics],
+              inputs=[script('compute_oof_metrics.py'), oof, PACKAGE], outputs=[oof_metrics], deps=['train']),
+    ]
+
+
+def metrics_path(args):
+    """JSON metrics written by the oof_metrics stage."""
+    return os.path.join(args.model_dir, 'oof_metrics.json')
+
+
+def print_metrics(args):
+    """Show the stored OOF metrics, so a run whose oof_metrics stage was skipped still reports them."""
+    try:
+        with open(metrics_path(args), encoding='utf-8') as f:
+            m = json.load(f)
+    except (OSError, ValueError):
+        return
+    print(f'OOF metrics ({m["rows"]} rows, threshold {m["threshold"]:g}): ROC AUC {m["roc_auc"]:.4f}, '
+          f'F1 {m["f1"]:.4f}, precision {m["precision"]:.4f}, recall {m["recall"]:.4f}, '
+          f'Brier {m["brier"]:.4f}, ECE {m["ece"]:.4f}')
+
+
+def split_names(value):
+    return [v for v in (value or '').split(',') if v]
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--out_dir', default='data/ru_toxic')
-    parser.add_argument('--sample_size', type=int, default=5000)
-    parser.add_argument('--n_splits', type=int, default=5)
-    parser.add_argument('--model_path', default='models/baseline_tfidf_logreg.joblib')
-    parser.add_argument('--calibrated_model', default='models/calibrated_model.joblib')
+    parser.add_argument('--data_dir', default='data', help='Root of hf_raw/ and ru_toxic/')
+    parser.add_argument('--model_dir', default='models')
+    parser.add_argument('--input_dir', default=None, help='Optional: prepare from local tables instead of the Hub')
+    parser.add_argument('--jobs', type=int, default=2, help='Maximum number of stages running at the same time')
+    parser.add_argument('--only', default=None, help='Comma-separated stages to bring up to date (with their dependencies)')
+    parser.add_argument('--force', default=None, help='Comma-separated stages to rerun even if up to date')
+    parser.add_argument('--force_all', action='store_true', help='Rerun every selected stage')
+    parser.add_argument('--dry_run', action='store_true', help='Only print which stages would run and why')
+    parser.add_argument('--state', default=None, help='Pipeline state file (default: <data_dir>/pipeline_state.json)')
+    parser.add_argument('--log_dir', default=None, help='Per-stage logs (default: <data_dir>/pipeline_logs)')
     args = parser.parse_args()
 
-    python = sys.executable
-
-    cmd_prepare = [python, 'scripts/prepare_combined.py', '--out_dir', args.out_dir, '--sample_size', str(args.sample_size)]
-    run_cmd(cmd_prepare)
-
-    combined_csv = os.path.join(args.out_dir, 'combined.csv')
-    sample_csv = os.path.join(args.out_dir, 'sample_small.csv')
-
-    out_oof = os.path.join(args.out_dir, 'combined_oof.csv')
-    cmd_oof = [python, 'scripts/create_oof_soft_labels.py', '--input_csv', combined_csv, '--out_csv', out_oof, '--n_splits', str(args.n_splits), '--sample_size', str(args.sample_size)]
-    run_cmd(cmd_oof)
-    cmd_train = [python, 'scripts/train_baseline.py', '--model_path', args.model_path]
-    run_cmd(cmd_train)
-    cmd_cal = [python, 'scripts/calibrate.py', '--model', args.model_path, '--val_csv', sample_csv, '--out_model', args.calibrated_model, '--method', 'isotonic']
-    run_cmd(cmd_cal)
-
-    print('\nPipeline completed. Calibrated model saved to', args.calibrated_model)
+    stages = build_stages(args)
+    all_names = [s.name for s in stages]
+    try:
+        if args.only:
+            stages = select_stages(stages, split_names(args.only))
+        force = all_names if args.force_all else split_names(args.force)
+        unknown = [f for f in force if f not in all_names]
+        if unknown:
+            raise ValueError(f'Unknown stages: {", ".join(unknown)}')
+    except ValueError as e:
+        parser.error(str(e))
+
+    runner = PipelineRunner(
+        stages,
+        state_path=args.state or os.path.join(args.data_dir, 'pipeline_state.json'),
+        log_dir=args.log_dir or os.path.join(args.data_dir, 'pipeline_logs'),
+        jobs=args.jobs, force=force,
+    )
+    if args.dry_run:
+        for name, action, reason in runner.plan():
+            print(f'{name:<12} {action:<5} {reason}')
+        return
+
+    status = runner.run()
+    print('\nPipeline summary:')
+    for stage in runner.stages:
+        print(f'  {stage.name:<12} {status.get(stage.name)}')
+    if any(s in (FAILED, BLOCKED) for s in status.values()):
+        raise SystemExit('Pipeline failed; rerun to resume from the failed stage')
+    print()
+    print_metrics(args)
+    print('\nPipeline finished. Model:', os.path.join(args.model_dir, 'calibrated_model.joblib'))
 
 
 if __name__ == '__main__':
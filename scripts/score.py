@@ -0,0 +1,83 @@
+"""Score a large table of messages in chunks and write P(toxic) incrementally.
+
+Usage:
+    python scripts/score.py models/calibrated_model_full.tox data/chat_dump.csv scores/chat_dump.parquet --workers 4
+
+The input (CSV, Parquet, Arrow or a Parquet dataset directory) is read
+`--chunksize` rows at a time. Every chunk is scored with one vectorized
+`predict_proba` call in a pool of `--workers` processes that load the model
+once, and the results are appended to the output (CSV, Parquet or Arrow, by
+extension) in input order. Only a few chunks are held in memory at any time,
+so memory use does not depend on the size of the input.
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.dataio import TableWriter, iter_batches
+from toxicity.inference import iter_scored_chunks
+from toxicity.model_io import load_model
+from toxicity.sysinfo import format_bytes, peak_rss_bytes
+from toxicity.windows import add_window_args, window_config
+
+
+def split_columns(value):
+    return [c for c in (value or '').split(',') if c]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path', help='Path to joblib model or serving artifact')
+    parser.add_argument('input', help='CSV/Parquet/Arrow file or Parquet dataset directory with a text column')
+    parser.add_argument('output', help='Output CSV/Parquet/Arrow file')
+    parser.add_argument('--text_column', default='text')
+    parser.add_argument('--keep_columns', default=None,
+                        help='Comma-separated input columns copied to the output (e.g. id,chat_id); default: the text column')
+    parser.add_argument('--chunksize', type=int, default=50000, help='Rows read and scored per chunk')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Scoring processes; 0 scores in the main process')
+    parser.add_argument('--max_pending', type=int, default=None, help='Chunks read ahead of the writer (default: 2 * workers)')
+    parser.add_argument('--threshold', type=float, default=None, help='Also write a 0/1 `toxic` column at this threshold')
+    parser.add_argument('--log_every', type=int, default=10, help='Print progress every N chunks')
+    add_window_args(parser)
+    args = parser.parse_args()
+    if args.chunksize < 1:
+        parser.error('--chunksize must be >= 1')
+
+    keep = split_columns(args.keep_columns) or [args.text_column]
+    columns = list(dict.fromkeys([args.text_column] + keep))
+
+    t0 = time.perf_counter()
+    model = load_model(args.model_path)
+    print(f'Model loaded in {time.perf_counter() - t0:.2f}s')
+
+    t0 = time.perf_counter()
+    chunks = iter_batches(args.input, columns=columns, batch_size=args.chunksize)
+    with TableWriter(args.output) as writer:
+        scored = iter_scored_chunks(model, chunks, n_workers=args.workers, max_pending=args.max_pending,
+                                    text_column=args.text_column, windows=window_config(args))
+        for i, (chunk, probs) in enumerate(scored, 1):
+            out = chunk[keep].copy()
+            out['toxic_proba'] = probs
+            if args.threshold is not None:
+                out['toxic'] = (probs >= args.threshold).astype(int)
+            writer.write(out)
+            if i % args.log_every == 0:
+                elapsed = time.perf_counter() - t0
+                print(f'  {writer.rows} rows, {writer.rows / elapsed:.0f} rows/s, peak RSS {format_bytes(peak_rss_bytes())}')
+        rows = writer.rows
+
+    elapsed = time.perf_counter() - t0
+    rate = rows / elapsed if elapsed > 0 else float('inf')
+    print(f'Scored {rows} rows in {elapsed:.1f}s ({rate:.0f} rows/s) with {args.workers} workers')
+    print(f'Peak RSS of this process: {format_bytes(peak_rss_bytes())}')
+    print('Saved scores to', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Flood the bot handlers with simulated updates and show what is scored and what is shed.
+
+Usage:
+    python scripts/simulate_bot_overload.py --model models/calibrated_model_full.tox
+    python scripts/simulate_bot_overload.py --model models/calibrated_model_full.tox -- --shed_policy drop --max_pending 64
+
+No Telegram token or network is needed: fake updates (see
+`toxicity.fake_telegram`) go straight into `private_message_handler` and
+`check_reply_handler`, with the batcher, cache and admission control built
+from the bot's own options (anything after ``--``). Three floods are run in
+turn:
+
+* ``same_target``: many users trigger "токс" on the same group message;
+* ``group_spam``: a few users in one chat trigger it on different messages;
+* ``dm_flood``: many users send direct messages at once.
+
+For each, the handler outcomes (replied, shed_duplicate, shed_chat_rate,
+shed_user_rate, shed_overloaded, ...), the number of busy replies and the
+largest queue depth and pending count seen are printed.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (REPO_ROOT, os.path.join(REPO_ROOT, 'bot')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import telegram_bot
+from toxicity.fake_telegram import FakeContext, ReplyLog, group_check_update, private_update
+from toxicity.synthetic import synthetic_texts
+
+
+def build_floods(n, reply_log):
+    texts = synthetic_texts(n, 12)
+    return {
+        'same_target': [group_check_update(texts[0], chat_id=-100, user_id=1000 + i % 50, target_message_id=1,
+                                           reply_log=reply_log) for i in range(n)],
+        'group_spam': [group_check_update(texts[i], chat_id=-200, user_id=2000 + i % 5, target_message_id=1000 + i,
+                                          reply_log=reply_log) for i in range(n)],
+        'dm_flood': [private_update(texts[i], user_id=3000 + i % (n // 4 or 1), reply_log=reply_log) for i in range(n)],
+    }
+
+
+async def run_flood(updates, context, batcher, admission, reply_log, duration):
+    """Deliver `updates` evenly over `duration` seconds; returns outcome counts and peak queue figures."""
+    handlers = {'private': telegram_bot.private_message_handler}
+    peak = {'queue_depth': 0, 'pending': 0}
+    done = asyncio.Event()
+
+    async def sample():
+        while not done.is_set():
+            peak['queue_depth'] = max(peak['queue_depth'], batcher.queue_depth)
+            peak['pending'] = max(peak['pending'], admission.pending)
+            await asyncio.sleep(0.001)
+
+    async def deliver(i, update):
+        await asyncio.sleep(duration * i / len(updates))
+        handler = handlers.get(update.message.chat.type, telegram_bot.check_reply_handler)
+        return await handler(update, context)
+
+    sampler = asyncio.create_task(sample())
+    replies_before = len(reply_log.replies)
+    t0 = time.perf_counter()
+    outcomes = await asyncio.gather(*[deliver(i, u) for i, u in enumerate(updates)])
+    elapsed = time.perf_counter() - t0
+    done.set()
+    await sampler
+    counts = {}
+    for outcome in outcomes:
+        counts[outcome] = counts.get(outcome, 0) + 1
+    new_replies = reply_log.texts()[replies_before:]
+    busy = sum(1 for text in new_replies if text == telegram_bot.BUSY_TEXT)
+    return counts, busy, len(new_replies) - busy, peak, elapsed
+
+
+async def simulate(args, bot_args):
+    model = telegram_bot.load_model(bot_args.model)
+    batcher, cache, metrics, admission = telegram_bot.build_services(bot_args, model)
+    post_init, post_shutdown = telegram_bot._make_lifecycle_hooks(batcher, cache, None, None, 0, metrics, admission)
+    context = FakeContext({'model': model})
+    await post_init(context)
+    reply_log = ReplyLog(delay=args.reply_delay_ms / 1000.0)
+    try:
+        for name, updates in build_floods(args.n_updates, reply_log).items():
+            counts, busy, scored, peak, elapsed = await run_flood(updates, context, batcher, admission, reply_log,
+                                                                  args.duration)
+            print(f'\n{name}: {len(updates)} updates in {elapsed:.2f}s')
+            for outcome, count in sorted(counts.items()):
+                print(f'  {outcome:<18} {count:>6}')
+            print(f'  score replies {scored}, busy replies {busy}, '
+                  f'peak queue depth {peak["queue_depth"]}, peak pending {peak["pending"]}')
+        print('\nAdmission totals:', admission.stats())
+    finally:
+        await post_shutdown(context)
+
+
+def main():
+    parser = argparse.ArgumentParser(epilog='Options after -- are passed to the bot (see bot/telegram_bot.py --help)')
+    parser.add_argument('--model', default='models/calibrated_model.joblib', help='Path to joblib model or serving artifact')
+    parser.add_argument('--n_updates', type=int, default=2000, help='Updates per flood')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds over which each flood arrives')
+    parser.add_argument('--reply_delay_ms', type=float, default=50.0, help='Simulated time to send one reply')
+    args, bot_argv = parser.parse_known_args()
+    if bot_argv[:1] == ['--']:
+        bot_argv = bot_argv[1:]
+    bot_args = telegram_bot.build_parser().parse_args(['--model', args.model] + bot_argv)
+    asyncio.run(simulate(args, bot_args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,30 @@
 import os
+import sys
 import argparse
-import pandas as pd
+import time
 import numpy as np
+from sklearn.base import clone
 from sklearn.pipeline import Pipeline
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import StratifiedKFold, cross_val_predict
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.model_selection import StratifiedKFold
 from sklearn.calibration import CalibratedClassifierCV
-from sklearn.metrics import brier_score_loss, roc_auc_score
-import joblib
+from joblib import Parallel, delayed
+import sklearn
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from toxicity.artifact import write_artifact
+from toxicity.dataio import TableWriter, iter_batches, read_table, write_table
+from toxicity.feature_cache import FeatureCache, decode_frame, encode_frame
+from toxicity.features import CachedTfidfVectorizer, TokenCounts, calibrated_to_text_model
+from toxicity.fused import fuse_calibrated, max_abs_diff
+from toxicity.metrics import BinaryMetrics, binned_auc
+from toxicity.model_io import dump_model
+from toxicity.profiling import active_profiler, add_profile_args, annotate, iter_stage, matrix_info, profiling, stage
+from toxicity.sysinfo import peak_rss_bytes
 
 
 def ensure_dir(path):
@@ -17,57 +33,350 @@ def ensure_dir(path):
         os.makedirs(d, exist_ok=True)
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--input', default='data/ru_toxic/combined.csv')
-    parser.add_argument('--fallback', default='data/ru_toxic/sample_small.csv')
-    parser.add_argument('--oof_out', default='data/ru_toxic/combined_oof.csv')
-    parser.add_argument('--model_out', default='models/calibrated_model.joblib')
-    parser.add_argument('--n_splits', type=int, default=5)
-    args = parser.parse_args()
+TFIDF_MAX_FEATURES = 50000
+TFIDF_NGRAM_RANGE = (1, 2)
 
-    inp = args.input if os.path.exists(args.input) else args.fallback
-    if not os.path.exists(inp):
-        raise FileNotFoundError(f'No input CSV found at {args.input} or fallback {args.fallback}')
 
-    df = pd.read_csv(inp)
-    if 'text' not in df.columns or 'label' not in df.columns:
+def make_vectorizer(args):
+    if args.vectorizer == 'hashing':
+        # Stateless: nothing is learned from the corpus and no vocabulary is stored
+        return 'hashing', HashingVectorizer(n_features=args.n_features, ngram_range=(1,2), alternate_sign=False, norm='l2')
+    return 'tfidf', TfidfVectorizer(max_features=TFIDF_MAX_FEATURES, ngram_range=TFIDF_NGRAM_RANGE)
+
+
+def read_training_csv(path):
+    try:
+        return read_table(path, columns=['text', 'label'])
+    except (ValueError, KeyError):
+        raise RuntimeError('Input CSV must contain `text` and `label` columns')
+
+
+def load_token_counts(path, cache):
+    """Read and tokenize the training CSV, or load both from the feature cache.
+
+    On a cache hit the CSV is not parsed at all; the frame is rebuilt from the
+    cache with the same columns and missing values as a fresh read.
+    """
+    if cache is not None:
+        key = cache.make_key(path, {'kind': 'token_counts', 'ngram_range': TFIDF_NGRAM_RANGE, 'sklearn': sklearn.__version__,
+                                    'frame': 1})
+        with stage('cache_lookup'):
+            hit = cache.get(key)
+        if hit is not None:
+            arrays, meta = hit
+            print('Loaded tokenized corpus from cache', key)
+            df = decode_frame(arrays, meta['columns'])
+            token_counts = TokenCounts.from_arrays(arrays, ngram_range=TFIDF_NGRAM_RANGE)
+            annotate(rows=len(df), **matrix_info(token_counts.counts))
+            return df, token_counts
+
+    with stage('read'):
+        df = read_training_csv(path)
+        annotate(rows=len(df))
+    print('Tokenizing corpus once...')
+    with stage('tokenize'):
+        texts = df['text'].astype(str).values
+        token_counts = TokenCounts.from_texts(texts, ngram_range=TFIDF_NGRAM_RANGE)
+        annotate(**matrix_info(token_counts.counts))
+    if cache is not None:
+        with stage('cache_store'):
+            arrays = token_counts.to_arrays()
+            frame_arrays, columns = encode_frame(df)
+            arrays.update(frame_arrays)
+            cache.put(key, arrays, {'input': os.path.abspath(path), 'rows': len(df), 'columns': columns})
+        print('Stored tokenized corpus in cache', key)
+    return df, token_counts
+
+
+def calibrate_prefit(estimator, X, y):
+    """Fit a sigmoid calibrator on held-out data for an already trained estimator."""
+    try:
+        from sklearn.frozen import FrozenEstimator
+    except ImportError:  # scikit-learn < 1.6
+        calibrator = CalibratedClassifierCV(estimator, method='sigmoid', cv='prefit')
+    else:
+        calibrator = CalibratedClassifierCV(FrozenEstimator(estimator), method='sigmoid')
+    return calibrator.fit(X, y)
+
+
+def _fit_predict_fold(estimator, X, y, train, test):
+    t0, c0 = time.perf_counter(), time.process_time()
+    est = clone(estimator).fit(X[train], y[train])
+    probs = est.predict_proba(X[test])[:, 1]
+    usage = {'wall_s': time.perf_counter() - t0, 'cpu_s': time.process_time() - c0, 'peak_rss': peak_rss_bytes(),
+             'pid': os.getpid()}
+    return test, probs, usage
+
+
+def oof_predict(estimator, X, y, cv):
+    """Out-of-fold P(label=1), like `cross_val_predict(..., method='predict_proba', n_jobs=-1)`.
+
+    Folds run in parallel as before; each reports its wall time, CPU time and
+    peak RSS from the worker, so the profiler can show them separately.
+    """
+    folds = Parallel(n_jobs=-1)(
+        delayed(_fit_predict_fold)(estimator, X, y, train, test) for train, test in cv.split(X, y)
+    )
+    oof = np.empty(len(y))
+    for i, (test, probs, usage) in enumerate(folds, 1):
+        oof[test] = probs
+        active = active_profiler()
+        if active is not None:
+            active.record(f'fold_{i}', rows=len(test), **usage)
+    return oof
+
+
+def save_model(model, path):
+    with stage('serialize'):
+        ensure_dir(path)
+        dump_model(model, path)
+        annotate(file_bytes=os.path.getsize(path))
+    print('Saved calibrated model to', path)
+
+
+def iter_chunks(path, chunksize):
+    try:
+        yield from iter_batches(path, columns=['text', 'label'], batch_size=chunksize)
+    except (ValueError, KeyError):
         raise RuntimeError('Input CSV must contain `text` and `label` columns')
 
-    X = df['text'].astype(str).values
-    y = df['label'].astype(int).values
+
+def row_hash(index):
+    """Deterministic pseudo-random 32-bit value per row number, independent of chunk size."""
+    return (np.asarray(index, dtype=np.uint64) * np.uint64(2654435761) + np.uint64(40503)) % np.uint64(2**32)
+
+
+def train_streaming(args, inp):
+    """Out-of-core training: hashed features, SGD via partial_fit, bounded memory.
+
+    Rows are assigned to CV folds and to a small calibration holdout by a hash
+    of their row number. One SGD model per fold plus a final model are updated
+    chunk by chunk; the holdout (at most `calib_size` rows, reservoir-sampled)
+    is used only to fit the sigmoid calibrators. A second pass over the CSV
+    writes the out-of-fold probabilities.
+    """
+    _, hasher = make_vectorizer(args)
+    hasher.fit([])
+    classes = np.array([0, 1])
+    k = args.n_splits
+
+    def new_sgd():
+        return SGDClassifier(loss='log_loss', alpha=args.sgd_alpha, random_state=42)
+
+    fold_models = [new_sgd() for _ in range(k)]
+    final_model = new_sgd()
+    rng = np.random.default_rng(42)
+    calib_texts, calib_y, calib_seen = [], [], 0
+
+    for epoch in range(args.epochs):
+        start = 0
+        with stage(f'epoch_{epoch + 1}'):
+            for chunk in iter_stage('read', iter_chunks(inp, args.chunksize)):
+                idx = np.arange(start, start + len(chunk))
+                start += len(chunk)
+                h = row_hash(idx)
+                fold = (h % np.uint64(k)).astype(int)
+                holdout = (h >> np.uint64(16)) % np.uint64(args.calib_every) == 0
+                texts = chunk['text'].fillna('').astype(str).values
+                y = chunk['label'].astype(int).values
+
+                if epoch == 0:
+                    for t, lab in zip(texts[holdout], y[holdout]):
+                        calib_seen += 1
+                        if len(calib_texts) < args.calib_size:
+                            calib_texts.append(t)
+                            calib_y.append(lab)
+                        else:
+                            j = rng.integers(calib_seen)
+                            if j < args.calib_size:
+                                calib_texts[j] = t
+                                calib_y[j] = lab
+
+                train = ~holdout
+                order = rng.permutation(int(train.sum()))
+                with stage('hash'):
+                    Xc = hasher.transform(texts[train])[order]
+                yc, fc = y[train][order], fold[train][order]
+                with stage('partial_fit'):
+                    final_model.partial_fit(Xc, yc, classes=classes)
+                    for i, m in enumerate(fold_models):
+                        mask = fc != i
+                        if mask.any():
+                            m.partial_fit(Xc[mask], yc[mask], classes=classes)
+            annotate(rows=start)
+        print(f'Epoch {epoch + 1}/{args.epochs} done ({start} rows)')
+
+    if len(set(calib_y)) < 2:
+        raise RuntimeError('Calibration holdout needs both classes; lower --calib_every or add data')
+    print(f'Calibrating on {len(calib_texts)} held-out rows...')
+    with stage('calibrate', rows=len(calib_texts)):
+        calibrated_folds = [calibrate_prefit(Pipeline([('hashing', hasher), ('clf', m)]), calib_texts, calib_y) for m in fold_models]
+        calibrator = calibrate_prefit(Pipeline([('hashing', hasher), ('clf', final_model)]), calib_texts, calib_y)
+
+    print('Writing OOF probabilities...')
+    bins = 4096
+    pos_hist, neg_hist = np.zeros(bins), np.zeros(bins)
+    brier_sum, n_rows, start = 0.0, 0, 0
+    with stage('oof'), TableWriter(args.oof_out) as writer:
+        for chunk in iter_stage('read', iter_chunks(inp, args.chunksize)):
+            idx = np.arange(start, start + len(chunk))
+            fold = (row_hash(idx) % np.uint64(k)).astype(int)
+            start += len(chunk)
+            texts = chunk['text'].fillna('').astype(str).values
+            probs = np.empty(len(chunk))
+            with stage('predict'):
+                for i, m in enumerate(calibrated_folds):
+                    mask = fold == i
+                    if mask.any():
+                        probs[mask] = m.predict_proba(texts[mask])[:, 1]
+            chunk = chunk.copy()
+            chunk['soft_label'] = probs
+            with stage('write'):
+                writer.write(chunk)
+
+            y = chunk['label'].astype(int).values
+            brier_sum += float(((probs - y) ** 2).sum())
+            n_rows += len(chunk)
+            b = np.minimum((probs * bins).astype(int), bins - 1)
+            pos_hist += np.bincount(b[y == 1], minlength=bins)
+            neg_hist += np.bincount(b[y == 0], minlength=bins)
+    print('Saved OOF csv to', args.oof_out)
+
+    save_model(calibrator, args.model_out)
+
+    if n_rows:
+        print(f'OOF Brier score: {brier_sum / n_rows:.4f}')
+        print(f'OOF ROC AUC (binned): {binned_auc(pos_hist, neg_hist):.4f}')
+
+
+def train_in_memory(args, inp):
+    """Nested-CV OOF probabilities and a calibrated TF-IDF + LogisticRegression model."""
+    use_cache = args.engine == 'cached' and args.vectorizer == 'tfidf'
+    if use_cache:
+        cache = None if args.no_cache else FeatureCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+        with stage('load'):
+            df, token_counts = load_token_counts(inp, cache)
+    else:
+        with stage('read'):
+            df = read_training_csv(inp)
+            annotate(rows=len(df))
+
+    with stage('labels'):
+        X = df['text'].astype(str).values
+        y = df['label'].astype(int).values
+        annotate(positive=int(y.sum()))
 
     base_pipe = Pipeline([
-        ('tfidf', TfidfVectorizer(max_features=50000, ngram_range=(1,2))),
+        make_vectorizer(args),
         ('clf', LogisticRegression(max_iter=2000, solver='lbfgs'))
     ])
 
+    if use_cache:
+        # Every (inner and outer) fold only slices rows of the cached count
+        # matrix. Row ids take the place of the texts.
+        print(f'Cached counts: {token_counts.counts.shape[1]} terms, {token_counts.counts.nnz} non-zeros')
+        fit_pipe = Pipeline([
+            ('tfidf', CachedTfidfVectorizer(token_counts, max_features=TFIDF_MAX_FEATURES)),
+            ('clf', LogisticRegression(max_iter=2000, solver='lbfgs'))
+        ])
+        X_fit = np.arange(len(X))
+    else:
+        fit_pipe, X_fit = base_pipe, X
+        if active_profiler() is not None:
+            # the folds refit the vectorizer internally; fit it once here to report the feature matrix
+            with stage('vectorize'):
+                annotate(**matrix_info(clone(base_pipe.steps[0][1]).fit_transform(X)))
+
     cv = StratifiedKFold(n_splits=args.n_splits, shuffle=True, random_state=42)
-    calibrator = CalibratedClassifierCV(base_pipe, method='sigmoid', cv=5)
+    calibrator = CalibratedClassifierCV(fit_pipe, method='sigmoid', cv=5)
 
     print('Computing OOF probabilities with cross-validation...')
-    oof_probs = cross_val_predict(calibrator, X, y, cv=cv, method='predict_proba', n_jobs=-1)[:,1]
+    with stage('oof'):
+        oof_probs = oof_predict(calibrator, X_fit, y, cv)
 
     df_out = df.copy()
     df_out['soft_label'] = oof_probs
 
-    ensure_dir(args.oof_out)
-    df_out.to_csv(args.oof_out, index=False)
+    with stage('write_oof'):
+        write_table(df_out, args.oof_out)
     print('Saved OOF csv to', args.oof_out)
 
     print('Fitting calibrated model on full data...')
-    calibrator.fit(X, y)
-    ensure_dir(args.model_out)
-    joblib.dump(calibrator, args.model_out)
-    print('Saved calibrated model to', args.model_out)
+    with stage('calibrate', rows=len(y)):
+        calibrator.fit(X_fit, y)
+        if use_cache:
+            calibrator = calibrated_to_text_model(calibrator, base_pipe)
+    save_model(calibrator, args.model_out)
 
-    try:
-        brier = brier_score_loss(y, oof_probs)
-        auc = roc_auc_score(y, oof_probs) if len(np.unique(y))>1 else float('nan')
-        print(f'OOF Brier score: {brier:.4f}')
-        print(f'OOF ROC AUC: {auc:.4f}')
-    except Exception as e:
-        print('Failed to compute metrics:', e)
+    if (args.fused_out or args.artifact_out) and args.vectorizer != 'tfidf':
+        print('Skipping fused/artifact export: only TF-IDF models can be fused')
+    elif args.fused_out or args.artifact_out:
+        with stage('fuse'):
+            fused = fuse_calibrated(calibrator)
+            diff = max_abs_diff(calibrator, fused, X[:5000])
+        print(f'Fused model max abs probability difference: {diff:.3g}')
+        if diff > args.fuse_tolerance:
+            raise SystemExit(f'Fused model differs from the original by {diff:.3g} > {args.fuse_tolerance}; '
+                             'not saving the fused model/serving artifact')
+        if args.fused_out:
+            with stage('serialize_fused'):
+                ensure_dir(args.fused_out)
+                dump_model(fused, args.fused_out)
+                annotate(file_bytes=os.path.getsize(args.fused_out))
+            print('Saved fused model to', args.fused_out)
+        if args.artifact_out:
+            with stage('serialize_artifact'):
+                ensure_dir(args.artifact_out)
+                version = write_artifact(fused, args.artifact_out)
+                annotate(file_bytes=os.path.getsize(args.artifact_out))
+            print('Saved serving artifact to', args.artifact_out, '(version', version + ')')
+
+    metrics = BinaryMetrics(y, oof_probs)
+    print(f'OOF Brier score: {metrics.brier():.4f}')
+    print(f'OOF ROC AUC: {metrics.roc_auc():.4f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default='data/ru_toxic/combined.csv')
+    parser.add_argument('--fallback', default='data/ru_toxic/sample_small.csv')
+    parser.add_argument('--oof_out', default='data/ru_toxic/combined_oof.csv')
+    parser.add_argument('--model_out', default='models/calibrated_model.joblib')
+    parser.add_argument('--n_splits', type=int, default=5)
+    parser.add_argument('--fused_out', default=None, help='Optional path to also save the fused serving model')
+    parser.add_argument('--artifact_out', default=None, help='Optional path to also save a fast-loading serving artifact')
+    parser.add_argument('--fuse_tolerance', type=float, default=1e-6, help='Maximum allowed absolute probability difference of the fused model')
+    parser.add_argument('--vectorizer', choices=['tfidf', 'hashing'], default='tfidf', help='tfidf: fitted vocabulary; hashing: stateless feature hashing')
+    parser.add_argument('--n_features', type=int, default=2**20, help='Number of hashed features for --vectorizer hashing')
+    parser.add_argument('--learner', choices=['lr', 'sgd'], default='lr', help='lr: in-memory LogisticRegression; sgd: stream the CSV through SGDClassifier.partial_fit (needs --vectorizer hashing)')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows per chunk for --learner sgd')
+    parser.add_argument('--epochs', type=int, default=5, help='Passes over the data for --learner sgd')
+    parser.add_argument('--sgd_alpha', type=float, default=1e-6, help='Regularization strength for --learner sgd')
+    parser.add_argument('--calib_every', type=int, default=20, help='For --learner sgd: hold out about 1 in N rows for calibration')
+    parser.add_argument('--calib_size', type=int, default=50000, help='For --learner sgd: maximum number of held-out calibration rows')
+    parser.add_argument('--engine', choices=['cached', 'sklearn'], default='cached', help='cached: tokenize the corpus once and fit TF-IDF per fold from cached counts; sklearn: refit TfidfVectorizer on texts in every fold')
+    parser.add_argument('--cache_dir', default='data/feature_cache', help='Directory of the persistent tokenization cache (--engine cached)')
+    parser.add_argument('--cache_max_mb', type=int, default=4096, help='Size limit of the tokenization cache; least recently used entries are evicted')
+    parser.add_argument('--no_cache', action='store_true', help='Do not read or write the tokenization cache')
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    inp = args.input if os.path.exists(args.input) else args.fallback
+    if not os.path.exists(inp):
+        raise FileNotFoundError(f'No input CSV found at {args.input} or fallback {args.fallback}')
+    # --input/--oof_out may also be Parquet (.parquet, or a partitioned dataset directory) or Arrow IPC (.arrow)
+
+    if args.learner == 'sgd':
+        if args.vectorizer != 'hashing':
+            parser.error('--learner sgd requires --vectorizer hashing (a TF-IDF vocabulary needs the whole corpus)')
+        if args.fused_out or args.artifact_out:
+            parser.error('--fused_out/--artifact_out are only supported for TF-IDF models')
+
+    with profiling(args):
+        if args.learner == 'sgd':
+            train_streaming(args, inp)
+        else:
+            train_in_memory(args, inp)
 
 
 if __name__ == '__main__':
@@ -0,0 +1 @@
+"""Shared inference and training helpers used by the bot, the console app and scripts."""
@@ -0,0 +1,147 @@
+"""Admission control for scoring requests: rate limits, a pending-request bound and coalescing.
+
+`AdmissionController.try_admit` decides, without waiting, whether a request
+is scored or shed:
+
+* ``duplicate``: a request with the same dedupe key (e.g. the same
+  ``reply_to_message`` in a chat) was admitted less than `coalesce_window`
+  seconds ago; the earlier answer covers it.
+* ``overloaded``: `max_pending` admitted requests have not finished yet.
+* ``chat_rate`` / ``user_rate``: the chat's or the user's token bucket is
+  empty (`rate` tokens per second, at most `burst` saved up).
+
+Tokens are only taken from the buckets of admitted requests, so requests
+shed for another reason do not use up a chat's or user's allowance.
+Shedding at admission keeps a flood from queueing work whose answers would
+arrive too late to matter; admitted requests must call `release()`, and
+`forget(dedupe_key)` if they fail, so a repeated request is served again. With
+``policy='busy'`` the caller may tell a shed chat that it is busy, at most
+once per `busy_notice_interval` (see `should_notify`); with ``'drop'`` shed
+requests are ignored silently.
+"""
+import time
+from collections import OrderedDict
+
+
+SHED_REASONS = ('duplicate', 'chat_rate', 'user_rate', 'overloaded')
+
+
+class KeyedRateLimiter:
+    """Token bucket per key; the least recently seen keys are forgotten beyond `max_keys`."""
+
+    def __init__(self, rate, burst, max_keys=100000):
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate must be > 0 and burst >= 1')
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def available(self, key, now):
+        """Whether `key` has a token, without taking it."""
+        return self._tokens(key, now) >= 1
+
+    def take(self, key, now):
+        tokens = self._tokens(key, now) - 1
+        self._buckets.pop(key, None)
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def allow(self, key, now):
+        """Take a token for `key` if it has one; returns whether it had."""
+        if not self.available(key, now):
+            return False
+        self.take(key, now)
+        return True
+
+
+class AdmissionController:
+    """Decide which scoring requests to serve; rates of 0 and `max_pending` of 0 disable those checks."""
+
+    def __init__(self, chat_rate=0, chat_burst=5, user_rate=0, user_burst=5, max_pending=0, coalesce_window=0,
+                 policy='drop', busy_notice_interval=10.0, max_keys=100000, clock=time.monotonic):
+        if policy not in ('drop', 'busy'):
+            raise ValueError("policy must be 'drop' or 'busy'")
+        self.chat_limiter = KeyedRateLimiter(chat_rate, chat_burst, max_keys) if chat_rate > 0 else None
+        self.user_limiter = KeyedRateLimiter(user_rate, user_burst, max_keys) if user_rate > 0 else None
+        self.max_pending = max_pending
+        self.coalesce_window = coalesce_window
+        self.policy = policy
+        self.busy_notice_interval = busy_notice_interval
+        self.max_keys = max_keys
+        self.clock = clock
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.admitted = 0
+        self.shed = dict.fromkeys(SHED_REASONS, 0)
+        self._recent = OrderedDict()
+        self._notified = OrderedDict()
+
+    def try_admit(self, chat_id=None, user_id=None, dedupe_key=None):
+        """None if the request is admitted (call `release()` when done), else the reason it is shed."""
+        now = self.clock()
+        reason = self._check(chat_id, user_id, dedupe_key, now)
+        if reason is not None:
+            self.shed[reason] += 1
+            return reason
+        if self.chat_limiter is not None and chat_id is not None:
+            self.chat_limiter.take(chat_id, now)
+        if self.user_limiter is not None and user_id is not None:
+            self.user_limiter.take(user_id, now)
+        self.pending += 1
+        self.admitted += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        if dedupe_key is not None and self.coalesce_window > 0:
+            self._remember(self._recent, dedupe_key, now)
+        return None
+
+    def _check(self, chat_id, user_id, dedupe_key, now):
+        if dedupe_key is not None and self.coalesce_window > 0:
+            # keys are kept in admission order, so expired ones are at the front
+            while self._recent and now - next(iter(self._recent.values())) >= self.coalesce_window:
+                self._recent.popitem(last=False)
+            seen = self._recent.get(dedupe_key)
+            if seen is not None and now - seen < self.coalesce_window:
+                return 'duplicate'
+        if self.max_pending and self.pending >= self.max_pending:
+            return 'overloaded'
+        if self.chat_limiter is not None and chat_id is not None and not self.chat_limiter.available(chat_id, now):
+            return 'chat_rate'
+        if self.user_limiter is not None and user_id is not None and not self.user_limiter.available(user_id, now):
+            return 'user_rate'
+        return None
+
+    def release(self):
+        self.pending -= 1
+
+    def forget(self, dedupe_key):
+        """Stop coalescing on `dedupe_key`: its admitted request failed and no answer was sent."""
+        if dedupe_key is not None:
+            self._recent.pop(dedupe_key, None)
+
+    def should_notify(self, chat_id, reason):
+        """Whether to tell the chat it was shed: only with the busy policy, never for duplicates,
+        and at most once per `busy_notice_interval` per chat so the notices do not become a flood themselves."""
+        if self.policy != 'busy' or reason == 'duplicate':
+            return False
+        now = self.clock()
+        last = self._notified.get(chat_id)
+        if last is not None and now - last < self.busy_notice_interval:
+            return False
+        self._remember(self._notified, chat_id, now)
+        return True
+
+    def _remember(self, entries, key, now):
+        entries.pop(key, None)
+        entries[key] = now
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+
+    def stats(self):
+        return {'pending': self.pending, 'max_pending_seen': self.max_pending_seen, 'admitted': self.admitted,
+                'shed': dict(self.shed)}
@@ -0,0 +1,241 @@
+"""Flat, memory-mapped serving artifact for fused TF-IDF + LR models.
+
+Unpickling a joblib model rebuilds every ``vocabulary_`` dict object by
+object. The artifact instead keeps all state in flat arrays that are mapped
+straight from the file, so loading costs one ``mmap`` and a small JSON parse.
+
+File layout::
+
+    magic (8 bytes) | format version (uint32) | header length (uint32)
+    JSON header: model metadata, tokenizer settings and an array table
+    arrays, each aligned to 64 bytes, at the offsets listed in the header
+
+The vocabulary is a sorted table of fixed-width UTF-8 byte strings; a token's
+column is its position in that table and lookup is one vectorized
+``np.searchsorted`` for a whole batch of tokens.
+"""
+import datetime
+import hashlib
+import json
+import os
+import stat
+import struct
+import tempfile
+
+import numpy as np
+from scipy import sparse
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.feature_extraction.text import CountVectorizer
+
+from toxicity.fused import FusedScorer, fuse_calibrated
+
+
+MAGIC = b'TOXSCORE'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<8sII')
+_ALIGN = 64
+
+_ANALYZER_PARAMS = (
+    'input', 'encoding', 'decode_error', 'strip_accents', 'lowercase',
+    'stop_words', 'token_pattern', 'ngram_range', 'analyzer',
+)
+
+
+class SortedVocabularyVectorizer:
+    """Count vectorizer backed by a sorted byte-string vocabulary array."""
+
+    def __init__(self, vocab, analyzer_params, binary=False):
+        self.vocab = vocab
+        self.analyzer_params = dict(analyzer_params)
+        self.binary = binary
+        self._analyzer = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_analyzer'] = None
+        return state
+
+    @property
+    def analyzer(self):
+        if self._analyzer is None:
+            params = dict(self.analyzer_params)
+            params['ngram_range'] = tuple(params['ngram_range'])
+            self._analyzer = CountVectorizer(**params).build_analyzer()
+        return self._analyzer
+
+    def get_feature_names_out(self):
+        return np.array([b.decode('utf-8') for b in self.vocab], dtype=object)
+
+    def transform(self, texts):
+        analyze = self.analyzer
+        tokens = [analyze(t) for t in texts]
+        lengths = np.fromiter((len(toks) for toks in tokens), dtype=np.int64, count=len(tokens))
+        # The table is one byte wider than its longest entry, so tokens that
+        # get truncated on conversion can never compare equal to an entry.
+        keys = np.array([tok.encode('utf-8') for toks in tokens for tok in toks], dtype=self.vocab.dtype)
+        if len(self.vocab) == 0:
+            return sparse.csr_matrix((len(tokens), 0), dtype=np.float64)
+        idx = np.searchsorted(self.vocab, keys)
+        np.minimum(idx, len(self.vocab) - 1, out=idx)
+        hit = self.vocab[idx] == keys
+        rows = np.repeat(np.arange(len(tokens)), lengths)[hit]
+        counts = sparse.csr_matrix(
+            (np.ones(int(hit.sum())), (rows, idx[hit])),
+            shape=(len(tokens), len(self.vocab)),
+            dtype=np.float64,
+        )
+        counts.sum_duplicates()
+        if self.binary:
+            counts.data[:] = 1.0
+        return counts
+
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_artifact(model, path, model_version=None):
+    """Write a fused model (or a fusable CalibratedClassifierCV) as a serving artifact.
+
+    The file is written next to `path` and renamed over it, so a process that
+    has the previous artifact memory-mapped keeps reading the old file.
+    """
+    if isinstance(model, CalibratedClassifierCV):
+        model = fuse_calibrated(model)
+    if not isinstance(model, FusedScorer) or not isinstance(model.vectorizer, (CountVectorizer, SortedVocabularyVectorizer)):
+        raise TypeError(f'Cannot write {type(model).__name__} as a serving artifact')
+
+    vec = model.vectorizer
+    if isinstance(vec, SortedVocabularyVectorizer):
+        analyzer_params, binary = vec.analyzer_params, vec.binary
+        tokens = [b.decode('utf-8') for b in vec.vocab]
+    else:
+        if vec.tokenizer is not None or vec.preprocessor is not None or callable(vec.analyzer):
+            raise ValueError('Custom tokenizer/preprocessor/analyzer callables cannot be stored in an artifact')
+        params = vec.get_params()
+        analyzer_params = {k: params[k] for k in _ANALYZER_PARAMS}
+        analyzer_params['ngram_range'] = list(analyzer_params['ngram_range'])
+        binary = bool(vec.binary)
+        tokens = [None] * len(vec.vocabulary_)
+        for tok, col in vec.vocabulary_.items():
+            tokens[col] = tok
+
+    encoded = [t.encode('utf-8') for t in tokens]
+    width = max((len(b) for b in encoded), default=0) + 1
+    order = np.argsort(np.array(encoded, dtype=f'S{width}'), kind='stable')
+    arrays = {
+        'vocab': np.array(encoded, dtype=f'S{width}')[order],
+        'coef': np.ascontiguousarray(model.coef_[order]),
+        'sq_idf': np.ascontiguousarray(model.sq_idf_[order]),
+        'intercept': np.ascontiguousarray(model.intercept_),
+        'cal_a': np.ascontiguousarray(model.cal_a_),
+        'cal_b': np.ascontiguousarray(model.cal_b_),
+    }
+    if np.any(arrays['vocab'][1:] == arrays['vocab'][:-1]):
+        raise ValueError('Vocabulary contains duplicate tokens')
+
+    if model_version is None:
+        digest = hashlib.blake2b(digest_size=8)
+        for name in sorted(arrays):
+            digest.update(arrays[name].tobytes())
+        digest.update(json.dumps(analyzer_params, sort_keys=True).encode('utf-8'))
+        model_version = digest.hexdigest()
+
+    table, offset = {}, 0
+    for name, arr in arrays.items():
+        table[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset = _aligned(offset + arr.nbytes)
+    header = {
+        'format_version': FORMAT_VERSION,
+        'model_type': 'fused_tfidf_lr',
+        'model_version': model_version,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'analyzer': analyzer_params,
+        'binary': binary,
+        'sublinear_tf': bool(model.sublinear_tf),
+        'classes': np.asarray(model.classes_).tolist(),
+        'arrays': table,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = _aligned(_PREFIX.size + len(header_bytes))
+
+    d = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=d, prefix='.tmp-', suffix='.tox')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            for name, arr in arrays.items():
+                f.seek(data_start + table[name]['offset'])
+                f.write(arr.tobytes())
+            f.truncate(data_start + offset)
+        replace_file(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return model_version
+
+
+def replace_file(tmp, path):
+    """`os.replace` `tmp` over `path`, keeping the mode of the file it replaces.
+
+    `tempfile.mkstemp` creates owner-only files; a new `path` gets the mode
+    a plain `open` would give it, so services running as another user can
+    still read the model.
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(tmp, mode)
+    os.replace(tmp, path)
+
+
+def is_artifact(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def read_header(path):
+    """Return (header dict, offset of the array section) without mapping the arrays."""
+    with open(path, 'rb') as f:
+        magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a serving artifact')
+        if version > FORMAT_VERSION:
+            raise ValueError(f'Unsupported artifact format version {version} (supported <= {FORMAT_VERSION})')
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    return header, _aligned(_PREFIX.size + header_len)
+
+
+def load_artifact(path):
+    """Memory-map a serving artifact and return a ready-to-use FusedScorer."""
+    header, data_start = read_header(path)
+    buf = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        arr = np.frombuffer(buf, dtype=dtype, count=count, offset=data_start + spec['offset'])
+        arrays[name] = arr.reshape(spec['shape'])
+
+    vectorizer = SortedVocabularyVectorizer(arrays['vocab'], header['analyzer'], binary=header['binary'])
+    model = FusedScorer(
+        vectorizer,
+        coef=arrays['coef'],
+        sq_idf=arrays['sq_idf'],
+        intercept=arrays['intercept'],
+        cal_a=arrays['cal_a'],
+        cal_b=arrays['cal_b'],
+        sublinear_tf=header['sublinear_tf'],
+        classes=header['classes'],
+    )
+    model.artifact_path = path
+    model.model_version = header['model_version']
+    return model
@@ -0,0 +1,158 @@
+"""Reading and writing datasets as CSV, Parquet or Arrow IPC.
+
+The format is chosen by file extension: ``.csv``, ``.parquet`` or
+``.arrow``/``.feather`` (Arrow IPC file format). A directory is read as a
+Parquet dataset, e.g. one written with ``partition_cols=['source']`` that keeps
+one partition per source corpus. Arrow IPC files are memory-mapped, so columns
+are read without copying; all readers support column projection.
+"""
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+TABLE_EXTENSIONS = ('.csv', '.parquet', '.arrow', '.feather')
+
+
+def table_format(path):
+    if os.path.isdir(path):
+        return 'dataset'
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext == '.parquet':
+        return 'parquet'
+    if ext in ('.arrow', '.feather'):
+        return 'arrow'
+    raise ValueError(f'Unsupported table format: {path} (expected one of {", ".join(TABLE_EXTENSIONS)} or a directory)')
+
+
+def is_table_file(path):
+    return os.path.splitext(path)[1].lower() in TABLE_EXTENSIONS
+
+
+def with_extension(path, fmt):
+    """`path` with its extension replaced by the one for `fmt` ('csv', 'parquet' or 'arrow')."""
+    return os.path.splitext(path)[0] + {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}[fmt]
+
+
+def read_arrow(path, columns=None):
+    """Read a Parquet/Arrow file or dataset directory as a `pyarrow.Table` (CSV is converted)."""
+    fmt = table_format(path)
+    if fmt == 'arrow':
+        # Record batches reference the mapped file directly: no copy is made
+        table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        return table.select(columns) if columns else table
+    if fmt == 'parquet':
+        return pq.read_table(path, columns=columns, memory_map=True)
+    if fmt == 'dataset':
+        return ds.dataset(path, format='parquet', partitioning='hive').to_table(columns=columns)
+    return pa.Table.from_pandas(pd.read_csv(path, usecols=columns), preserve_index=False)
+
+
+def read_table(path, columns=None):
+    """Read any supported table into a DataFrame, loading only `columns` when given."""
+    if table_format(path) == 'csv':
+        return pd.read_csv(path, usecols=columns)
+    return read_arrow(path, columns).to_pandas()
+
+
+def iter_batches(path, columns=None, batch_size=100000):
+    """Yield DataFrames of at most `batch_size` rows without loading the whole table."""
+    fmt = table_format(path)
+    if fmt == 'csv':
+        yield from pd.read_csv(path, usecols=columns, chunksize=batch_size)
+        return
+    if fmt == 'parquet':
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_size, columns=columns)
+    elif fmt == 'arrow':
+        reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+        table = reader.read_all()
+        batches = (table.select(columns) if columns else table).to_batches(max_chunksize=batch_size)
+    else:
+        batches = ds.dataset(path, format='parquet', partitioning='hive').to_batches(columns=columns, batch_size=batch_size)
+    for batch in batches:
+        yield batch.to_pandas()
+
+
+def write_table(df, path, partition_cols=None):
+    """Write `df` in the format given by the extension of `path` (a directory when partitioned)."""
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    if partition_cols:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_to_dataset(table, path, partition_cols=list(partition_cols), existing_data_behavior='delete_matching')
+        return
+    fmt = table_format(path)
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+        return
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if fmt == 'parquet':
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+class TableWriter:
+    """Append DataFrames to a CSV, Parquet or Arrow IPC file one chunk at a time.
+
+    With `partition_cols` the output is a Parquet dataset directory (replaced
+    if it exists) and every chunk adds one file to each partition it touches.
+    """
+
+    def __init__(self, path, partition_cols=None):
+        self.path = path
+        self.partition_cols = list(partition_cols) if partition_cols else None
+        self.format = 'dataset' if self.partition_cols else table_format(path)
+        self._writer = None
+        self._sink = None
+        self._schema = None
+        self._chunks = 0
+        self.rows = 0
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        if self.partition_cols and os.path.isdir(path):
+            shutil.rmtree(path)
+
+    def write(self, df):
+        if self.format == 'dataset':
+            pq.write_to_dataset(
+                pa.Table.from_pandas(df, preserve_index=False), self.path, partition_cols=self.partition_cols,
+                basename_template=f'part-{self._chunks}-{{i}}.parquet', existing_data_behavior='overwrite_or_ignore',
+            )
+            self._chunks += 1
+        elif self.format == 'csv':
+            df.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0, index=False)
+        else:
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                if self.format == 'parquet':
+                    self._writer = pq.ParquetWriter(self.path, self._schema)
+                else:
+                    self._sink = pa.OSFile(self.path, 'wb')
+                    self._writer = pa.ipc.new_file(self._sink, self._schema)
+            self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
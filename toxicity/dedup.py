@@ -0,0 +1,214 @@
+"""Exact and near-duplicate detection for text corpora with a persistent index.
+
+Texts are normalized (lowercase, ё -> е, URLs and mentions removed,
+punctuation collapsed to spaces) and hashed. A repeated hash is an exact
+duplicate. A text that normalizes to nothing (only emoji or punctuation) is
+hashed as it is, so different ones are not merged. Remaining texts get a
+MinHash signature over character 5-gram shingles: `HashingVectorizer`
+produces the shingle ids and numpy evaluates the ``num_perm`` universal hash
+functions. Signatures are split into ``bands`` bands for LSH. A text is a near
+duplicate if it shares a band with an earlier text (in the index or earlier in
+the batch) whose estimated Jaccard similarity is at least ``threshold``; every
+earlier text in the band bucket is compared. Texts shorter than one shingle
+have no signature and are only checked for exact duplicates: short insults
+("лох", "дура") must not be merged with each other.
+
+`DedupIndex` keeps hashes and signatures of everything it has accepted.
+`save`/`load` persist them, so later batches are deduplicated against all
+earlier ones.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+
+
+KEEP, EXACT, NEAR = 0, 1, 2
+STATUS_NAMES = {KEEP: 'kept', EXACT: 'exact', NEAR: 'near'}
+
+INDEX_VERSION = 1
+_PRIME = np.uint64((1 << 31) - 1)
+_URL_RE = r'(?:https?://|www\.)\S+'
+_MENTION_RE = r'[@#]\w+'
+
+
+def normalize_texts(texts):
+    """Canonical form used for hashing: lowercase, no URLs/mentions/punctuation, single spaces."""
+    s = pd.Series(texts, dtype=object).fillna('').astype(str).str.lower()
+    s = s.str.replace('ё', 'е', regex=False)
+    s = s.str.replace(_URL_RE, ' ', regex=True).str.replace(_MENTION_RE, ' ', regex=True)
+    s = s.str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+    return s.reset_index(drop=True)
+
+
+def exact_hashes(normalized):
+    return pd.util.hash_pandas_object(pd.Series(normalized, dtype=object), index=False).to_numpy()
+
+
+class DedupIndex:
+    """Hashes and MinHash/LSH tables of all texts accepted so far."""
+
+    def __init__(self, num_perm=64, bands=8, threshold=0.8, shingle_size=5, seed=1):
+        if num_perm % bands:
+            raise ValueError('num_perm must be divisible by bands')
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self._band_mult = rng.integers(1, 1 << 63, size=num_perm // bands, dtype=np.uint64) | np.uint64(1)
+        self._shingler = HashingVectorizer(
+            analyzer='char', ngram_range=(shingle_size, shingle_size), lowercase=False,
+            n_features=(1 << 31) - 1, alternate_sign=False, norm=None, dtype=np.float32,
+        )
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._build_bands()
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _build_bands(self):
+        keys = self.band_keys(self.signatures)
+        self._band_order = [np.argsort(keys[:, b], kind='stable') for b in range(self.bands)]
+        self._band_sorted = [keys[order, b] for b, order in enumerate(self._band_order)]
+
+    def _add_signatures(self, sig):
+        """Append `sig` to the index, merging its band keys into the sorted band tables."""
+        first = len(self.signatures)
+        self.signatures = np.vstack([self.signatures, sig])
+        keys = self.band_keys(sig)
+        for b in range(self.bands):
+            order = np.argsort(keys[:, b], kind='stable')
+            new_keys = keys[order, b]
+            # after equal keys, so a lookup still finds the earliest text first
+            at = np.searchsorted(self._band_sorted[b], new_keys, side='right')
+            self._band_sorted[b] = np.insert(self._band_sorted[b], at, new_keys)
+            self._band_order[b] = np.insert(self._band_order[b], at, order + first)
+
+    def minhash(self, normalized):
+        """MinHash signatures, shape (n_texts, num_perm), uint32."""
+        X = self._shingler.transform(normalized).tocsr()
+        X.sum_duplicates()
+        sig = np.full((X.shape[0], self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        nonempty = np.flatnonzero(np.diff(X.indptr))
+        if len(nonempty):
+            ids = X.indices.astype(np.uint64)
+            starts = X.indptr[nonempty]
+            for i in range(self.num_perm):
+                vals = (self._a[i] * ids + self._b[i]) % _PRIME
+                sig[nonempty, i] = np.minimum.reduceat(vals, starts)
+        return sig
+
+    def band_keys(self, sig):
+        r = self.num_perm // self.bands
+        bands = sig.astype(np.uint64).reshape(len(sig), self.bands, r)
+        return (bands * self._band_mult).sum(axis=2, dtype=np.uint64)
+
+    def _similar(self, sig, rows, refs, other):
+        return (sig[rows] == other[refs]).mean(axis=1) >= self.threshold
+
+    def _match_index(self, sig, keys, b, near):
+        """Mark rows similar to any indexed text in their bucket of band `b`."""
+        lo = np.searchsorted(self._band_sorted[b], keys, side='left')
+        hi = np.searchsorted(self._band_sorted[b], keys, side='right')
+        rows = np.flatnonzero((lo < hi) & ~near)
+        # step d compares each row with the d-th member of its bucket
+        d = 0
+        while len(rows):
+            refs = self._band_order[b][lo[rows] + d]
+            near[rows[self._similar(sig, rows, refs, self.signatures)]] = True
+            d += 1
+            rows = rows[(lo[rows] + d < hi[rows]) & ~near[rows]]
+
+    def _match_batch(self, sig, keys, near):
+        """Mark rows similar to any earlier row of the batch with the same band key."""
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.r_[0, np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1]
+        group_start = np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+        # positions in `order`; step d compares each row with the row d places before it
+        at = np.flatnonzero(np.arange(len(keys)) > group_start)
+        d = 1
+        while len(at):
+            at = at[~near[order[at]]]
+            rows = order[at]
+            near[rows[self._similar(sig, rows, order[at - d], sig)]] = True
+            d += 1
+            at = at[at - d >= group_start[at]]
+
+    def dedup(self, texts, update=True):
+        """Status (KEEP, EXACT or NEAR) of each text; kept texts are added to the index."""
+        normalized = normalize_texts(texts)
+        raw = pd.Series(texts, dtype=object).fillna('').astype(str).str.strip().reset_index(drop=True)
+        hashes = exact_hashes(normalized.where(normalized != '', raw))
+        n = len(hashes)
+        status = np.full(n, KEEP, dtype=np.int8)
+        if n == 0:
+            return status
+
+        pos = np.searchsorted(self.hashes, hashes)
+        seen = pos < len(self.hashes)
+        seen[seen] = self.hashes[pos[seen]] == hashes[seen]
+        status[seen | pd.Series(hashes).duplicated().to_numpy()] = EXACT
+
+        new = np.flatnonzero(status == KEEP)
+        # texts without a single shingle would all share the empty signature
+        cand = new[(normalized.iloc[new].str.len() >= self.shingle_size).to_numpy()]
+        if not len(cand):
+            if update:
+                self._add_hashes(hashes[new])
+            return status
+        sig = self.minhash(normalized.iloc[cand])
+        keys = self.band_keys(sig)
+        near = np.zeros(len(cand), dtype=bool)
+        for b in range(self.bands):
+            self._match_index(sig, keys[:, b], b, near)
+            self._match_batch(sig, keys[:, b], near)
+        status[cand[near]] = NEAR
+
+        if update:
+            self._add_hashes(hashes[new])
+            self._add_signatures(sig[~near])
+        return status
+
+    def _add_hashes(self, hashes):
+        hashes = np.unique(hashes)
+        self.hashes = np.insert(self.hashes, np.searchsorted(self.hashes, hashes), hashes)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'hashes.npy'), self.hashes, allow_pickle=False)
+        np.save(os.path.join(path, 'signatures.npy'), self.signatures, allow_pickle=False)
+        meta = {
+            'version': INDEX_VERSION, 'num_perm': self.num_perm, 'bands': self.bands, 'threshold': self.threshold,
+            'shingle_size': self.shingle_size, 'seed': self.seed, 'texts': len(self),
+        }
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=1)
+
+    @classmethod
+    def load(cls, path, threshold=None):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f'Unsupported dedup index version: {meta.get("version")}')
+        index = cls(num_perm=meta['num_perm'], bands=meta['bands'],
+                    threshold=meta['threshold'] if threshold is None else threshold,
+                    shingle_size=meta['shingle_size'], seed=meta['seed'])
+        index.hashes = np.load(os.path.join(path, 'hashes.npy'), allow_pickle=False)
+        index.signatures = np.load(os.path.join(path, 'signatures.npy'), allow_pickle=False)
+        index._build_bands()
+        return index
+
+    @classmethod
+    def open(cls, path=None, threshold=0.8):
+        """Load the index at `path` if it exists, otherwise start an empty one."""
+        if path and os.path.exists(os.path.join(path, 'meta.json')):
+            return cls.load(path, threshold=threshold)
+        return cls(threshold=threshold)
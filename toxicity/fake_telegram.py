@@ -0,0 +1,83 @@
+"""Minimal stand-ins for python-telegram-bot objects, to drive the bot handlers without a network.
+
+The handlers only read a few attributes of `Update`, `Message`, `Chat` and
+`User` and call `Message.reply_text`; these classes provide exactly those.
+Replies are recorded in a `ReplyLog` instead of being sent, optionally after
+a simulated network delay.
+"""
+import asyncio
+import datetime
+import itertools
+import time
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeChat:
+    def __init__(self, chat_id, chat_type='private'):
+        self.id = chat_id
+        self.type = chat_type
+
+
+class ReplyLog:
+    """Replies "sent" by the handlers: (message, reply text, perf_counter time)."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.replies = []
+
+    async def send(self, message, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.replies.append((message, text, time.perf_counter()))
+
+    def texts(self):
+        return [text for _, text, _ in self.replies]
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, text, chat, from_user=None, reply_to_message=None, reply_log=None, message_id=None):
+        self.message_id = message_id if message_id is not None else next(self._ids)
+        self.text = text
+        self.caption = None
+        self.chat = chat
+        self.from_user = from_user
+        self.reply_to_message = reply_to_message
+        self.date = datetime.datetime.now(datetime.timezone.utc)
+        self.reply_log = reply_log
+
+    async def reply_text(self, text, **kwargs):
+        if self.reply_log is not None:
+            await self.reply_log.send(self, text)
+
+
+class FakeUpdate:
+    _ids = itertools.count(1)
+
+    def __init__(self, message):
+        self.update_id = next(self._ids)
+        self.message = message
+
+
+class FakeContext:
+    """What the handlers use of `ContextTypes.DEFAULT_TYPE` (and of the application in lifecycle hooks)."""
+
+    def __init__(self, bot_data=None):
+        self.bot_data = bot_data if bot_data is not None else {}
+
+
+def private_update(text, user_id, reply_log=None):
+    """A direct message from `user_id`."""
+    return FakeUpdate(FakeMessage(text, FakeChat(user_id, 'private'), FakeUser(user_id), reply_log=reply_log))
+
+
+def group_check_update(target_text, chat_id, user_id, target_message_id=None, trigger='токс?', reply_log=None):
+    """A group message with the trigger word replying to a message with `target_text`."""
+    chat = FakeChat(chat_id, 'group')
+    target = FakeMessage(target_text, chat, FakeUser(-1), message_id=target_message_id)
+    return FakeUpdate(FakeMessage(trigger, chat, FakeUser(user_id), reply_to_message=target, reply_log=reply_log))
@@ -0,0 +1,208 @@
+"""On-disk cache of tokenized datasets keyed by input file content and vectorizer settings.
+
+Each entry is a directory of ``.npy`` files (CSR parts, the columns of the
+input table with texts as a UTF-8 blob with offsets, ...) that are loaded with ``mmap_mode='r'``, plus a
+``meta.json``. ``index.json`` records entry sizes and last use for LRU
+eviction once the cache grows beyond `max_bytes`, and memoizes file content
+hashes by (size, mtime) so unchanged inputs are not re-hashed on every run.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+_INDEX = 'index.json'
+_HASH_BLOCK = 1 << 20
+
+
+def file_digest(path):
+    """Hex blake2b-128 digest of a file's content."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def encode_texts(texts):
+    """Pack strings into a UTF-8 byte blob and an offsets array (len(texts) + 1)."""
+    encoded = [str(t).encode('utf-8') for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def decode_texts(blob, offsets):
+    raw = blob.tobytes()
+    return [raw[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def encode_frame(df, prefix='column'):
+    """Arrays holding the columns of `df`, and the column list to keep in the entry's meta.
+
+    Numeric and boolean columns are stored as they are; other columns as UTF-8
+    text with a mask of missing values, so they come back as strings and NaN.
+    """
+    arrays = {}
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        key = f'{prefix}{i}'
+        if col.dtype.kind in 'biuf':
+            arrays[key + '_values'] = col.to_numpy()
+            columns.append([name, 'values'])
+        else:
+            missing = col.isna().to_numpy()
+            arrays[key + '_missing'] = missing
+            arrays[key + '_blob'], arrays[key + '_offsets'] = encode_texts(col.mask(missing, '').astype(str))
+            columns.append([name, 'text'])
+    return arrays, columns
+
+
+def decode_frame(arrays, columns, prefix='column'):
+    data = {}
+    for i, (name, kind) in enumerate(columns):
+        key = f'{prefix}{i}'
+        if kind == 'values':
+            data[name] = np.array(arrays[key + '_values'])
+            continue
+        values = np.array(decode_texts(arrays[key + '_blob'], arrays[key + '_offsets']), dtype=object)
+        values[np.asarray(arrays[key + '_missing'])] = np.nan
+        data[name] = values
+    return pd.DataFrame(data, columns=[name for name, _ in columns])
+
+
+def csr_to_arrays(prefix, matrix):
+    matrix = sparse.csr_matrix(matrix)
+    return {
+        f'{prefix}_data': matrix.data,
+        f'{prefix}_indices': matrix.indices,
+        f'{prefix}_indptr': matrix.indptr,
+        f'{prefix}_shape': np.asarray(matrix.shape, dtype=np.int64),
+    }
+
+
+def arrays_to_csr(prefix, arrays):
+    shape = tuple(int(n) for n in arrays[f'{prefix}_shape'])
+    return sparse.csr_matrix(
+        (arrays[f'{prefix}_data'], arrays[f'{prefix}_indices'], arrays[f'{prefix}_indptr']),
+        shape=shape, copy=False,
+    )
+
+
+class FeatureCache:
+    """Size-bounded LRU cache of numpy arrays stored as memory-mappable ``.npy`` files."""
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, _INDEX)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault('entries', {})
+        index.setdefault('file_hashes', {})
+        return index
+
+    def _save_index(self, index):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, self._index_path())
+
+    def file_hash(self, path):
+        """Content hash of `path`, recomputed only when its size or mtime changes.
+
+        A directory (e.g. a partitioned Parquet dataset) hashes the relative
+        paths and content hashes of all files below it.
+        """
+        if os.path.isdir(path):
+            digest = hashlib.blake2b(digest_size=16)
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fn in sorted(files):
+                    p = os.path.join(root, fn)
+                    digest.update(os.path.relpath(p, path).encode('utf-8') + b'\0')
+                    digest.update(self.file_hash(p).encode('ascii'))
+            return digest.hexdigest()
+        st = os.stat(path)
+        index = self._load_index()
+        known = index['file_hashes'].get(os.path.abspath(path))
+        if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+            return known['hash']
+        digest = file_digest(path)
+        index['file_hashes'][os.path.abspath(path)] = {
+            'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': digest,
+        }
+        self._save_index(index)
+        return digest
+
+    def make_key(self, path, params):
+        payload = json.dumps({'file': self.file_hash(path), 'params': params}, sort_keys=True, default=repr)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def get(self, key):
+        """Return (arrays, meta) for `key` with arrays memory-mapped, or None on a miss."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode='r', allow_pickle=False)
+            for name in meta['arrays']
+        }
+        index = self._load_index()
+        if key in index['entries']:
+            index['entries'][key]['last_used'] = time.time()
+            self._save_index(index)
+        return arrays, meta
+
+    def put(self, key, arrays, meta=None):
+        meta = dict(meta or {})
+        meta['arrays'] = sorted(arrays)
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        size = 0
+        for name, arr in arrays.items():
+            path = os.path.join(tmp_dir, name + '.npy')
+            np.save(path, np.ascontiguousarray(arr), allow_pickle=False)
+            size += os.path.getsize(path)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, default=repr)
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+
+        index = self._load_index()
+        now = time.time()
+        index['entries'][key] = {'size': size, 'created': now, 'last_used': now}
+        self._evict(index, keep=key)
+        self._save_index(index)
+
+    def _evict(self, index, keep=None):
+        entries = index['entries']
+        total = sum(e['size'] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= entries.pop(key)['size']
@@ -0,0 +1,136 @@
+"""Tokenize a training corpus once and fit TF-IDF per CV fold from the cached counts.
+
+Nested cross-validation with ``CalibratedClassifierCV(Pipeline(tfidf, clf))``
+re-tokenizes the same texts for every inner and outer fold. `TokenCounts`
+holds the full term-count matrix of the corpus (columns in the alphabetical
+order `CountVectorizer` uses), and `CachedTfidfVectorizer` is a drop-in
+TF-IDF step whose "documents" are row ids into that matrix: fitting only
+slices rows, selects the `max_features` most frequent terms exactly like
+`TfidfVectorizer` and recomputes IDF. Because ids stand in for texts, the
+usual scikit-learn CV utilities produce the same folds and the same
+probabilities as training on the texts themselves.
+"""
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, TfidfVectorizer
+
+from toxicity.feature_cache import arrays_to_csr, csr_to_arrays, decode_texts, encode_texts
+
+
+class TokenCounts:
+    """Term counts of a whole corpus: CSR matrix (n_texts, n_terms) plus the sorted term list.
+
+    Treated as read-only and shared: deep copies (e.g. from `sklearn.base.clone`)
+    return the same object instead of copying the matrix.
+    """
+
+    def __init__(self, counts, terms, count_params):
+        self.counts = counts
+        self.terms = terms
+        self.count_params = dict(count_params)
+
+    @classmethod
+    def from_texts(cls, texts, **count_params):
+        vec = CountVectorizer(dtype=np.float64, **count_params)
+        counts = vec.fit_transform(texts).tocsr()
+        counts.sort_indices()
+        return cls(counts, vec.get_feature_names_out(), vec.get_params())
+
+    @classmethod
+    def from_arrays(cls, arrays, **count_params):
+        """Rebuild from `to_arrays` output (e.g. memory-mapped feature cache arrays)."""
+        terms = np.array(decode_texts(arrays['terms_blob'], arrays['terms_offsets']), dtype=object)
+        params = CountVectorizer(dtype=np.float64, **count_params).get_params()
+        return cls(arrays_to_csr('counts', arrays), terms, params)
+
+    def to_arrays(self):
+        arrays = csr_to_arrays('counts', self.counts)
+        arrays['terms_blob'], arrays['terms_offsets'] = encode_texts(self.terms)
+        return arrays
+
+    def __len__(self):
+        return self.counts.shape[0]
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def rows(self, ids):
+        return self.counts[np.asarray(ids, dtype=np.int64)]
+
+
+class CachedTfidfVectorizer(TransformerMixin, BaseEstimator):
+    """`TfidfVectorizer` equivalent that takes row ids of a `TokenCounts` instead of texts."""
+
+    def __init__(self, token_counts=None, max_features=None, norm='l2', use_idf=True, smooth_idf=True, sublinear_tf=False):
+        self.token_counts = token_counts
+        self.max_features = max_features
+        self.norm = norm
+        self.use_idf = use_idf
+        self.smooth_idf = smooth_idf
+        self.sublinear_tf = sublinear_tf
+
+    def fit(self, ids, y=None):
+        self._fit(ids)
+        return self
+
+    def fit_transform(self, ids, y=None):
+        X = self._fit(ids)
+        return self._tfidf.transform(X, copy=False)
+
+    def _fit(self, ids):
+        sub = self.token_counts.rows(ids)
+        df = np.bincount(sub.indices, minlength=sub.shape[1])
+        present = np.flatnonzero(df)
+        # Same selection as CountVectorizer._limit_features: terms in
+        # alphabetical order, then the (unstable) argsort of negated frequencies.
+        if self.max_features is not None and len(present) > self.max_features:
+            tfs = np.asarray(sub.sum(axis=0)).ravel()
+            keep = np.sort(present[(-tfs[present]).argsort()[: self.max_features]])
+        else:
+            keep = present
+        self.columns_ = keep
+        X = self._select(sub)
+        self._tfidf = TfidfTransformer(
+            norm=self.norm, use_idf=self.use_idf, smooth_idf=self.smooth_idf, sublinear_tf=self.sublinear_tf,
+        ).fit(X)
+        return X
+
+    def _select(self, sub):
+        X = sub[:, self.columns_]
+        X.sort_indices()
+        return X
+
+    def transform(self, ids):
+        return self._tfidf.transform(self._select(self.token_counts.rows(ids)), copy=False)
+
+    def to_text_vectorizer(self):
+        """Equivalent fitted `TfidfVectorizer` that works on raw texts."""
+        params = dict(self.token_counts.count_params)
+        for key in ('dtype', 'max_features', 'vocabulary'):
+            params.pop(key, None)
+        vec = TfidfVectorizer(
+            max_features=self.max_features, norm=self.norm, use_idf=self.use_idf,
+            smooth_idf=self.smooth_idf, sublinear_tf=self.sublinear_tf, **params,
+        )
+        terms = self.token_counts.terms[self.columns_]
+        vec.vocabulary_ = {str(t): i for i, t in enumerate(terms)}
+        vec.fixed_vocabulary_ = False
+        vec._tfidf = self._tfidf
+        return vec
+
+
+def calibrated_to_text_model(calibrator, text_estimator):
+    """Replace the id-based TF-IDF steps of a fitted CalibratedClassifierCV with text vectorizers.
+
+    `text_estimator` is the unfitted text pipeline the model should report as
+    its base estimator.
+    """
+    for cc in calibrator.calibrated_classifiers_:
+        name, step = cc.estimator.steps[0]
+        if isinstance(step, CachedTfidfVectorizer):
+            cc.estimator.steps[0] = (name, step.to_text_vectorizer())
+    calibrator.estimator = text_estimator
+    for attr in ('n_features_in_', 'feature_names_in_'):
+        if attr in vars(calibrator):
+            delattr(calibrator, attr)
+    return calibrator
@@ -0,0 +1,160 @@
+"""Fused serving form of the calibrated TF-IDF + logistic regression ensemble.
+
+`CalibratedClassifierCV(cv=5)` keeps five fitted ``Pipeline(tfidf, clf)``
+copies whose vocabularies mostly overlap, so scoring one text tokenizes it five
+times. For fold ``k`` the TF-IDF row is ``c * idf_k / ||c * idf_k||`` where
+``c`` are the raw term counts, hence its decision value can be computed from
+counts over the union vocabulary alone::
+
+    f_k = (c @ (idf_k * w_k)) / sqrt(c**2 @ idf_k**2) + b_k
+
+`FusedScorer` stores those per-fold columns side by side, so every text is
+tokenized once and all folds and their sigmoid calibrators are evaluated with
+two sparse-dense matrix products.
+"""
+import hashlib
+
+import numpy as np
+from scipy.special import expit
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.pipeline import Pipeline
+
+
+_COUNT_PARAMS = (
+    'input', 'encoding', 'decode_error', 'strip_accents', 'lowercase', 'preprocessor',
+    'tokenizer', 'stop_words', 'token_pattern', 'ngram_range', 'analyzer', 'binary',
+)
+
+
+class FusedScorer:
+    """Tokenize once, score every calibrated fold with one matrix product and average."""
+
+    def __init__(self, vectorizer, coef, sq_idf, intercept, cal_a, cal_b, sublinear_tf=False, classes=(0, 1)):
+        self.vectorizer = vectorizer
+        self.coef_ = np.asarray(coef, dtype=np.float64)
+        self.sq_idf_ = np.asarray(sq_idf, dtype=np.float64)
+        self.intercept_ = np.asarray(intercept, dtype=np.float64)
+        self.cal_a_ = np.asarray(cal_a, dtype=np.float64)
+        self.cal_b_ = np.asarray(cal_b, dtype=np.float64)
+        self.sublinear_tf = sublinear_tf
+        self.classes_ = np.asarray(classes)
+
+    @property
+    def n_folds(self):
+        return self.coef_.shape[1]
+
+    def transform(self, texts):
+        """Raw (or sublinear) term counts over the shared vocabulary as CSR."""
+        counts = self.vectorizer.transform(texts)
+        if self.sublinear_tf:
+            np.log(counts.data, counts.data)
+            counts.data += 1
+        return counts
+
+    def decision_from_counts(self, counts):
+        """Per-fold logistic regression decision values, shape (n_texts, n_folds)."""
+        num = np.asarray(counts @ self.coef_)
+        norm = np.sqrt(np.asarray(counts.multiply(counts) @ self.sq_idf_))
+        norm[norm == 0.0] = 1.0
+        return num / norm + self.intercept_
+
+    def proba_from_counts(self, counts):
+        """Calibrated P(toxic) averaged over folds, shape (n_texts,)."""
+        dec = self.decision_from_counts(counts)
+        return expit(-(dec * self.cal_a_ + self.cal_b_)).mean(axis=1)
+
+    def predict_proba(self, texts):
+        pos = self.proba_from_counts(self.transform(texts))
+        return np.column_stack([1.0 - pos, pos])
+
+    def predict(self, texts):
+        return self.classes_[(self.predict_proba(texts)[:, 1] >= 0.5).astype(int)]
+
+
+def _split_pipeline(pipe):
+    if not isinstance(pipe, Pipeline) or len(pipe.steps) != 2:
+        raise ValueError('Expected a Pipeline of (TfidfVectorizer, linear classifier)')
+    tfidf, clf = pipe.steps[0][1], pipe.steps[1][1]
+    if not isinstance(tfidf, TfidfVectorizer):
+        raise ValueError(f'Unsupported vectorizer: {type(tfidf).__name__}')
+    if tfidf.norm != 'l2' or not tfidf.use_idf:
+        raise ValueError('Only TF-IDF with use_idf=True and norm="l2" can be fused')
+    coef = np.asarray(clf.coef_)
+    if coef.shape[0] != 1:
+        raise ValueError('Only binary classifiers can be fused')
+    return tfidf, coef[0], float(np.ravel(clf.intercept_)[0])
+
+
+def fuse_calibrated(model):
+    """Build a FusedScorer equivalent to a fitted sigmoid `CalibratedClassifierCV` over TF-IDF + LR."""
+    if not isinstance(model, CalibratedClassifierCV):
+        raise TypeError(f'Expected CalibratedClassifierCV, got {type(model).__name__}')
+    if model.method != 'sigmoid':
+        raise ValueError('Only sigmoid calibration can be fused')
+    if len(model.classes_) != 2:
+        raise ValueError('Only binary models can be fused')
+
+    folds = []
+    for cc in model.calibrated_classifiers_:
+        tfidf, w, b = _split_pipeline(cc.estimator)
+        if list(cc.estimator.classes_) != list(model.classes_):
+            raise ValueError('Inner classifier classes differ from calibrator classes')
+        cal = cc.calibrators[0]
+        folds.append((tfidf, w, b, float(cal.a_), float(cal.b_)))
+
+    first = folds[0][0]
+    params = {k: first.get_params()[k] for k in _COUNT_PARAMS}
+    for tfidf, *_ in folds[1:]:
+        other = {k: tfidf.get_params()[k] for k in _COUNT_PARAMS}
+        if other != params or tfidf.sublinear_tf != first.sublinear_tf:
+            raise ValueError('Inner TF-IDF vectorizers use different tokenization settings')
+
+    vocab = sorted(set().union(*(tfidf.vocabulary_ for tfidf, *_ in folds)))
+    index = {tok: i for i, tok in enumerate(vocab)}
+    coef = np.zeros((len(vocab), len(folds)))
+    sq_idf = np.zeros((len(vocab), len(folds)))
+    for k, (tfidf, w, _, _, _) in enumerate(folds):
+        cols = np.empty(len(tfidf.vocabulary_), dtype=np.int64)
+        rows = np.empty(len(tfidf.vocabulary_), dtype=np.int64)
+        for j, (tok, col) in enumerate(tfidf.vocabulary_.items()):
+            rows[j] = index[tok]
+            cols[j] = col
+        idf = tfidf.idf_[cols]
+        coef[rows, k] = idf * w[cols]
+        sq_idf[rows, k] = idf * idf
+
+    vectorizer = CountVectorizer(vocabulary=index, dtype=np.float64, **params)
+    vectorizer._validate_vocabulary()
+    return FusedScorer(
+        vectorizer,
+        coef=coef,
+        sq_idf=sq_idf,
+        intercept=[b for _, _, b, _, _ in folds],
+        cal_a=[a for _, _, _, a, _ in folds],
+        cal_b=[cb for _, _, _, _, cb in folds],
+        sublinear_tf=first.sublinear_tf,
+        classes=model.classes_,
+    )
+
+
+def vectorizer_fingerprint(vectorizer):
+    """Hash of a fused model's token-to-column mapping and tokenizer settings."""
+    digest = hashlib.blake2b(digest_size=16)
+    vocab = getattr(vectorizer, 'vocab', None)
+    if vocab is not None:
+        digest.update(np.ascontiguousarray(vocab).tobytes())
+        params = dict(vectorizer.analyzer_params, binary=vectorizer.binary)
+    else:
+        for tok, _ in sorted(vectorizer.vocabulary_.items(), key=lambda kv: kv[1]):
+            digest.update(tok.encode('utf-8') + b'\0')
+        params = {k: vectorizer.get_params()[k] for k in _COUNT_PARAMS}
+    digest.update(repr(sorted(params.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def max_abs_diff(model, fused, texts):
+    """Largest absolute difference of P(toxic) between `model` and its fused form on `texts`."""
+    ref = np.asarray(model.predict_proba(texts))[:, 1]
+    got = fused.predict_proba(texts)[:, 1]
+    return float(np.max(np.abs(ref - got))) if len(texts) else 0.0
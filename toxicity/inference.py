@@ -0,0 +1,398 @@
+"""Model scoring helpers and an asyncio micro-batcher for serving.
+
+The batcher lets async handlers ``await`` a single toxicity probability while
+messages arriving close together are scored with one vectorized
+``predict_proba`` call in an executor, keeping the event loop free.
+"""
+import asyncio
+import collections
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import joblib
+import numpy as np
+
+from toxicity.model_io import load_model
+
+
+logger = logging.getLogger(__name__)
+
+
+def score_texts(model, texts):
+    """(P(toxic) for every text, whether the hard labels of the `predict` fallback were used)."""
+    try:
+        return np.asarray(model.predict_proba(texts), dtype=float)[:, 1], False
+    except Exception as e:
+        logger.exception('predict_proba failed, falling back to predict: %s', e)
+    preds = model.predict(texts)
+    return np.array([1.0 if p == 1 else 0.0 for p in preds], dtype=float), True
+
+
+def score_texts_windowed(model, texts, windows):
+    """(P(toxic) per text, (start, end) of each text's most toxic window, whether `predict` was the fallback).
+
+    The windows of all texts (see `toxicity.windows.WindowConfig`) are scored
+    with one `predict_proba` call and combined per text.
+    """
+    spans = [windows.spans(text) for text in texts]
+    window_texts = [text[start:end] for text, text_spans in zip(texts, spans) for start, end in text_spans]
+    probs, fell_back = score_texts(model, window_texts) if window_texts else (np.zeros(0), False)
+    out = np.empty(len(texts), dtype=float)
+    best_spans = []
+    offset = 0
+    for i, text_spans in enumerate(spans):
+        out[i], best = windows.combine(probs[offset:offset + len(text_spans)])
+        best_spans.append(text_spans[best])
+        offset += len(text_spans)
+    return out, best_spans, fell_back
+
+
+def _score_batch(model, texts, windows=None):
+    """(probabilities, most toxic spans or None, fallback flag) with or without windows."""
+    if windows is None:
+        probs, fell_back = score_texts(model, texts)
+        return probs, None, fell_back
+    return score_texts_windowed(model, texts, windows)
+
+
+def predict_toxic_proba(model, texts, windows=None):
+    """Return P(toxic) for every text, falling back to hard labels from `predict`.
+
+    With a `toxicity.windows.WindowConfig` long texts are scored by windows.
+    """
+    return _score_batch(model, texts, windows)[0]
+
+
+class MicroBatcher:
+    """Collect concurrent scoring requests into batches and score them off the event loop.
+
+    A batch is flushed when `max_batch_size` texts are collected or `batch_window`
+    seconds have passed since its first text arrived. At most `max_queue_size`
+    texts wait in the queue; further callers wait for room (backpressure).
+    Up to `max_concurrent_batches` batches are scored at the same time.
+
+    `on_batch`, if given, is called on the event loop after every batch as
+    ``on_batch(size, queue_seconds, predict_seconds, fallback, error)``:
+    how long the oldest text waited in the queue, how long scoring took,
+    whether `predict` was used instead of `predict_proba`, and whether
+    scoring raised.
+
+    With `windows` (a `toxicity.windows.WindowConfig`) long texts are scored
+    by sliding windows; `predict_with_span` also returns the most toxic span.
+    """
+
+    def __init__(self, model, max_batch_size=32, batch_window=0.005, max_queue_size=1024, executor=None,
+                 max_concurrent_batches=1, on_batch=None, windows=None):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be >= 1')
+        if batch_window < 0:
+            raise ValueError('batch_window must be >= 0')
+        if max_concurrent_batches < 1:
+            raise ValueError('max_concurrent_batches must be >= 1')
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_queue_size = max_queue_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self.on_batch = on_batch
+        self.windows = windows
+        self._executor = executor
+        self._own_executor = executor is None
+        self._queue = None
+        self._task = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self._task is not None:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        _fail_stopped(pending)
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def swap_model(self, model):
+        """Score every batch dispatched from now on with `model`; returns the previous model.
+
+        A batch reads the model once when it is dispatched, so batches already
+        being scored finish with the old model and no batch mixes the two.
+        """
+        old, self.model = self.model, model
+        return old
+
+    async def predict(self, text):
+        """Return P(toxic) for one text once its batch has been scored."""
+        prob, _ = await self.predict_with_span(text)
+        return prob
+
+    async def predict_with_span(self, text):
+        """(P(toxic), (start, end) of the most toxic window or None without `windows`) for one text."""
+        if self._task is None:
+            raise RuntimeError('MicroBatcher is not started')
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        await self._queue.put((text, fut, loop.time()))
+        return await fut
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            batch.append(await self._queue.get())
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # texts already taken off the queue are no longer seen by stop()
+            _fail_stopped(batch)
+            raise
+        return batch
+
+    async def _score(self, texts):
+        loop = asyncio.get_running_loop()
+        model = self.model
+        return await loop.run_in_executor(self._executor, _score_batch, model, texts, self.windows)
+
+    async def _dispatch(self, batch):
+        texts = [text for text, _, _ in batch]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            probs, spans, fallback = await self._score(texts)
+        except asyncio.CancelledError:
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.cancel()
+            raise
+        except Exception as e:
+            logger.exception('batch inference failed (%d texts): %s', len(texts), e)
+            self._observe(batch, started, loop.time(), False, True)
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self._observe(batch, started, loop.time(), fallback, False)
+        spans = spans or [None] * len(batch)
+        for (_, fut, _), prob, span in zip(batch, probs, spans):
+            if not fut.done():
+                fut.set_result((float(prob), span))
+
+    def _observe(self, batch, started, finished, fallback, error):
+        if self.on_batch is None:
+            return
+        try:
+            self.on_batch(len(batch), started - batch[0][2], finished - started, fallback, error)
+        except Exception as e:
+            logger.exception('on_batch callback failed: %s', e)
+
+    async def _run(self):
+        # Waiting for a free slot before collecting lets texts pile up into
+        # larger batches while every executor worker is busy.
+        slots = asyncio.Semaphore(self.max_concurrent_batches)
+        inflight = set()
+
+        def _done(task):
+            inflight.discard(task)
+            slots.release()
+
+        try:
+            while True:
+                await slots.acquire()
+                batch = await self._collect()
+                task = asyncio.create_task(self._dispatch(batch))
+                inflight.add(task)
+                task.add_done_callback(_done)
+        finally:
+            for task in list(inflight):
+                task.cancel()
+
+
+def _fail_stopped(items):
+    for _, fut, _ in items:
+        if not fut.done():
+            fut.set_exception(RuntimeError('Inference worker stopped'))
+
+
+_worker_model = None
+
+
+def dump_shared_model(model, path):
+    """Dump `model` uncompressed so worker processes can memory-map its numpy arrays."""
+    joblib.dump(model, path, compress=0)
+    return path
+
+
+def shared_model_path(model):
+    """A file worker processes can memory-map `model` from, and the temporary directory holding it (or None).
+
+    Serving artifacts are mapped directly; other models are dumped once uncompressed.
+    """
+    path = getattr(model, 'artifact_path', None)
+    if path is not None:
+        return path, None
+    shared_dir = tempfile.mkdtemp(prefix='toxicity-model-')
+    return dump_shared_model(model, os.path.join(shared_dir, 'model.joblib')), shared_dir
+
+
+def _init_worker(model_path):
+    global _worker_model
+    # mmap_mode='r' maps idf_/coef_ and the other arrays read-only from the page
+    # cache, so every worker shares the same physical pages.
+    _worker_model = load_model(model_path, mmap_mode='r')
+
+
+def _score_in_worker(texts, windows=None):
+    return _score_batch(_worker_model, texts, windows)
+
+
+def iter_scored_chunks(model, chunks, n_workers=0, max_pending=None, text_column='text', windows=None):
+    """Yield ``(chunk, probs)`` for every DataFrame in `chunks`, in input order.
+
+    With `n_workers` > 0 chunks are scored in that many processes which load
+    the model once (memory-mapped, as in `ProcessPoolBatcher`). At most
+    `max_pending` chunks (default ``2 * n_workers``) are read ahead, so memory
+    does not grow with the input. `windows` scores long texts by windows.
+    """
+    if n_workers < 1:
+        for chunk in chunks:
+            yield chunk, predict_toxic_proba(model, chunk_texts(chunk, text_column), windows)
+        return
+    max_pending = max(1, max_pending or 2 * n_workers)
+    path, shared_dir = shared_model_path(model)
+    pending = collections.deque()
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(path,)) as pool:
+            for chunk in chunks:
+                pending.append((chunk, pool.submit(_score_in_worker, chunk_texts(chunk, text_column), windows)))
+                if len(pending) >= max_pending:
+                    chunk, fut = pending.popleft()
+                    yield chunk, fut.result()[0]
+            while pending:
+                chunk, fut = pending.popleft()
+                yield chunk, fut.result()[0]
+    finally:
+        for _, fut in pending:
+            fut.cancel()
+        if shared_dir is not None:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+def chunk_texts(chunk, text_column='text'):
+    """Texts of a DataFrame chunk as a list of str (missing values become empty strings)."""
+    return chunk[text_column].fillna('').astype(str).tolist()
+
+
+def _retire_executor(executor, shared_dir):
+    """Let `executor` finish its submitted batches, then remove the model file its workers mapped."""
+    if executor is not None:
+        executor.shutdown(wait=True)
+    if shared_dir is not None:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+class ProcessPoolBatcher(MicroBatcher):
+    """MicroBatcher that spreads batches over `n_workers` scoring processes.
+
+    On start the model is dumped once to a temporary file which every worker
+    loads with memory mapping, so the large arrays are not copied per process.
+    Models loaded from a serving artifact are already memory-mapped and the
+    workers map the artifact file directly.
+    """
+
+    def __init__(self, model, n_workers, **kwargs):
+        if n_workers < 1:
+            raise ValueError('n_workers must be >= 1')
+        kwargs.setdefault('max_concurrent_batches', n_workers)
+        super().__init__(model, **kwargs)
+        self.n_workers = n_workers
+        self._shared_dir = None
+
+    def _make_executor(self, model):
+        """A process pool whose workers load `model`, and the temporary directory it was dumped to (or None)."""
+        path, shared_dir = shared_model_path(model)
+        executor = ProcessPoolExecutor(max_workers=self.n_workers, initializer=_init_worker, initargs=(path,))
+        return executor, shared_dir
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._executor, self._shared_dir = self._make_executor(self.model)
+        self._own_executor = True
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        if self._shared_dir is not None:
+            shutil.rmtree(self._shared_dir, ignore_errors=True)
+            self._shared_dir = None
+
+    async def warm_up(self, executor=None):
+        """Spawn every worker process and wait until each has loaded the model."""
+        loop = asyncio.get_running_loop()
+        executor = executor or self._executor
+        await asyncio.gather(*[
+            loop.run_in_executor(executor, _score_in_worker, [''])
+            for _ in range(self.n_workers)
+        ])
+
+    async def swap_model(self, model):
+        """Start a new, warmed-up worker pool for `model`, then switch batches over to it.
+
+        Batches already submitted to the old pool finish there and its workers
+        exit in the background. If the new pool fails to start, the old one stays.
+        """
+        loop = asyncio.get_running_loop()
+        executor, shared_dir = await loop.run_in_executor(None, self._make_executor, model)
+        try:
+            await self.warm_up(executor)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if shared_dir is not None:
+                shutil.rmtree(shared_dir, ignore_errors=True)
+            raise
+        old_model, self.model = self.model, model
+        old_executor, self._executor = self._executor, executor
+        old_dir, self._shared_dir = self._shared_dir, shared_dir
+        loop.run_in_executor(None, _retire_executor, old_executor, old_dir)
+        return old_model
+
+    def worker_pids(self):
+        processes = getattr(self._executor, '_processes', None) or {}
+        return sorted(processes)
+
+    async def _score(self, texts):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _score_in_worker, texts, self.windows)
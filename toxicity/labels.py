@@ -0,0 +1,109 @@
+"""Normalization of heterogeneous source labels to 0/1.
+
+`label_value` is the per-value rule, and `to_binary_label` applies it to a
+whole column. Numeric columns are thresholded with numpy. String and other
+hashable object values are factorized, so the rule runs once per distinct
+value and the result is gathered with a lookup table. List, tuple, array and
+dict cells become tuples of their elements and are factorized the same way.
+Cells that nest unhashable values are spread into a 2-D grid of elements
+instead. A cell counts as toxic when any of its elements converts to the
+integer 1.
+"""
+import numpy as np
+import pandas as pd
+
+
+TRUE_STRINGS = ('1', 'true', 'yes', 'toxic', 'tox')
+_CONTAINER_TYPES = (list, tuple, dict, np.ndarray)
+_SCALAR_KINDS = ('empty', 'string', 'integer', 'floating', 'mixed-integer-float', 'boolean', 'decimal')
+
+
+def _element_is_one(v):
+    try:
+        return int(v) == 1
+    except Exception:
+        return False
+
+
+def label_value(x):
+    """0/1 label of a single raw value."""
+    if isinstance(x, (list, tuple, np.ndarray)):
+        return int(any(_element_is_one(v) for v in x))
+    if isinstance(x, dict):
+        return int(any(_element_is_one(v) for v in x.values()))
+    if pd.isna(x):
+        return 0
+    if isinstance(x, str):
+        if x.strip().lower() in TRUE_STRINGS:
+            return 1
+        try:
+            return 1 if float(x) > 0.5 else 0
+        except Exception:
+            return 0
+    try:
+        return 1 if int(x) == 1 else 0
+    except Exception:
+        try:
+            return 1 if float(x) > 0.5 else 0
+        except Exception:
+            return 0
+
+
+def _lookup(values, rule):
+    """Apply `rule` once per distinct value; missing values map to 0."""
+    try:
+        codes, uniques = pd.factorize(values)
+    except TypeError:
+        # unhashable cells (e.g. nested lists) are rare: evaluate them one by one
+        return np.fromiter((rule(v) for v in values), dtype=np.int64, count=len(values))
+    table = np.fromiter((rule(u) for u in uniques), dtype=np.int64, count=len(uniques))
+    return np.append(table, 0)[codes]
+
+
+def _numeric_labels(values):
+    # int(x) == 1 holds for 1 <= x < 2; int(inf) overflows and falls back to float(inf) > 0.5
+    v = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return (((v >= 1.0) & (v < 2.0)) | (v == np.inf)).astype(np.int64)
+
+
+def _factorize_rows(cells):
+    try:
+        return pd.factorize(cells)
+    except TypeError:
+        pass
+    rows = pd.Series([tuple(v.values()) if isinstance(v, dict) else tuple(v) for v in cells], dtype=object)
+    return pd.factorize(rows)
+
+
+def _container_labels(cells):
+    try:
+        # rows of scalars are hashable: one rule call per distinct row
+        codes, uniques = _factorize_rows(cells)
+    except TypeError:
+        rows = [list(v.values()) if isinstance(v, dict) else v for v in cells]
+        # ragged rows are padded with NaN, which never counts as 1
+        grid = pd.DataFrame(rows).to_numpy(dtype=object)
+        if grid.size == 0:
+            return np.zeros(len(cells), dtype=np.int64)
+        return _lookup(grid.ravel(), _element_is_one).reshape(grid.shape).max(axis=1)
+    table = np.fromiter((label_value(u) for u in uniques), dtype=np.int64, count=len(uniques))
+    return table[codes]
+
+
+def to_binary_label(series):
+    """Vectorized `series.map(label_value)` returning an int64 Series with the same index."""
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        out = _numeric_labels(series.to_numpy(dtype=np.float64, na_value=np.nan))
+    elif not pd.api.types.is_object_dtype(series):
+        out = _lookup(series.array, label_value)
+    elif pd.api.types.infer_dtype(series, skipna=True) in _SCALAR_KINDS:
+        out = _lookup(series.to_numpy(), label_value)
+    else:
+        values = series.to_numpy()
+        is_container = series.map(type).isin(_CONTAINER_TYPES).to_numpy()
+        out = np.zeros(len(series), dtype=np.int64)
+        out[~is_container] = _lookup(values[~is_container], label_value)
+        if is_container.any():
+            out[is_container] = _container_labels(values[is_container])
+    return pd.Series(out, index=series.index, name=series.name)
@@ -0,0 +1,271 @@
+"""Binary classification metrics from one sort of the scores.
+
+`BinaryMetrics` sorts the probabilities once. Cumulative sums of the labels
+over the distinct scores then give the confusion matrix at every threshold
+(a row is predicted toxic when ``prob >= threshold``). Accuracy, precision,
+recall and F1 at any threshold, the ROC and PR curves, ROC AUC, average
+precision and threshold sweeps are all read off these arrays. Calibration
+(reliability bins and ECE) uses one `bincount`. The values match the
+corresponding scikit-learn functions (with ``zero_division=0``).
+
+`bootstrap` computes percentile confidence intervals without resampling
+rows. Scores are bucketed per class on a fine grid (``grid`` cells in [0, 1]).
+Each replicate draws the cell counts from a multinomial, so all replicates
+are evaluated at once as a (replicates x cells) matrix. AUC ties within a
+cell are counted as half, so bootstrap AUCs are exact up to the grid
+resolution. The point estimates come from the exact arrays.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def binned_auc(pos_hist, neg_hist):
+    """ROC AUC from per-bin positive/negative counts of scores (ties inside a bin count as 1/2).
+
+    Bins are in increasing score order along the last axis; leading axes
+    (e.g. bootstrap replicates) are kept.
+    """
+    pos_hist, neg_hist = np.asarray(pos_hist, dtype=float), np.asarray(neg_hist, dtype=float)
+    n_pos, n_neg = pos_hist.sum(axis=-1), neg_hist.sum(axis=-1)
+    neg_below = np.cumsum(neg_hist, axis=-1) - neg_hist
+    with np.errstate(invalid='ignore', divide='ignore'):
+        auc = (pos_hist * (neg_below + 0.5 * neg_hist)).sum(axis=-1) / (n_pos * n_neg)
+    return np.where((n_pos > 0) & (n_neg > 0), auc, np.nan)[()]
+
+
+def _safe_div(a, b):
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(b > 0, a / np.where(b > 0, b, 1), 0.0)[()]
+
+
+def _bin_index(p, n_bins):
+    """Bin i holds edges[i] <= p < edges[i + 1] for edges = linspace(0, 1, n_bins + 1); 1.0 is in the last bin."""
+    edges = np.linspace(0.0, 1.0, n_bins + 1)
+    return np.clip(np.searchsorted(edges, p, side='right') - 1, 0, n_bins - 1)
+
+
+class BinaryMetrics:
+    """Confusion-matrix curve of labels `y_true` (0/1) against scores `y_prob` in [0, 1]."""
+
+    def __init__(self, y_true, y_prob):
+        y = np.asarray(y_true).astype(np.int64, copy=False).ravel()
+        p = np.asarray(y_prob, dtype=np.float64).ravel()
+        if len(y) != len(p):
+            raise ValueError(f'y_true and y_prob have different lengths ({len(y)} vs {len(p)})')
+        self.y, self.p = y, p
+        self.n = len(y)
+        self.n_pos = int(y.sum())
+        self.n_neg = self.n - self.n_pos
+
+        order = np.argsort(p)[::-1]
+        p_sorted = p[order]
+        # last position of every run of equal scores
+        ends = np.r_[np.flatnonzero(p_sorted[1:] != p_sorted[:-1]), self.n - 1] if self.n else np.empty(0, dtype=np.int64)
+        self.thresholds = p_sorted[ends]
+        self.tps = np.cumsum(y[order])[ends] if self.n else np.empty(0, dtype=np.int64)
+        self.fps = ends + 1 - self.tps
+
+    def _counts_at(self, threshold):
+        """(tp, fp) for each threshold in `threshold` (scalar or array)."""
+        k = np.searchsorted(-self.thresholds, -np.asarray(threshold, dtype=float), side='right')
+        tps = np.r_[0, self.tps][k]
+        fps = np.r_[0, self.fps][k]
+        return tps, fps
+
+    def confusion(self, threshold=0.5):
+        """(tn, fp, fn, tp), the order of ``confusion_matrix(...).ravel()``."""
+        tp, fp = (int(v) for v in self._counts_at(threshold))
+        return self.n_neg - fp, fp, self.n_pos - tp, tp
+
+    def at(self, threshold=0.5):
+        """Threshold metrics as a dict (scalars) or, for an array of thresholds, a DataFrame."""
+        tp, fp = self._counts_at(threshold)
+        fn, tn = self.n_pos - tp, self.n_neg - fp
+        out = {
+            'threshold': np.asarray(threshold, dtype=float)[()],
+            'accuracy': _safe_div(tp + tn, self.n),
+            'precision': _safe_div(tp, tp + fp),
+            'recall': _safe_div(tp, self.n_pos),
+            'f1': _safe_div(2 * tp, 2 * tp + fp + fn),
+            'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn,
+        }
+        if np.ndim(threshold):
+            return pd.DataFrame(out)
+        return {k: (int(v) if k in ('tp', 'fp', 'tn', 'fn') else float(v)) for k, v in out.items()}
+
+    def threshold_sweep(self, thresholds=None):
+        if thresholds is None:
+            thresholds = np.round(np.arange(0.05, 1.0, 0.05), 2)
+        return self.at(np.asarray(thresholds, dtype=float))
+
+    def roc_curve(self):
+        """(fpr, tpr, thresholds) with the (0, 0) point first, like `sklearn.metrics.roc_curve`."""
+        fpr = np.r_[0.0, _safe_div(self.fps, self.n_neg)]
+        tpr = np.r_[0.0, _safe_div(self.tps, self.n_pos)]
+        return fpr, tpr, np.r_[np.inf, self.thresholds]
+
+    def roc_auc(self):
+        if not self.n_pos or not self.n_neg:
+            return float('nan')
+        fpr, tpr, _ = self.roc_curve()
+        # trapezoidal area, as in roc_auc_score
+        return float((np.diff(fpr) * (tpr[1:] + tpr[:-1])).sum() / 2)
+
+    def pr_curve(self):
+        """(precision, recall, thresholds) in increasing-threshold order, like `precision_recall_curve`."""
+        precision = np.r_[_safe_div(self.tps, self.tps + self.fps)[::-1], 1.0]
+        recall = np.r_[_safe_div(self.tps, self.n_pos)[::-1], 0.0]
+        return precision, recall, self.thresholds[::-1]
+
+    def average_precision(self):
+        if not self.n_pos:
+            return float('nan')
+        gained = np.diff(np.r_[0, self.tps]) / self.n_pos
+        return float((gained * _safe_div(self.tps, self.tps + self.fps)).sum())
+
+    def brier(self):
+        return float(np.mean((self.p - self.y) ** 2)) if self.n else float('nan')
+
+    def calibration(self, n_bins=10):
+        """Reliability table: rows per non-empty bin of width 1/n_bins (the last bin includes 1.0)."""
+        b = _bin_index(self.p, n_bins)
+        count = np.bincount(b, minlength=n_bins)
+        sum_p = np.bincount(b, weights=self.p, minlength=n_bins)
+        sum_y = np.bincount(b, weights=self.y, minlength=n_bins)
+        table = pd.DataFrame({
+            'bin_lower': np.arange(n_bins) / n_bins,
+            'bin_upper': np.arange(1, n_bins + 1) / n_bins,
+            'count': count,
+            'mean_predicted': _safe_div(sum_p, count),
+            'fraction_positive': _safe_div(sum_y, count),
+        })
+        return table[table['count'] > 0].reset_index(drop=True)
+
+    def ece(self, n_bins=10):
+        """Expected calibration error: mean over rows of |mean prediction - positive rate| of their bin."""
+        b = _bin_index(self.p, n_bins)
+        gap = np.bincount(b, weights=self.p - self.y, minlength=n_bins)
+        return float(np.abs(gap).sum() / self.n) if self.n else float('nan')
+
+    def best_thresholds(self, min_precision=0.9):
+        """Thresholds maximizing F1, accuracy and Youden's J, and the best recall at `min_precision`."""
+        tps, fps = self.tps, self.fps
+        candidates = {
+            'max_f1': _safe_div(2 * tps, tps + fps + self.n_pos),
+            'max_accuracy': _safe_div(tps + self.n_neg - fps, self.n),
+            'max_youden_j': _safe_div(tps, self.n_pos) - _safe_div(fps, self.n_neg),
+        }
+        ok = _safe_div(tps, tps + fps) >= min_precision
+        candidates[f'max_recall_at_precision>={min_precision:g}'] = np.where(ok, _safe_div(tps, self.n_pos), -np.inf)
+        rows = []
+        for name, values in candidates.items():
+            if not len(values) or not np.isfinite(values).any():
+                continue
+            row = self.at(float(self.thresholds[int(np.argmax(values))]))
+            rows.append(dict(criterion=name, **row))
+        return pd.DataFrame(rows)
+
+    def summary(self, threshold=0.5, n_bins=10):
+        out = self.at(threshold)
+        out.update(roc_auc=self.roc_auc(), average_precision=self.average_precision(), brier=self.brier(),
+                   ece=self.ece(n_bins))
+        return out
+
+    def bootstrap(self, threshold=0.5, n_boot=200, alpha=0.05, n_bins=10, grid=10000, seed=0, chunk=50):
+        """Percentile confidence intervals of the `summary` metrics (see module docstring)."""
+        if grid % n_bins:
+            raise ValueError('grid must be a multiple of n_bins')
+        q = np.clip((self.p * grid).astype(np.int64), 0, grid - 1)
+        cell = q * 2 + self.y
+        count = np.bincount(cell, minlength=2 * grid).astype(float)
+        mean_p = _safe_div(np.bincount(cell, weights=self.p, minlength=2 * grid), count)
+        mean_sq = _safe_div(np.bincount(cell, weights=(self.p - self.y) ** 2, minlength=2 * grid), count)
+        calib_gap = mean_p - np.tile([0.0, 1.0], grid)
+        k_thr = int(np.ceil(threshold * grid - 1e-9))
+        bin_starts = np.arange(n_bins) * (2 * grid // n_bins)
+
+        rng = np.random.default_rng(seed)
+        pvals = count / self.n
+        samples = []
+        for start in range(0, n_boot, chunk):
+            C = rng.multinomial(self.n, pvals, size=min(chunk, n_boot - start)).astype(float)
+            neg, pos = C[:, 0::2], C[:, 1::2]
+            tp, fp = pos[:, k_thr:].sum(axis=1), neg[:, k_thr:].sum(axis=1)
+            n_pos = pos.sum(axis=1)
+            fn, tn = n_pos - tp, (self.n - n_pos) - fp
+            gap = np.add.reduceat(C * calib_gap, bin_starts, axis=1)
+            samples.append(pd.DataFrame({
+                'accuracy': (tp + tn) / self.n,
+                'precision': _safe_div(tp, tp + fp),
+                'recall': _safe_div(tp, n_pos),
+                'f1': _safe_div(2 * tp, 2 * tp + fp + fn),
+                'roc_auc': binned_auc(pos, neg),
+                'brier': C @ mean_sq / self.n,
+                'ece': np.abs(gap).sum(axis=1) / self.n,
+            }))
+        samples = pd.concat(samples, ignore_index=True)
+        point = self.summary(threshold, n_bins)
+        return pd.DataFrame({
+            'metric': samples.columns,
+            'value': [point[m] for m in samples.columns],
+            'ci_low': samples.quantile(alpha / 2).values,
+            'ci_high': samples.quantile(1 - alpha / 2).values,
+        })
+
+
+def print_report(metrics, threshold=0.5, n_bins=10, per_class=False, sweep=False, n_boot=0, seed=0):
+    """Print the summary at `threshold`, optionally per-class scores, a threshold sweep and bootstrap CIs."""
+    s = metrics.summary(threshold, n_bins)
+    print(f'Rows: {metrics.n} (positive {metrics.n_pos}), threshold {threshold:g}')
+    print(f'Accuracy: {s["accuracy"]:.4f}')
+    print(f'Precision: {s["precision"]:.4f}')
+    print(f'Recall: {s["recall"]:.4f}')
+    print(f'F1: {s["f1"]:.4f}')
+    print(f'ROC AUC: {s["roc_auc"]:.4f}')
+    print(f'Average precision: {s["average_precision"]:.4f}')
+    print(f'Brier score: {s["brier"]:.4f}')
+    print(f'ECE ({n_bins} bins): {s["ece"]:.4f}')
+    if per_class:
+        tn, fp, fn, tp = metrics.confusion(threshold)
+        rows = {
+            '0': (_safe_div(tn, tn + fn), _safe_div(tn, tn + fp), metrics.n_neg),
+            '1': (_safe_div(tp, tp + fp), _safe_div(tp, tp + fn), metrics.n_pos),
+        }
+        table = pd.DataFrame(rows, index=['precision', 'recall', 'support']).T
+        table['f1'] = _safe_div(2 * table['precision'] * table['recall'], table['precision'] + table['recall'])
+        table['support'] = table['support'].astype(int)
+        print(f'\nConfusion matrix [[tn fp] [fn tp]]: [[{tn} {fp}] [{fn} {tp}]]')
+        print(table[['precision', 'recall', 'f1', 'support']].round(4).to_string())
+    if sweep:
+        print('\nThreshold sweep:')
+        print(metrics.threshold_sweep().round(4).to_string(index=False))
+        print('\nBest thresholds:')
+        print(metrics.best_thresholds().round(4).to_string(index=False))
+    if n_boot:
+        print(f'\nBootstrap 95% confidence intervals ({n_boot} replicates):')
+        print(metrics.bootstrap(threshold, n_boot=n_boot, n_bins=n_bins, seed=seed).round(4).to_string(index=False))
+
+
+def write_summary(metrics, path, threshold=0.5, n_bins=10, **extra):
+    """Save the `summary` at `threshold` with row counts (and `extra` fields) as JSON."""
+    out = dict(extra, rows=int(metrics.n), positive=int(metrics.n_pos), threshold=threshold, calibration_bins=n_bins)
+    out.update({k: int(v) if k in ('tp', 'fp', 'tn', 'fn') else float(v)
+                for k, v in metrics.summary(threshold, n_bins).items()})
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(out, f, indent=2)
+
+
+def add_report_args(parser):
+    parser.add_argument('--threshold', type=float, default=0.5, help='Decision threshold for converting probabilities to labels')
+    parser.add_argument('--calibration_bins', type=int, default=10, help='Number of bins for ECE')
+    parser.add_argument('--sweep', action='store_true', help='Also print metrics over a grid of thresholds and the best thresholds')
+    parser.add_argument('--bootstrap', type=int, default=0, help='Number of bootstrap replicates for 95%% confidence intervals (0 = off)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the bootstrap')
+    parser.add_argument('--metrics_out', default=None, help='Optional path to write the summary metrics as JSON')
@@ -0,0 +1,44 @@
+"""Load any model format accepted by the serving entry points."""
+import os
+import tempfile
+
+import joblib
+
+from toxicity.artifact import is_artifact, load_artifact, replace_file
+
+
+def load_model(path, mmap_mode=None):
+    """Load a serving artifact or a joblib model (sklearn pipeline, calibrator or fused scorer).
+
+    `mmap_mode` is passed to `joblib.load`; serving artifacts are always memory-mapped.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'Model not found: {path}')
+    if is_artifact(path):
+        return load_artifact(path)
+    return joblib.load(path, mmap_mode=mmap_mode)
+
+
+def dump_model(model, path, **kwargs):
+    """`joblib.dump` to a temporary file next to `path`, then rename it over `path`.
+
+    Readers never see a half-written model, and a process that has the old
+    file memory-mapped keeps its pages. `kwargs` go to `joblib.dump`.
+    """
+    d = os.path.dirname(os.path.abspath(path))
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix='.tmp-', suffix='.joblib')
+    os.close(fd)
+    try:
+        joblib.dump(model, tmp, **kwargs)
+        replace_file(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def model_version(model):
+    """Version recorded in a serving artifact, or None for joblib models."""
+    return getattr(model, 'model_version', None)
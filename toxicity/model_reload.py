@@ -0,0 +1,182 @@
+"""Watch a model file and hot-swap the serving model when it changes.
+
+`ModelReloader` polls the size and mtime of the model path. Once a change
+has been stable for one polling interval (so a file still being copied is
+not read), the new model is loaded and probed in a background thread while
+the old model keeps serving. Only a model that loaded and scored the probe
+batch is handed to the `on_swap` coroutine, which switches references
+without awaiting in between, so handlers see either the old or the new
+model and never a half-loaded one. A failed load is logged and the old model
+stays; the same file is not retried until it changes again.
+
+Serving artifacts are memory-mapped, so a writer that rewrites the watched
+file in place would pull the pages out from under the serving model and the
+process would die with SIGBUS on its next read. `load_snapshot` therefore
+maps a private copy of an artifact, never the watched file itself.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from toxicity.artifact import is_artifact
+from toxicity.feature_cache import file_digest
+from toxicity.inference import predict_toxic_proba
+from toxicity.model_io import load_model, model_version
+
+
+logger = logging.getLogger(__name__)
+
+PROBE_TEXTS = ['привет, как дела?', 'ты дурак', '', 'спасибо за помощь ' * 20]
+
+
+def file_state(path):
+    """(size, mtime_ns) of `path`, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def load_snapshot(path):
+    """Load the model at `path`; returns (model, path of the private copy it is mapped from, or None).
+
+    A serving artifact is copied to a temporary file first and loaded from
+    there; joblib models are read into memory and need no copy.
+    """
+    if not is_artifact(path):
+        return load_model(path), None
+    fd, snapshot = tempfile.mkstemp(prefix='toxicity-serving-', suffix='.tox')
+    os.close(fd)
+    try:
+        shutil.copyfile(path, snapshot)
+        return load_model(snapshot), snapshot
+    except BaseException:
+        remove_snapshot(snapshot)
+        raise
+
+
+def remove_snapshot(snapshot):
+    """Delete a copy made by `load_snapshot` (models mapped from it keep working on POSIX)."""
+    if snapshot is None:
+        return
+    try:
+        os.remove(snapshot)
+    except OSError:
+        # still mapped on Windows; left to the temporary directory cleanup
+        pass
+
+
+def load_and_probe(path, probe_texts=PROBE_TEXTS):
+    """Load the model at `path` (see `load_snapshot`) and check it scores `probe_texts`.
+
+    Returns (model, content digest, snapshot path or None).
+    """
+    model, snapshot = load_snapshot(path)
+    try:
+        probs = np.asarray(predict_toxic_proba(model, list(probe_texts)))
+        if probs.shape != (len(probe_texts),) or not np.all(np.isfinite(probs)) or probs.min() < 0 or probs.max() > 1:
+            raise ValueError(f'probe batch returned invalid probabilities: {probs!r}')
+        return model, file_digest(snapshot or path), snapshot
+    except BaseException:
+        remove_snapshot(snapshot)
+        raise
+
+
+class ModelReloader:
+    """Poll `path` every `interval` seconds and call ``await on_swap(model, model_id)`` with each new model.
+
+    `snapshot` is the private copy the current model was loaded from (see
+    `load_snapshot`); the reloader deletes it once a newer model is swapped in,
+    and `close` deletes the last one.
+    """
+
+    def __init__(self, path, on_swap, interval=5.0, probe_texts=PROBE_TEXTS, snapshot=None):
+        if interval <= 0:
+            raise ValueError('interval must be > 0')
+        self.path = path
+        self.on_swap = on_swap
+        self.interval = interval
+        self.probe_texts = list(probe_texts)
+        self.snapshot = snapshot
+        self.reloads = self.failures = 0
+        self._loaded_state = file_state(path)
+        self._pending_state = None
+        self._failed_state = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def close(self):
+        """Delete the copy the current model is mapped from; call after the model is no longer used."""
+        remove_snapshot(self.snapshot)
+        self.snapshot = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.exception('model reload check failed: %s', e)
+
+    async def check(self):
+        """One polling step; returns True if a new model was swapped in."""
+        state = file_state(self.path)
+        if state is None or state == self._loaded_state or state == self._failed_state:
+            self._pending_state = None
+            return False
+        if state != self._pending_state:
+            # changed since the last poll: wait one more interval for the write to finish
+            self._pending_state = state
+            return False
+        self._pending_state = None
+        return await self.reload(state)
+
+    async def reload(self, state=None):
+        """Load, probe and swap in the model at `path`; keeps the current model on failure."""
+        state = state or file_state(self.path)
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        snapshot = None
+        try:
+            model, model_id, snapshot = await loop.run_in_executor(None, load_and_probe, self.path, self.probe_texts)
+            loaded = time.perf_counter() - t0
+            if file_state(self.path) != state:
+                logger.info('Model file %s changed while loading; will retry', self.path)
+                remove_snapshot(snapshot)
+                return False
+            await self.on_swap(model, model_id)
+        except Exception as e:
+            remove_snapshot(snapshot)
+            self.failures += 1
+            self._failed_state = state
+            logger.error('Reloading model %s failed after %.2fs, keeping the current model: %s',
+                         self.path, time.perf_counter() - t0, e)
+            return False
+        self.reloads += 1
+        # batches still running on the old model keep their mapping after the unlink
+        remove_snapshot(self.snapshot)
+        self.snapshot = snapshot
+        self._loaded_state = state
+        self._failed_state = None
+        logger.info('Reloaded model %s: version %s (content %s), loaded and probed in %.2fs, swapped in %.2fs total',
+                    self.path, model_version(model), model_id[:12], loaded, time.perf_counter() - t0)
+        return True
@@ -0,0 +1,255 @@
+"""Run a DAG of script stages, skipping stages whose inputs have not changed.
+
+Each `Stage` declares a command, the files it reads (data and code), the
+files it writes and the stages it depends on. A stage's fingerprint hashes
+its command and the content of its inputs, and is computed only once its
+dependencies have finished. A stage is skipped when the state file records a
+successful run with the same fingerprint and its outputs still have the
+recorded hashes. Otherwise it is run.
+
+Stages whose dependencies are satisfied run in parallel (up to `jobs` at a
+time). If a stage fails, the stages that depend on it are not started, but
+independent branches finish. Successful stages are recorded as soon as they
+complete, so the next invocation resumes from the failed stage. Output of
+every stage is prefixed with its name and also written to
+``<log_dir>/<stage>.log``.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from toxicity.feature_cache import file_digest
+
+
+STATE_VERSION = 1
+
+DONE, SKIPPED, FAILED, BLOCKED = 'done', 'skipped', 'failed', 'blocked'
+
+
+class Stage:
+    def __init__(self, name, cmd, inputs=(), outputs=(), deps=()):
+        self.name = name
+        self.cmd = [str(c) for c in cmd]
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+
+
+class PipelineState:
+    """JSON file with the last successful run of every stage and a memo of file hashes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {'version': STATE_VERSION, 'stages': {}, 'file_hashes': {}}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = None
+            if data and data.get('version') == STATE_VERSION:
+                self.data = data
+
+    def save(self):
+        with self._lock:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=d or '.', suffix='.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def path_hash(self, path):
+        """Content hash of a file or directory tree, or None if it does not exist.
+
+        File hashes are reused while the size and mtime are unchanged.
+        """
+        if os.path.isdir(path):
+            digest = hashlib.blake2b(digest_size=16)
+            for root, dirs, files in os.walk(path):
+                # bytecode caches change with the interpreter, not with the code
+                dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+                for fn in sorted(files):
+                    p = os.path.join(root, fn)
+                    digest.update(os.path.relpath(p, path).encode('utf-8') + b'\0')
+                    digest.update(self.path_hash(p).encode('ascii'))
+            return digest.hexdigest()
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = os.path.abspath(path)
+        with self._lock:
+            known = self.data['file_hashes'].get(key)
+        if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+            return known['hash']
+        digest = file_digest(path)
+        with self._lock:
+            self.data['file_hashes'][key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': digest}
+        return digest
+
+    def fingerprint(self, stage):
+        payload = json.dumps({'cmd': stage.cmd, 'inputs': {p: self.path_hash(p) for p in stage.inputs}}, sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def is_up_to_date(self, stage, fingerprint):
+        entry = self.data['stages'].get(stage.name)
+        if not entry or entry.get('fingerprint') != fingerprint:
+            return False
+        return all(self.path_hash(p) == h for p, h in entry.get('outputs', {}).items())
+
+    def record(self, stage, fingerprint, seconds):
+        outputs = {p: self.path_hash(p) for p in stage.outputs}
+        with self._lock:
+            self.data['stages'][stage.name] = {
+                'fingerprint': fingerprint, 'outputs': outputs, 'seconds': seconds,
+                'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+        self.save()
+
+    def forget(self, name):
+        with self._lock:
+            self.data['stages'].pop(name, None)
+        self.save()
+
+
+def select_stages(stages, targets):
+    """The named target stages plus everything they depend on, in declaration order."""
+    by_name = {s.name: s for s in stages}
+    unknown = [t for t in targets if t not in by_name]
+    if unknown:
+        raise ValueError(f'Unknown stages: {", ".join(unknown)}')
+    needed, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(by_name[name].deps)
+    return [s for s in stages if s.name in needed]
+
+
+def check_dag(stages):
+    """Validate dependencies and return the stages in a dependency-respecting order."""
+    names = {s.name for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in names]
+        if missing:
+            raise ValueError(f'Stage {s.name} depends on unknown stages: {", ".join(missing)}')
+    done, order, pending = set(), [], list(stages)
+    while pending:
+        ready = [s for s in pending if all(d in done for d in s.deps)]
+        if not ready:
+            raise ValueError('Pipeline has a dependency cycle: ' + ', '.join(s.name for s in pending))
+        done.update(s.name for s in ready)
+        order.extend(ready)
+        pending = [s for s in pending if s.name not in done]
+    return order
+
+
+class PipelineRunner:
+    def __init__(self, stages, state_path, log_dir=None, jobs=2, force=(), cwd=None):
+        self.stages = check_dag(stages)
+        self.state = PipelineState(state_path)
+        self.log_dir = log_dir
+        self.jobs = max(1, jobs)
+        self.force = set(force)
+        self.cwd = cwd
+        self._print_lock = threading.Lock()
+
+    def _print(self, *args):
+        with self._print_lock:
+            print(*args, flush=True)
+
+    def _run_stage(self, stage):
+        """Run or skip one stage; returns its status."""
+        fingerprint = self.state.fingerprint(stage)
+        if stage.name not in self.force and self.state.is_up_to_date(stage, fingerprint):
+            self._print(f'--- {stage.name}: up to date, skipping')
+            return SKIPPED
+        self._print(f'--- {stage.name}: running')
+        self._print('>', ' '.join(stage.cmd))
+        log = None
+        if self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            log = open(os.path.join(self.log_dir, stage.name + '.log'), 'w', encoding='utf-8')
+        t0 = time.perf_counter()
+        try:
+            proc = subprocess.Popen(stage.cmd, cwd=self.cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, encoding='utf-8', errors='replace', env=dict(os.environ, PYTHONUNBUFFERED='1', PYTHONIOENCODING='utf-8'))
+            for line in proc.stdout:
+                line = line.rstrip('\n')
+                self._print(f'[{stage.name}] {line}')
+                if log is not None:
+                    log.write(line + '\n')
+            returncode = proc.wait()
+        except OSError as e:
+            self._print(f'[{stage.name}] failed to start: {e}')
+            returncode = -1
+        finally:
+            if log is not None:
+                log.close()
+        seconds = time.perf_counter() - t0
+        if returncode != 0:
+            self._print(f'--- {stage.name}: FAILED (exit code {returncode}) after {seconds:.1f}s')
+            self.state.forget(stage.name)
+            return FAILED
+        missing = [p for p in stage.outputs if not os.path.exists(p)]
+        if missing:
+            self._print(f'--- {stage.name}: FAILED, outputs not written: {", ".join(missing)}')
+            self.state.forget(stage.name)
+            return FAILED
+        # the fingerprint taken before the run: inputs edited while it ran make the next run redo it
+        self.state.record(stage, fingerprint, seconds)
+        self._print(f'--- {stage.name}: done in {seconds:.1f}s')
+        return DONE
+
+    def run(self):
+        """Run all stages; returns {stage name: status}."""
+        status = {}
+        pending = list(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending or running:
+                for stage in list(pending):
+                    dep_status = [status.get(d) for d in stage.deps]
+                    if any(s in (FAILED, BLOCKED) for s in dep_status):
+                        status[stage.name] = BLOCKED
+                        pending.remove(stage)
+                        self._print(f'--- {stage.name}: blocked by a failed dependency')
+                    elif all(s in (DONE, SKIPPED) for s in dep_status) and len(running) < self.jobs:
+                        pending.remove(stage)
+                        running[pool.submit(self._run_stage, stage)] = stage
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    stage = running.pop(fut)
+                    try:
+                        status[stage.name] = fut.result()
+                    except Exception as e:
+                        self._print(f'--- {stage.name}: FAILED ({e})')
+                        status[stage.name] = FAILED
+        self.state.save()
+        return status
+
+    def plan(self):
+        """Which stages would run: changed inputs, missing outputs, forced, or downstream of one of those."""
+        will_run, out = set(), []
+        for stage in self.stages:
+            if stage.name in self.force or any(d in will_run for d in stage.deps):
+                reason = 'forced' if stage.name in self.force else 'dependency will run'
+            elif not self.state.is_up_to_date(stage, self.state.fingerprint(stage)):
+                reason = 'inputs or outputs changed' if stage.name in self.state.data['stages'] else 'never run'
+            else:
+                out.append((stage.name, 'skip', 'up to date'))
+                continue
+            will_run.add(stage.name)
+            out.append((stage.name, 'run', reason))
+        return out
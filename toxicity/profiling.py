@@ -0,0 +1,271 @@
+"""Per-stage wall time, CPU time and peak memory for the data and training scripts.
+
+A `Profiler` records nested stages::
+
+    profiler = Profiler()
+    with profiler.stage('read'):
+        df = read_table(path)
+        profiler.annotate(rows=len(df))
+
+Stage names are joined into paths ('oof/fold_1'), and repeated stages with
+the same path (e.g. one per chunk) are merged: times add up, the peak is the
+maximum and `calls` counts them. While a profiler is running, a background
+thread samples the RSS every `interval` seconds, so each stage's peak also
+covers allocations freed before it ends. Stages run in other processes
+(joblib workers) can be added with `record`.
+
+With `cprofile_dir` set, each top-level stage also runs under `cProfile`, and
+its stats are written to ``<cprofile_dir>/<nn>_<stage>.prof``. cProfile
+cannot nest, so nested stages appear inside their parent's dump.
+
+Scripts use the module-level `stage`/`annotate`, which go to the active
+profiler and do nothing when none is active.
+"""
+import contextlib
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+
+from toxicity.sysinfo import format_bytes, peak_rss_bytes, rss_bytes
+
+
+REPORT_VERSION = 1
+
+_active = None
+
+
+class _Stage:
+    __slots__ = ('path', 'depth', 'calls', 'wall', 'cpu', 'rss_start', 'rss_end', 'peak_rss', 'info')
+
+    def __init__(self, path, depth):
+        self.path = path
+        self.depth = depth
+        self.calls = 0
+        self.wall = self.cpu = 0.0
+        self.rss_start = self.rss_end = self.peak_rss = None
+        self.info = {}
+
+    def observe_rss(self, rss):
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def as_dict(self):
+        out = {'stage': self.path, 'depth': self.depth, 'calls': self.calls, 'wall_s': self.wall, 'cpu_s': self.cpu,
+               'rss_start': self.rss_start, 'rss_end': self.rss_end, 'peak_rss': self.peak_rss}
+        out.update(self.info)
+        return out
+
+
+class Profiler:
+    """Collects stage timings and memory readings of one script run."""
+
+    def __init__(self, cprofile_dir=None, interval=0.05):
+        self.cprofile_dir = cprofile_dir
+        self.interval = interval
+        self._stages = {}
+        self._open = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+        self._elapsed = None
+        self._n_dumps = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Start sampling memory and make this the profiler used by the module-level `stage`."""
+        global _active
+        self._started = (time.perf_counter(), time.process_time())
+        if self.cprofile_dir:
+            os.makedirs(self.cprofile_dir, exist_ok=True)
+        if self.interval and rss_bytes() is not None:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, name='profiler-rss', daemon=True)
+            self._sampler.start()
+        _active = self
+
+    def stop(self):
+        global _active
+        if _active is self:
+            _active = None
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        if self._started is not None:
+            t0, c0 = self._started
+            self._elapsed = (time.perf_counter() - t0, time.process_time() - c0)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = rss_bytes()
+            with self._lock:
+                for st in self._open:
+                    st.observe_rss(rss)
+
+    def _get(self, name):
+        parent = self._open[-1].path + '/' if self._open else ''
+        path = parent + name
+        st = self._stages.get(path)
+        if st is None:
+            st = self._stages[path] = _Stage(path, len(self._open))
+        return st
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        with self._lock:
+            st = self._get(name)
+            st.info.update(info)
+            rss = rss_bytes()
+            if st.rss_start is None:
+                st.rss_start = rss
+            st.observe_rss(rss)
+            self._open.append(st)
+        prof = None
+        if self.cprofile_dir and st.depth == 0:
+            prof = cProfile.Profile()
+            prof.enable()
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield st
+        finally:
+            wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+            if prof is not None:
+                prof.disable()
+                self._n_dumps += 1
+                fname = '%02d_%s.prof' % (self._n_dumps, re.sub(r'\W+', '_', name))
+                prof.dump_stats(os.path.join(self.cprofile_dir, fname))
+            with self._lock:
+                self._open.remove(st)
+                rss = rss_bytes()
+                st.observe_rss(rss)
+                st.rss_end = rss
+                st.calls += 1
+                st.wall += wall
+                st.cpu += cpu
+                # a child's peak is also its parents' peak
+                for parent in self._open:
+                    parent.observe_rss(st.peak_rss)
+
+    def annotate(self, **info):
+        """Attach values (rows, matrix shape, nnz, file size...) to the innermost open stage."""
+        if self._open:
+            self._open[-1].info.update(info)
+
+    def record(self, name, wall_s, cpu_s=None, peak_rss=None, **info):
+        """Add a stage measured elsewhere, e.g. a CV fold run in a worker process.
+
+        For workers `peak_rss` is the worker's own high-water mark, which may
+        include earlier tasks run by the same process.
+        """
+        with self._lock:
+            st = self._get(name)
+            st.calls += 1
+            st.wall += wall_s
+            if cpu_s is not None:
+                st.cpu += cpu_s
+            st.observe_rss(peak_rss)
+            st.info.update(info)
+
+    def report(self):
+        elapsed = self._elapsed
+        peaks = [p for p in [peak_rss_bytes()] + [st.peak_rss for st in self._stages.values()] if p is not None]
+        return {
+            'version': REPORT_VERSION,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wall_s': elapsed[0] if elapsed else None,
+            'cpu_s': elapsed[1] if elapsed else None,
+            'peak_rss': max(peaks) if peaks else None,
+            'stages': [st.as_dict() for st in self._stages.values()],
+        }
+
+    def print_report(self):
+        rep = self.report()
+        print('\nProfile (wall/CPU seconds; peak RSS of the process while the stage ran):')
+        print(f'{"stage":<40} {"calls":>5} {"wall":>9} {"cpu":>9} {"peak RSS":>10}  details')
+        for st in rep['stages']:
+            name = '  ' * st['depth'] + st['stage'].rsplit('/', 1)[-1]
+            details = ', '.join(f'{k}={v}' for k, v in st.items()
+                                if k not in ('stage', 'depth', 'calls', 'wall_s', 'cpu_s', 'rss_start', 'rss_end', 'peak_rss'))
+            print(f'{name:<40} {st["calls"]:>5} {st["wall_s"]:>9.2f} {st["cpu_s"]:>9.2f} '
+                  f'{format_bytes(st["peak_rss"]):>10}  {details}')
+        if rep['wall_s'] is not None:
+            print(f'{"total":<40} {"":>5} {rep["wall_s"]:>9.2f} {rep["cpu_s"]:>9.2f} {format_bytes(rep["peak_rss"]):>10}')
+
+    def save(self, path):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+
+def active_profiler():
+    return _active
+
+
+def stage(name, **info):
+    """`Profiler.stage` of the active profiler, or a no-op context."""
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name, **info)
+
+
+def annotate(**info):
+    if _active is not None:
+        _active.annotate(**info)
+
+
+def iter_stage(name, iterable):
+    """Yield from `iterable`, timing each step (e.g. reading the next chunk) as stage `name`."""
+    it = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def matrix_info(X):
+    """Shape and number of stored values of a (sparse) feature matrix, for `annotate`."""
+    info = {'shape': 'x'.join(str(n) for n in X.shape)}
+    if hasattr(X, 'nnz'):
+        info['nnz'] = int(X.nnz)
+    return info
+
+
+@contextlib.contextmanager
+def profiling(args):
+    """Run a script under a profiler if `--profile`, `--profile_out` or `--cprofile_dir` was given."""
+    if not (args.profile or args.profile_out or args.cprofile_dir):
+        yield None
+        return
+    profiler = Profiler(cprofile_dir=args.cprofile_dir)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.print_report()
+        if args.profile_out:
+            profiler.save(args.profile_out)
+            print('Saved profile report to', args.profile_out)
+        if args.cprofile_dir:
+            print('Saved cProfile stats to', args.cprofile_dir)
+
+
+def add_profile_args(parser):
+    parser.add_argument('--profile', action='store_true', help='Print wall time, CPU time and peak RSS per stage')
+    parser.add_argument('--profile_out', default=None, help='Optional path to write the per-stage profile as JSON')
+    parser.add_argument('--cprofile_dir', default=None, help='Optional directory for a cProfile dump of every top-level stage')
@@ -0,0 +1,197 @@
+"""Bounded LRU (optionally TTL) cache of toxicity scores in front of the model.
+
+Entries are keyed by the text as the model's vectorizer sees it. For word
+TF-IDF models the key is the unigram sequence produced by the vectorizer's own
+preprocessor and tokenizer (lowercasing, accent stripping, token pattern, stop
+words). Texts that differ only in case, spacing or punctuation between words
+therefore share an entry, and because every n-gram is derived from that
+sequence, a hit returns exactly the score the model would compute. Models
+without a recognizable word vectorizer are keyed by the raw text.
+
+Squeezing runs of repeated characters ("дуууурак" -> "дуурак") is available
+but off by default. The vectorizer does not squeeze, so it may merge texts the
+model scores differently.
+
+Window scoring (`toxicity.windows`) splits texts at whitespace, which the key
+does not keep, so with windows on, the same approximation applies to long
+texts whose spacing or punctuation differs.
+
+Each score is stored with an optional `span`, the most toxic part of the
+text as the caller represents it (the bot keeps the position of the window).
+Entries of a version 1 cache file have no span.
+
+A cache is bound to a model id (content hash of the model file). Binding a
+different id clears it. A persisted cache is ignored on load if it was written
+for another model, key function or `scoring` setting (e.g. the window config).
+"""
+import json
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.pipeline import Pipeline
+
+try:
+    from sklearn.frozen import FrozenEstimator
+except ImportError:  # scikit-learn < 1.6
+    FrozenEstimator = None
+
+from toxicity.artifact import SortedVocabularyVectorizer
+from toxicity.fused import _COUNT_PARAMS, FusedScorer
+
+
+CACHE_VERSION = 2
+# versions whose files load into this one; older entries come without a span
+_LOADABLE_VERSIONS = (1, 2)
+
+
+def _text_vectorizers(model):
+    if isinstance(model, FusedScorer):
+        return [model.vectorizer]
+    if isinstance(model, Pipeline):
+        return [model.steps[0][1]]
+    if FrozenEstimator is not None and isinstance(model, FrozenEstimator):
+        return _text_vectorizers(model.estimator)
+    if isinstance(model, CalibratedClassifierCV) and hasattr(model, 'calibrated_classifiers_'):
+        return [v for cc in model.calibrated_classifiers_ for v in _text_vectorizers(cc.estimator)]
+    return []
+
+
+def _unigram_params(vectorizer):
+    if isinstance(vectorizer, SortedVocabularyVectorizer):
+        params = dict(vectorizer.analyzer_params)
+    elif hasattr(vectorizer, 'get_params'):
+        all_params = vectorizer.get_params()
+        if not all(k in all_params for k in _COUNT_PARAMS):
+            return None
+        params = {k: all_params[k] for k in _COUNT_PARAMS}
+    else:
+        return None
+    if params.get('analyzer') != 'word':
+        return None
+    params['ngram_range'] = (1, 1)
+    return params
+
+
+def token_key_function(model):
+    """Callable mapping a text to the unigram sequence the model tokenizes it into, or None."""
+    params = [_unigram_params(v) for v in _text_vectorizers(model)]
+    if not params or any(p is None or p != params[0] for p in params):
+        return None
+    analyze = CountVectorizer(**params[0]).build_analyzer()
+    return lambda text: '\x1f'.join(analyze(text))
+
+
+class ResultCache:
+    """LRU map from normalized text to (P(toxic), span) with hit/miss counters."""
+
+    def __init__(self, max_size=10000, ttl=None, key_fn=None, squeeze_repeats=0, model_id=None, scoring=None):
+        if max_size < 1:
+            raise ValueError('max_size must be >= 1')
+        self.max_size = max_size
+        self.ttl = ttl or None
+        self.key_fn = key_fn
+        self.squeeze_repeats = squeeze_repeats
+        self.model_id = model_id
+        self.scoring = scoring
+        self._squeeze_re = re.compile(r'(.)\1{%d,}' % squeeze_repeats) if squeeze_repeats else None
+        self._entries = OrderedDict()
+        self.hits = self.misses = self.evictions = self.expired = self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, text):
+        text = str(text)
+        if self._squeeze_re is not None:
+            text = self._squeeze_re.sub(lambda m: m.group(1) * self.squeeze_repeats, text)
+        return self.key_fn(text) if self.key_fn is not None else text
+
+    def lookup(self, key):
+        """(prob, span) stored for `key`, or None."""
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and time.time() - entry[1] > self.ttl:
+            del self._entries[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[2]
+
+    def store(self, key, prob, span=None):
+        self._entries[key] = (float(prob), time.time(), span)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, text):
+        return self.lookup(self.key(text))
+
+    def put(self, text, prob, span=None):
+        self.store(self.key(text), prob, span)
+
+    def clear(self):
+        self._entries.clear()
+
+    def bind_model(self, model_id):
+        """Drop all entries if `model_id` differs from the model they were computed with."""
+        if model_id != self.model_id:
+            if self._entries:
+                self.invalidations += 1
+            self.clear()
+            self.model_id = model_id
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expired': self.expired,
+            'invalidations': self.invalidations,
+        }
+
+    def _signature(self):
+        return {'version': CACHE_VERSION, 'model_id': self.model_id, 'token_keys': self.key_fn is not None,
+                'squeeze_repeats': self.squeeze_repeats, 'scoring': self.scoring}
+
+    def save(self, path):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        payload = dict(self._signature(), entries=[[k, p, t, s] for k, (p, t, s) in self._entries.items()])
+        fd, tmp = tempfile.mkstemp(dir=d or '.', suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """Restore entries saved for the same model and key settings; returns how many were restored."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        signature = self._signature()
+        if payload.get('version') not in _LOADABLE_VERSIONS:
+            return 0
+        if any(payload.get(k) != v for k, v in signature.items() if k != 'version'):
+            return 0
+        now = time.time()
+        for key, prob, ts, *span in payload.get('entries', []):
+            if self.ttl is None or now - ts <= self.ttl:
+                self._entries[key] = (float(prob), ts, span[0] if span else None)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return len(self._entries)
@@ -0,0 +1,49 @@
+"""Uniform row sampling from a stream of DataFrame chunks."""
+import numpy as np
+import pandas as pd
+
+
+class ReservoirSampler:
+    """Keep a uniform random sample of at most `k` rows seen across `add` calls (Algorithm R).
+
+    Memory is bounded by `k` rows regardless of stream length, and the sample
+    depends only on `seed` and the row order.
+    """
+
+    def __init__(self, k, seed=42):
+        self.k = int(k)
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self._columns = None
+
+    def add(self, df):
+        n = len(df)
+        if n == 0 or self.k <= 0:
+            self.seen += n
+            return
+        if self._columns is None:
+            self._columns = {c: np.empty(self.k, dtype=df[c].to_numpy().dtype) for c in df.columns}
+        arrays = {c: df[c].to_numpy() for c in self._columns}
+
+        take = max(0, min(self.k - self.seen, n))
+        for c, arr in arrays.items():
+            self._columns[c][self.seen:self.seen + take] = arr[:take]
+
+        rest = np.arange(take, n)
+        if len(rest):
+            # row at global position g replaces slot j ~ U[0, g] when j < k
+            slots = self.rng.integers(0, self.seen + rest + 1)
+            hit = slots < self.k
+            # reverse + unique keeps the last row per slot, as sequential replacement would
+            slots, rows = slots[hit][::-1], rest[hit][::-1]
+            slots, first = np.unique(slots, return_index=True)
+            rows = rows[first]
+            for c, arr in arrays.items():
+                self._columns[c][slots] = arr[rows]
+        self.seen += n
+
+    def to_frame(self):
+        n = min(self.seen, self.k)
+        if self._columns is None:
+            return pd.DataFrame()
+        return pd.DataFrame({c: arr[:n] for c, arr in self._columns.items()})
@@ -0,0 +1,19 @@
+"""Synthetic Russian chat messages for benchmarks and load tests."""
+import numpy as np
+
+
+NEUTRAL_WORDS = (
+    'привет спасибо хорошо отлично друг погода утро вечер работа книга кино музыка город дом семья '
+    'радость помощь вопрос ответ день сегодня завтра вчера новости парк машина школа учитель море'
+).split()
+TOXIC_WORDS = 'дурак идиот тупой урод козел мразь дебил бесишь заткнись отстой ненавижу тварь'.split()
+
+
+def synthetic_texts(n, n_words, seed=0, toxic_share=0.35):
+    """`n` Russian sentences of exactly `n_words` words, some with toxic words mixed in."""
+    rng = np.random.default_rng(seed)
+    words = rng.choice(NEUTRAL_WORDS, size=(n, n_words))
+    toxic = rng.random(n) < toxic_share
+    rows = np.flatnonzero(toxic)
+    words[rows, rng.integers(0, n_words, size=len(rows))] = rng.choice(TOXIC_WORDS, size=len(rows))
+    return [' '.join(row) for row in words]
@@ -0,0 +1,71 @@
+"""Process memory readings used by benchmarks and the training profiler.
+
+`psutil` is used when installed; otherwise the values are read from ``/proc``
+(Linux) or `resource`. Functions return ``None`` when a reading is unavailable.
+"""
+import os
+import sys
+
+try:
+    import psutil
+except ImportError:  # optional dependency
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _read_proc_kb(path, key):
+    try:
+        with open(path, encoding='ascii') as f:
+            for line in f:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def rss_bytes(pid=None):
+    """Current resident set size of `pid` (default: this process)."""
+    pid = os.getpid() if pid is None else pid
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    return _read_proc_kb(f'/proc/{pid}/status', 'VmRSS')
+
+
+def pss_bytes(pid=None):
+    """Proportional set size of `pid`: shared pages are split between the processes mapping them."""
+    pid = os.getpid() if pid is None else pid
+    if psutil is not None:
+        try:
+            return getattr(psutil.Process(pid).memory_full_info(), 'pss', None)
+        except (psutil.Error, AttributeError):
+            return None
+    return _read_proc_kb(f'/proc/{pid}/smaps_rollup', 'Pss')
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process since it started."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+def format_bytes(n):
+    if n is None:
+        return 'n/a'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unit == 'GB':
+            return f'{n:.1f} {unit}' if unit != 'B' else f'{n} B'
+        n /= 1024.0
@@ -0,0 +1,329 @@
+"""Prometheus-style counters, gauges and histograms, and per-request traces.
+
+The metrics are plain Python objects updated from the event loop: an
+increment is a dict lookup and an addition, a histogram observation a
+`bisect` over the bucket bounds, so they can stay on in production.
+`MetricsRegistry.render` produces the Prometheus text exposition format,
+served by `serve_metrics` (``GET /metrics``) or written periodically by
+`dump_metrics_periodically` (e.g. for the node_exporter textfile collector).
+"""
+import asyncio
+import bisect
+import logging
+import math
+import os
+import tempfile
+import time
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """A metric family; `labels(...)` returns the child for one label combination.
+
+    A metric without labels may take its value from `function`, called at
+    render time, instead of being updated.
+    """
+
+    kind = None
+    suffix = ''
+
+    def __init__(self, name, help_text, labelnames=(), function=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._children = {}
+        self._default = None if self.labelnames else self.labels()
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}')
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_value()
+        return child
+
+    def clear(self):
+        self._children.clear()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def samples(self):
+        """(name suffix, [(label, value), ...], value) for every exposed sample."""
+        if self.function is not None:
+            yield self.suffix, [], self.function()
+            return
+        for key, child in self._children.items():
+            yield self.suffix, list(zip(self.labelnames, key)), child.value
+
+
+class Counter(Metric):
+    kind = 'counter'
+    suffix = '_total'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def samples(self):
+        for key, child in self._children.items():
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), child.counts):
+                cumulative += count
+                yield '_bucket', labels + [('le', _format_value(float(bound)))], cumulative
+            yield '_sum', labels, child.sum
+            yield '_count', labels, child.count
+
+
+class MetricsRegistry:
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=(), function=None):
+        return self._add(Counter(self.prefix + name, help_text, labelnames, function))
+
+    def gauge(self, name, help_text, labelnames=(), function=None):
+        return self._add(Gauge(self.prefix + name, help_text, labelnames, function))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help_text, labelnames, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write `render()` to `path` atomically."""
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=d or '.', suffix='.prom')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+async def serve_metrics(registry, host='127.0.0.1', port=9108):
+    """Serve ``GET /metrics`` on `host`:`port`; returns the `asyncio.Server`."""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/metrics', '/'):
+                status, body = '200 OK', registry.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def dump_metrics_periodically(registry, path, interval):
+    """Write the metrics to `path` every `interval` seconds until cancelled, and once more on cancel."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                registry.write(path)
+            except OSError as e:
+                logger.warning('Cannot write metrics to %s: %s', path, e)
+    finally:
+        try:
+            registry.write(path)
+        except OSError:
+            pass
+
+
+class RequestTrace:
+    """Timestamps of the steps of one request, relative to its start."""
+
+    __slots__ = ('name', 'request_id', 'started_at', 'start', 'marks', 'outcome')
+
+    def __init__(self, name, request_id=None):
+        self.name = name
+        self.request_id = request_id
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.marks = []
+        self.outcome = None
+
+    def mark(self, step):
+        self.marks.append((step, time.perf_counter()))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def spans(self):
+        """[(step, seconds since the previous step), ...]."""
+        out, prev = [], self.start
+        for step, t in self.marks:
+            out.append((step, t - prev))
+            prev = t
+        return out
+
+    def format(self):
+        steps = ' '.join(f'{step}={seconds * 1000:.1f}ms' for step, seconds in self.spans())
+        return f'{self.name} id={self.request_id} outcome={self.outcome} total={self.elapsed() * 1000:.1f}ms {steps}'
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes a task that sleeps `interval` seconds.
+
+    A lag of L seconds means a callback (or the GIL held by another thread)
+    kept the loop busy for about L, delaying every coroutine waiting on it.
+    Lags are kept in a list, so run the monitor for bounded periods.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - t - self.interval))
+
+    def summary(self, blocked_threshold=0.01):
+        """Lag percentiles and the total time of stalls longer than `blocked_threshold` seconds."""
+        lags = sorted(self.lags)
+        if not lags:
+            return {'samples': 0, 'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0, 'blocked_seconds': 0.0, 'stalls': 0}
+
+        def pct(q):
+            return lags[min(len(lags) - 1, int(q * len(lags)))] * 1000
+
+        stalls = [lag for lag in lags if lag >= blocked_threshold]
+        return {'samples': len(lags), 'p50_ms': pct(0.5), 'p99_ms': pct(0.99), 'max_ms': lags[-1] * 1000,
+                'blocked_seconds': sum(stalls), 'stalls': len(stalls)}
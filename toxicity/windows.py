@@ -0,0 +1,87 @@
+"""Sliding-window scoring of long messages with a bounded cost per message.
+
+A message of up to `window_words` words is scored as is. A longer one is cut
+into windows of `window_words` words every `stride` words (by default the
+windows tile the text without overlap, so each word is vectorized once). If
+there are more than `max_windows` of them, `max_windows` windows are taken
+evenly from the start to the end of the text, so a wall of text costs at most
+``max_windows * window_words`` words (and ``max_window_chars`` characters per
+window) of vectorizing however long it is. A single toxic sentence is then not
+diluted by the rest of the text: the message gets the maximum window
+probability, or the mean of the `top_k` highest ones, and the window with the
+highest probability is reported as the most toxic span.
+
+The scoring itself is `toxicity.inference.score_texts_windowed`, which puts the
+windows of a whole batch of messages through one `predict_proba` call.
+"""
+import re
+
+import numpy as np
+
+
+WORD_RE = re.compile(r'\S+')
+AGGREGATES = ('max', 'topk')
+
+
+class WindowConfig:
+    """How long messages are split into windows and how window scores are combined."""
+
+    def __init__(self, window_words=64, stride=None, max_windows=16, aggregate='max', top_k=3, max_window_chars=4000):
+        stride = stride or window_words
+        if window_words < 1 or stride < 1 or max_windows < 1 or top_k < 1 or max_window_chars < 1:
+            raise ValueError('window_words, stride, max_windows, top_k and max_window_chars must be >= 1')
+        if aggregate not in AGGREGATES:
+            raise ValueError(f'aggregate must be one of {AGGREGATES}')
+        self.window_words = window_words
+        self.stride = stride
+        self.max_windows = max_windows
+        self.aggregate = aggregate
+        self.top_k = top_k
+        self.max_window_chars = max_window_chars
+
+    def __repr__(self):
+        return (f'WindowConfig(window_words={self.window_words}, stride={self.stride}, max_windows={self.max_windows}, '
+                f'aggregate={self.aggregate!r}, top_k={self.top_k}, max_window_chars={self.max_window_chars})')
+
+    def spans(self, text):
+        """(start, end) character offsets of the windows of `text` that are scored."""
+        if len(text) < 2 * self.window_words and len(text) <= self.max_window_chars:
+            # n words take at least 2n - 1 characters, so this text has at most window_words words
+            return [(0, len(text))]
+        words = [m.span() for m in WORD_RE.finditer(text)]
+        if len(words) <= self.window_words:
+            return [(0, min(len(text), self.max_window_chars))]
+        starts = list(range(0, len(words) - self.window_words, self.stride)) + [len(words) - self.window_words]
+        if len(starts) > self.max_windows:
+            picked = np.linspace(0, len(starts) - 1, self.max_windows).round().astype(int)
+            starts = [starts[i] for i in np.unique(picked)]
+        spans = []
+        for i in starts:
+            start = words[i][0]
+            end = words[i + self.window_words - 1][1]
+            spans.append((start, min(end, start + self.max_window_chars)))
+        return spans
+
+    def combine(self, probs):
+        """(message probability, index of the most toxic window) for the window probabilities of one message."""
+        best = int(np.argmax(probs))
+        if self.aggregate == 'max' or len(probs) == 1:
+            return float(probs[best]), best
+        k = min(self.top_k, len(probs))
+        return float(np.partition(probs, len(probs) - k)[-k:].mean()), best
+
+
+def add_window_args(parser, default_words=0):
+    parser.add_argument('--window_words', type=int, default=default_words, help='Score messages longer than this many words by sliding windows of this size (0 = score whole messages)')
+    parser.add_argument('--window_stride', type=int, default=None, help='Words between window starts (default: the window size, i.e. no overlap)')
+    parser.add_argument('--max_windows', type=int, default=16, help='Maximum windows scored per message; longer messages are sampled evenly')
+    parser.add_argument('--window_agg', choices=AGGREGATES, default='max', help='Combine window probabilities by their maximum or the mean of the --window_top_k highest')
+    parser.add_argument('--window_top_k', type=int, default=3, help='Windows averaged by --window_agg topk')
+
+
+def window_config(args):
+    """The `WindowConfig` given by `add_window_args` options, or None if windowing is off."""
+    if not args.window_words:
+        return None
+    return WindowConfig(window_words=args.window_words, stride=args.window_stride, max_windows=args.max_windows,
+                        aggregate=args.window_agg, top_k=args.window_top_k)